@@ -1,31 +1,37 @@
-import csv
 import numpy as np
-import matplotlib.pyplot as plt
-import os
+import argparse
 import datetime
 import json
-import math
 import re
 import pandas as pd
+import charts
+import csv_cache
 from jinja2 import Environment, FileSystemLoader, select_autoescape
+from util import list_part_folders, map_jobs
 
 # Template environment
 environment = Environment(loader=FileSystemLoader("."), autoescape=select_autoescape())
 template = environment.get_template("shifter_analysis.htm")
 
-def convert_to_float(c):
-  return float(c) if len(c) > 0 else float('nan')
+# Mean and standard deviation of column for each value of by, over all rows and over just the pulling
+# and just the relaxing ones, from one groupby. Rows of the other direction are NaN in the pulling and
+# relaxing columns, which the statistics skip
+def get_direction_stats(df, by, column):
+  values = pd.DataFrame({
+    by: df[by],
+    "All": df[column],
+    "Pulling": df[column].where(df["Direction"] == 'Pulling'),
+    "Relaxing": df[column].where(df["Direction"] == 'Relaxing')
+  })
+  groups = values.groupby(by, sort=False)
+  return pd.concat({"mean": groups.mean(), "std": groups.std()}, axis=1).swaplevel(axis=1)
+
+def analyze(dir, info, input_file, out_folder, mostPullIsLowestMeasurement, name):
+  # Each row of the CSV is a column: the set, run, direction and date of each run, then the measurement
+  # at each gear
+  columns = csv_cache.load("shifter", input_file, transposed=True)
+  row_headers = list(columns.keys())
 
-def analyze(input_file, out_folder, mostPullIsLowestMeasurement, name):
-  data = []
-  row_headers = []
-
-  with open(input_file, newline='') as csvfile: 
-    reader = csv.reader(csvfile)
-    for row in reader:
-      data.append(row)
-      row_headers.append(row[0])
-  
   # Find where measurements start
   gear_headers = [(i, h, m[1]) for i, h, m in 
     [(i,h,re.match(r'^(\d{1,2}).*', h)) for i,h in enumerate(row_headers)]
@@ -34,123 +40,121 @@ def analyze(input_file, out_folder, mostPullIsLowestMeasurement, name):
   first_gear_row_index = min([i for i,_,_ in gear_headers])
   last_gear_row_index = max([i for i,_,_ in gear_headers])
 
-  # Create DataFrame
-  d = [dict([(row_header, data[row_index][col_index])
-             for row_index,row_header in enumerate(row_headers[0:first_gear_row_index])]
-             + [('Gear', int(re.match(r'^(\d{1,2}).*', data[gear_row_index][0])[1])),
-                ('Gear Label', data[gear_row_index][0]),
-                ('Measurement', convert_to_float(data[gear_row_index][col_index])
-                 * (-1 if mostPullIsLowestMeasurement else 1))
-                ])
-       for col_index in range(1, len(data[0]))
-       for gear_row_index in range(first_gear_row_index, last_gear_row_index + 1)]
-  df = pd.DataFrame(d)
+  run_headers = row_headers[:first_gear_row_index]
+  gear_labels = row_headers[first_gear_row_index:last_gear_row_index + 1]
+  gears = [int(re.match(r'^(\d{1,2}).*', h)[1]) for h in gear_labels]
 
-  sets = sorted(list(set(df["Set"])))
+  # Create DataFrame, with a row per run and gear, run by run
+  measurements = np.array([columns[h] for h in gear_labels]) * (-1 if mostPullIsLowestMeasurement else 1)
+  run_count = measurements.shape[1]
 
-  # Get set averages and normalize data
-  set_gear_data = df.groupby(["Set", "Gear"])["Measurement"]
-  set_gear_averages = set_gear_data.mean()
+  df = pd.DataFrame({
+    **dict((h, np.repeat(columns[h], len(gears))) for h in run_headers),
+    "Gear": np.tile(gears, run_count),
+    "Gear Label": np.tile(gear_labels, run_count),
+    "Measurement": measurements.T.ravel()
+  })
 
-  set_gear_average_diffs = [(set, set_gear_averages[set] - set_gear_averages[sets[0]])
-                            for set in sets[1:]]
+  # Get set averages and normalize data. Each set is moved by how far its gear averages are from the
+  # first set's, on average
+  set_gear_averages = df.groupby(["Set", "Gear"])["Measurement"].mean().unstack("Gear")
+  set_average_diffs = pd.Series([0] + [(set_gear_averages.loc[set] - set_gear_averages.iloc[0]).mean()
+                                       for set in set_gear_averages.index[1:]],
+                                index=set_gear_averages.index, name="SetAverageDiff")
 
-  set_average_diffs = dict([(sets[0], 0)] + [(set, d.mean()) for set, d in set_gear_average_diffs])
-
-  normalized_measurements = df.apply(lambda row: row["Measurement"] - set_average_diffs[row["Set"]], axis=1)
+  df = df.merge(set_average_diffs, left_on="Set", right_index=True, how="left")
+  normalized_measurements = df["Measurement"] - df["SetAverageDiff"]
 
   # Normalized data starts at zero pull at the smallest cog and gets bigger
   # "Measurement" corresponds to the indicator value, which starts high and gets lower with more pull
   df["NormalizedMeasurement"] = normalized_measurements.max() - normalized_measurements
 
+  # Calculate shift amounts by calculating differences between subsequent positions
+  # Use MeasurementData to ensure that we wouldn't be affected by problems from normalization
+  # Besides, here we only care about differences, not absolute values
+  runs = df.groupby(["Run"], sort=False)
+  shifts_df = pd.DataFrame({
+    "RunOrder": runs.ngroup(),
+    "Direction": df["Direction"],
+    "GearStep": runs["Gear"].shift(-1).astype("Int64").astype(str) + "-" + df["Gear"].astype(str),
+    "Shift": runs["Measurement"].diff(-1)
+  })[runs.cumcount(ascending=False) > 0].sort_values("RunOrder", kind="stable")
+
+  gear_stats = get_direction_stats(df, "Gear", "NormalizedMeasurement")
+  shift_stats = get_direction_stats(shifts_df, "GearStep", "Shift")
 
   # Plot Averages
 
-  gear_averages = df.groupby(["Gear"], sort=False)["NormalizedMeasurement"].mean().rename("Average")
-  pulling_gear_averages = df[df["Direction"] == 'Pulling'].groupby(["Gear"], sort=False)["NormalizedMeasurement"].mean().rename("Average Pulling")
-  relaxing_gear_averages = df[df["Direction"] == 'Relaxing'].groupby(["Gear"], sort=False)["NormalizedMeasurement"].mean().rename("Average Relaxing")
+  gear_averages = gear_stats[("All", "mean")].rename("Average")
+  pulling_gear_averages = gear_stats[("Pulling", "mean")].rename("Average Pulling")
+  relaxing_gear_averages = gear_stats[("Relaxing", "mean")].rename("Average Relaxing")
 
   avgs = pd.DataFrame([gear_averages, pulling_gear_averages, relaxing_gear_averages]).T
   
-  absolute_ticks, absolute_labels = zip(*enumerate(df.groupby(["Gear Label"], sort=False).groups.keys()))
+  absolute_ticks, absolute_labels = zip(*enumerate(gear_labels))
 
-  avgs.plot.bar()
+  chart = charts.Chart(f"{out_folder}/meas_avgs.png")
+  chart.plot_bar(avgs)
   for i,a in enumerate(gear_averages):
-    plt.text(i, a + 0.2, round(a, 2), ha="center")
-  plt.ylim(bottom=-1)
-  plt.xticks(ticks=absolute_ticks, labels=absolute_labels)
-  plt.tight_layout()
-  plt.ylabel("Cable Pull (mm)")
+    chart.text(i, a + 0.2, round(a, 2), ha="center")
+  chart.ylim(bottom=-1)
+  chart.xticks(ticks=absolute_ticks, labels=absolute_labels)
+  chart.tight_layout()
+  chart.ylabel("Cable Pull (mm)")
   if info["side"] == "left":
-    plt.xlabel("Position")
-  plt.savefig(f"{out_folder}/meas_avgs.png")
-  plt.close()
+    chart.xlabel("Position")
+  chart.save()
 
   # Plot Stdev
 
-  gear_stdev = df.groupby(["Gear"], sort=False)["NormalizedMeasurement"].std().rename("Std Dev")
-  pulling_gear_stdev = df[df["Direction"] == 'Pulling'].groupby(["Gear"], sort=False)["NormalizedMeasurement"].std().rename("Std Dev Pulling")
-  relaxing_gear_stdev = df[df["Direction"] == 'Relaxing'].groupby(["Gear"], sort=False)["NormalizedMeasurement"].std().rename("Std Dev Relaxing")
+  gear_stdev = gear_stats[("All", "std")].rename("Std Dev")
+  pulling_gear_stdev = gear_stats[("Pulling", "std")].rename("Std Dev Pulling")
+  relaxing_gear_stdev = gear_stats[("Relaxing", "std")].rename("Std Dev Relaxing")
 
   avgs = pd.DataFrame([gear_stdev, pulling_gear_stdev, relaxing_gear_stdev]).T
 
-  avgs.plot.bar()
-  plt.xticks(ticks=absolute_ticks, labels=absolute_labels)
+  chart = charts.Chart(f"{out_folder}/meas_stdev.png")
+  chart.plot_bar(avgs)
+  chart.xticks(ticks=absolute_ticks, labels=absolute_labels)
   if info["side"] == "left":
-    plt.xlabel("Position")
-  plt.tight_layout()
-  plt.savefig(f"{out_folder}/meas_stdev.png")
-  plt.close()
+    chart.xlabel("Position")
+  chart.tight_layout()
+  chart.save()
 
   # Diff between relaxing and pulling averages
   relaxing_pulling_diffs = pulling_gear_averages - relaxing_gear_averages
 
-  relaxing_pulling_diffs.plot.bar()
-  plt.xticks(ticks=absolute_ticks, labels=absolute_labels)
+  chart = charts.Chart(f"{out_folder}/meas_diffs.png")
+  chart.plot_bar(relaxing_pulling_diffs)
+  chart.xticks(ticks=absolute_ticks, labels=absolute_labels)
   if info["side"] == "left":
-    plt.xlabel("Position")
-  plt.tight_layout()
-  plt.savefig(f"{out_folder}/meas_diffs.png")
-  plt.close()
-
-  # Calculate shift amounts by calculating differences between subsequent positions
-  # Use MeasurementData to ensure that we wouldn't be affected by problems from normalization
-  # Besides, here we only care about differences, not absolute values
-  md = df.groupby(["Run"], sort=False)
-
-  shifts_df = md.apply(lambda d: pd.DataFrame(dict(
-    [(header, d[header].iloc[:-1])
-     for header in row_headers[:first_gear_row_index]
-     if header != "Run"]+
-    [
-      ("GearStep", [f"{d["Gear"].iloc[i+1]}-{d["Gear"].iloc[i]}" for i in range(d.shape[0] - 1)]),
-      ("Shift", d["Measurement"].iloc[:-1].to_numpy()-d["Measurement"].iloc[1:].to_numpy())
-    ])), include_groups=False).reset_index()
-
+    chart.xlabel("Position")
+  chart.tight_layout()
+  chart.save()
 
   # Plot Shift Averages
 
-  shift_averages = shifts_df.groupby(["GearStep"], sort=False)["Shift"].mean()
-  pulling_shift_averages = shifts_df[shifts_df["Direction"] == 'Pulling'].groupby(["GearStep"], sort=False)["Shift"].mean().rename("Average Pulling")
-  relaxing_shift_averages = shifts_df[shifts_df["Direction"] == 'Relaxing'].groupby(["GearStep"], sort=False)["Shift"].mean().rename("Average Relaxing")
+  shift_averages = shift_stats[("All", "mean")].rename("Shift")
+  pulling_shift_averages = shift_stats[("Pulling", "mean")].rename("Average Pulling")
+  relaxing_shift_averages = shift_stats[("Relaxing", "mean")].rename("Average Relaxing")
 
   shift_avgs_df = pd.DataFrame([shift_averages, pulling_shift_averages, relaxing_shift_averages]).T
 
-  diff_ticks, diff_labels = zip(*enumerate(shifts_df.groupby(["GearStep"], sort=False).groups.keys()))
+  diff_ticks, diff_labels = zip(*enumerate(shift_stats.index))
   diff_labels = list(diff_labels)
   diff_labels[0] = diff_labels[0] + "\n(least pull)"
   diff_labels[-1] = diff_labels[-1] + "\n(most pull)"
 
-  shift_avgs_df.plot.bar()
-  plt.xticks(diff_ticks, diff_labels)
+  chart = charts.Chart(f"{out_folder}/shift_avgs.png")
+  chart.plot_bar(shift_avgs_df)
+  chart.xticks(diff_ticks, diff_labels)
   if info["side"] == "right":
-    plt.xlabel("Shift")
+    chart.xlabel("Shift")
   else:
-    plt.xlabel("Position Change")
-  plt.ylabel("Cable Pull (mm)")
-  plt.tight_layout()
-  plt.savefig(f"{out_folder}/shift_avgs.png")
-  plt.close()
+    chart.xlabel("Position Change")
+  chart.ylabel("Cable Pull (mm)")
+  chart.tight_layout()
+  chart.save()
 
   # Cable Pull chart
 
@@ -162,72 +166,62 @@ def analyze(input_file, out_folder, mostPullIsLowestMeasurement, name):
     raise Exception(info["side"])
     
 
-  shift_averages.plot.bar()
-  plt.xticks(diff_ticks, diff_labels, ha='right')
+  chart = charts.Chart(f"{out_folder}/cable_pull.png")
+  chart.plot_bar(shift_averages)
+  chart.xticks(diff_ticks, diff_labels, ha='right')
   if info["side"] == "right":
-    plt.xlabel("Shift")
+    chart.xlabel("Shift")
   else:
-    plt.xlabel("Position Change")
-  plt.ylabel("Cable Pull (mm)")
+    chart.xlabel("Position Change")
+  chart.ylabel("Cable Pull (mm)")
   if info["side"] == "right":
-    plt.plot([None] + [cable_pull] * (len(diff_labels)-2) + [None], color='tab:orange')
-    plt.annotate(f"Average Cable Pull: {round(cable_pull, 2)} mm",
+    chart.plot([None] + [cable_pull] * (len(diff_labels)-2) + [None], color='tab:orange')
+    chart.annotate(f"Average Cable Pull: {round(cable_pull, 2)} mm",
                 (round(len(diff_labels) / 2), cable_pull),
                 xytext=(-72, 30), textcoords="offset points",
                 arrowprops={"facecolor": "black", "shrink": 0.1, "headwidth": 6, "headlength": 6, "width": 2})
-  plt.title(f"{name} Cable Pull")
-  plt.tight_layout()
-  plt.savefig(f"{out_folder}/cable_pull.png", dpi=300)
-  plt.close()
+  chart.title(f"{name} Cable Pull")
+  chart.tight_layout()
+  chart.save(dpi=300)
 
   # Plot Shift Std Dev
 
-  shift_stdev = shifts_df.groupby(["GearStep"], sort=False)["Shift"].std()
-  pulling_shift_stdev = shifts_df[shifts_df["Direction"] == 'Pulling'].groupby(["GearStep"], sort=False)["Shift"].std().rename("Average Pulling")
-  relaxing_shift_stdev = shifts_df[shifts_df["Direction"] == 'Relaxing'].groupby(["GearStep"], sort=False)["Shift"].std().rename("Average Relaxing")
+  shift_stdev = shift_stats[("All", "std")].rename("Shift")
+  pulling_shift_stdev = shift_stats[("Pulling", "std")].rename("Average Pulling")
+  relaxing_shift_stdev = shift_stats[("Relaxing", "std")].rename("Average Relaxing")
 
   shift_stdevs_df = pd.DataFrame([shift_stdev, pulling_shift_stdev, relaxing_shift_stdev]).T
 
-  plt.clf()
-  shift_stdevs_df.plot.bar()
-  plt.xticks(diff_ticks, diff_labels)
+  chart = charts.Chart(f"{out_folder}/shift_stdev.png")
+  chart.plot_bar(shift_stdevs_df)
+  chart.xticks(diff_ticks, diff_labels)
   if info["side"] == "right":
-    plt.xlabel("Shift")
+    chart.xlabel("Shift")
   else:
-    plt.xlabel("Position Change")
-  plt.tight_layout()
-  plt.savefig(f"{out_folder}/shift_stdev.png")
-  plt.close()
+    chart.xlabel("Position Change")
+  chart.tight_layout()
+  chart.save()
 
   # Plot Shift Differences
 
   shift_relaxing_pulling_diffs = pulling_shift_averages - relaxing_shift_averages
 
-  shift_relaxing_pulling_diffs.plot.bar()
-  plt.savefig(f"{out_folder}/shift_diffs.png")
-  plt.close()
+  chart = charts.Chart(f"{out_folder}/shift_diffs.png")
+  chart.plot_bar(shift_relaxing_pulling_diffs)
+  chart.save()
 
 
+  # Shifts measured less than twice have no spread
   return {
     "shiftSpacings": shift_averages.to_list(),
+    "shiftSpacingStdevs": shift_stdev.fillna(0).to_list(),
     "cablePull": cable_pull,
     "analysisUrl": f"https://boothinator.github.io/derailleur-analysis/shifters/{dir}/default.htm"
   }
   
 
   
-all_info = []
-
-for dir in os.listdir('shifters'):
-  if dir == "template":
-    continue
-  
-  #FIXME:TESTING
-  #if dir != "Shimano Ultegra ST-RS685-L":
-  #  continue
-  #if dir != "Microshift Advent X":
-  #  continue
-
+def process_shifter(dir):
   with open(f"shifters/{dir}/info.json") as info_file:
     info = json.load(info_file)
   
@@ -241,7 +235,7 @@ for dir in os.listdir('shifters'):
   else:
     name = f"{info['brand']} {info['name']} {info['speeds']}-by"
   
-  result = analyze(f"shifters/{dir}/measurements.csv", f"shifters/{dir}", mostPullIsLowestMeasurement, name)
+  result = analyze(dir, info, f"shifters/{dir}/measurements.csv", f"shifters/{dir}", mostPullIsLowestMeasurement, name)
 
   print(f"{dir}: {result['cablePull']}")
 
@@ -249,8 +243,6 @@ for dir in os.listdir('shifters'):
     **info,
     **result
   }
-
-  all_info.append(info_out)
   
   with open(f"shifters/{dir}/info_out.json", "w") as info_file:
     json.dump(info_out, info_file, indent=2)
@@ -265,5 +257,37 @@ for dir in os.listdir('shifters'):
   with open(f"shifters/{dir}/default.htm", 'w') as f:
     print(output, file = f)
 
-with open(f"all_shifters.json", "w") as info_file:
-  json.dump(all_info, info_file, indent=2)
\ No newline at end of file
+  return info_out
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("dirs", nargs="*",
+                      help="Shifter folders to analyze, instead of all of them. The rest reuse their info_out.json")
+  parser.add_argument("--jobs", type=int, default=1, help="Number of worker processes to analyze shifters with")
+  charts.add_arguments(parser)
+  args = parser.parse_args()
+
+  all_dirs = list_part_folders('shifters')
+  dirs = [dir for dir in all_dirs if len(args.dirs) == 0 or dir in args.dirs]
+
+  #FIXME:TESTING
+  #dirs = ["Shimano Ultegra ST-RS685-L"]
+  #dirs = ["Microshift Advent X"]
+
+  csv_cache.update("shifter", [f"shifters/{dir}/measurements.csv" for dir in dirs], transposed=True)
+  info_outs = dict(zip(dirs, map_jobs(process_shifter, dirs, jobs=args.jobs,
+                                            initializer=charts.set_mode, initargs=(args.plots,))))
+
+  # Merged in folder order, so all_shifters.json doesn't depend on the job count
+  all_info = []
+
+  for dir in all_dirs:
+    if dir in info_outs:
+      all_info.append(info_outs[dir])
+    else:
+      with open(f"shifters/{dir}/info_out.json") as info_file:
+        all_info.append(json.load(info_file))
+
+  with open(f"all_shifters.json", "w") as info_file:
+    json.dump(all_info, info_file, indent=2)
@@ -1,112 +1,101 @@
-import csv
 import numpy as np
-import matplotlib.pyplot as plt
 import os
+import argparse
 import json
 import math
-from util import convert_to_floats, calc_pull_ratio
+import charts
+import csv_cache
+import batch_fit
+from util import calc_pull_ratio, list_part_folders, map_jobs
 
 extrusion_thickness=19.93
 
 with open("overall_stats.json") as f:
   overall_stats = json.load(f)
 
+# First value of a column that isn't NaN, or NaN
+def get_first_number(column):
+  numbers = column[~np.isnan(column)]
+  return float(numbers[0]) if len(numbers) > 0 else np.nan
+
+# How many values at the start of a boolean array are true
+def get_leading_count(values):
+  return len(values) if values.all() else int(np.argmin(values))
+
+# Indicator offset of each row: the measurement minus the indicator reading after the move, as of the last
+# move before that row, or 0 before the first move. Moves are the rows with an after move reading
+def get_indicator_offsets(meas, after_move):
+  moves = np.where(np.isnan(after_move), -1, np.arange(len(after_move)))
+  last_move = np.maximum.accumulate(moves)[:-1]
+
+  offsets = np.zeros(len(meas))
+  offsets[1:] = np.where(last_move >= 0, (meas - after_move)[last_move], 0)
+  return offsets
+
+# Reads a run and trims its outliers. Returns the run, for fitting and then save_analysis()
 def analyze(info, input_file):
-  
+  print(f"Processing {input_file}")
+
   jockey_wheel_thickness=info["jockeyWheelThickness"]
   carriage_to_jockey_wheel=info["distanceFromCarriageToJockeyWheel"]
   direction = "pulling" if "pulling" in input_file.lower() else "relaxing"
 
-  data = []
-
-  with open(input_file, newline='') as csvfile: 
-    reader = csv.DictReader(csvfile)
-    for row in reader:
-      data.append(row)
+  columns = csv_cache.load("pullratio", input_file)
+  number_of_measurements = len(columns["Carriage Meas. (mm)"])
+  no_measurements = np.full(number_of_measurements, np.nan)
 
-  convert_to_floats(data)
-    
   # Get run values
-  extrusion_to_carriage_slack = ([d["Distance from outside of extrusion to carriage when cable is slack (mm)"] for d in data
-                                 if not np.isnan(d["Distance from outside of extrusion to carriage when cable is slack (mm)"])] or [np.nan])[0]
-  extrusion_to_carriage_max_pull = ([d["Distance from outside of extrusion to carriage at max pull (mm)"] for d in data
-                                 if not np.isnan(d["Distance from outside of extrusion to carriage at max pull (mm)"])] or [np.nan])[0]
+  extrusion_to_carriage_slack = get_first_number(columns["Distance from outside of extrusion to carriage when cable is slack (mm)"])
+  extrusion_to_carriage_max_pull = get_first_number(columns["Distance from outside of extrusion to carriage at max pull (mm)"])
 
   jockey_wheel_center_at_full_slack=extrusion_to_carriage_slack - carriage_to_jockey_wheel - extrusion_thickness - jockey_wheel_thickness/2
 
 
   # Calculate additional columns
 
+  # Negate values if needed
+  if "Puller Meas. (mm)" in columns:
+    puller_meas = -columns["Puller Meas. (mm)"]
+  else:
+    puller_meas = columns.get("Puller Meas. (neg) (mm)", no_measurements)
+
+  if "Puller Indicator After Move (mm)" in columns:
+    puller_indicator_after_move = -columns["Puller Indicator After Move (mm)"]
+  else:
+    puller_indicator_after_move = columns.get("Puller Indicator After Move (neg) (mm)", no_measurements)
+
+  carriage_meas = columns["Carriage Meas. (mm)"]
+  carriage_indicator_after_move = columns["Carriage Indicator After Move (mm)"]
+
   # I didn't used to record the exact puller location. If there's no puller data,
   # calculate it as the row number / 3
-  calculate_puller_meas = len([1 for row in data
-                               if (
-                                    "Puller Meas. (neg) (mm)" in row
-                                    and not np.isnan(row["Puller Meas. (neg) (mm)"])
-                                  )
-                                  or 
-                                  (
-                                    "Puller Meas. (mm)" in row
-                                    and not np.isnan(row["Puller Meas. (mm)"]))
-                                  ]) == 0
-
-  prev_row = {
-    "Puller Indicator After Move (neg) (mm)": np.nan,
-    "Puller Meas. (neg) (mm)": 0,
-    "Puller Indicator Offset (mm)": 0,
-    "Carriage Indicator After Move (mm)": np.nan,
-    "Carriage Meas. (mm)": 0,
-    "Carriage Indicator Offset (mm)": 0
-  }
-  for i, row in enumerate(data):
-    # Negate values if needed
-    if "Puller Meas. (mm)" in row:
-      row["Puller Meas. (neg) (mm)"] = -row["Puller Meas. (mm)"]
-    
-    if "Puller Indicator After Move (mm)" in row:
-      row["Puller Indicator After Move (neg) (mm)"] = -row["Puller Indicator After Move (mm)"]
-
-    if np.isnan(prev_row["Puller Indicator After Move (neg) (mm)"]):
-      row["Puller Indicator Offset (mm)"] = prev_row["Puller Indicator Offset (mm)"]
-    else:    
-      row["Puller Indicator Offset (mm)"] = prev_row["Puller Meas. (neg) (mm)"] \
-                                            - prev_row["Puller Indicator After Move (neg) (mm)"]
-    
-    if np.isnan(prev_row["Carriage Indicator After Move (mm)"]):
-      row["Carriage Indicator Offset (mm)"] = prev_row["Carriage Indicator Offset (mm)"]
-    else:
-      row["Carriage Indicator Offset (mm)"] = prev_row["Carriage Meas. (mm)"]\
-                                              - prev_row["Carriage Indicator After Move (mm)"]
-    
-    if calculate_puller_meas:
-      # Pulling
-      if direction == "pulling":
-        row["Cable Pull (mm)"] = i / 3
-      else:
-        # Relaxing
-        row["Cable Pull (mm)"] = -i / 3
+  calculate_puller_meas = np.isnan(puller_meas).all()
+
+  if calculate_puller_meas:
+    # Pulling
+    if direction == "pulling":
+      cable_pull = np.arange(number_of_measurements) / 3
     else:
-      row["Cable Pull (mm)"] = row["Puller Meas. (neg) (mm)"] + row["Puller Indicator Offset (mm)"]
-    row["Jockey Position (mm)"] = row["Carriage Meas. (mm)"] + row["Carriage Indicator Offset (mm)"] \
-                                  + jockey_wheel_center_at_full_slack
-    
-    prev_row = row
+      # Relaxing
+      cable_pull = -np.arange(number_of_measurements) / 3
+  else:
+    cable_pull = puller_meas + get_indicator_offsets(puller_meas, puller_indicator_after_move)
+  jockey_position = carriage_meas + get_indicator_offsets(carriage_meas, carriage_indicator_after_move) \
+                    + jockey_wheel_center_at_full_slack
 
-  data_sorted = sorted(data, key=lambda row: row["Cable Pull (mm)"])
-  
-  cable_pull_meas = [d["Cable Pull (mm)"] for d in data_sorted]
-  jockey_position_meas = [d["Jockey Position (mm)"] for d in data_sorted]
+  order = np.argsort(cable_pull, kind="stable")
+  cable_pull_meas = cable_pull[order]
+  jockey_position_meas = jockey_position[order]
   
-  plt.clf()
-  plt.plot(cable_pull_meas,jockey_position_meas)
-  plt.xlim([cable_pull_meas[0]-1, cable_pull_meas[-1] + 1 ])
   graph_file = input_file.replace('.csv', '_meas.png')
-  plt.savefig(graph_file)
-  plt.close()
+  chart = charts.Chart(graph_file)
+  chart.plot(cable_pull_meas,jockey_position_meas)
+  chart.xlim([cable_pull_meas[0]-1, cable_pull_meas[-1] + 1 ])
+  chart.save()
 
   # Double check jockey position range
   jockey_caliper_meas_range = extrusion_to_carriage_max_pull - extrusion_to_carriage_slack
-  jockey_indicator_meas_range = max(jockey_position_meas) - min(jockey_position_meas)
+  jockey_indicator_meas_range = jockey_position_meas.max() - jockey_position_meas.min()
   if math.isnan(jockey_caliper_meas_range):
     meas_method_percent_diff = math.nan
   else:
@@ -116,8 +105,8 @@ def analyze(info, input_file):
       print(f"Warning: Caliper vs Indicator range mismatch: {meas_method_percent_diff}. caliper range: {jockey_caliper_meas_range}, indicator range: {jockey_indicator_meas_range}")
 
   # Get cable pull and jockey position data
-  cable_pull_raw = cable_pull = np.array([d["Cable Pull (mm)"] for d in data_sorted])
-  jockey_position = np.array([d["Jockey Position (mm)"] for d in data_sorted])
+  cable_pull_raw = cable_pull = cable_pull_meas
+  jockey_position = jockey_position_meas
 
   jockey_position_raw = jockey_position = jockey_position - jockey_position.min() + jockey_wheel_center_at_full_slack
 
@@ -126,34 +115,28 @@ def analyze(info, input_file):
 
   average_jockey_position_diff = np.mean(jockey_position_diffs)
 
-  # Find end of low outliers
+  # Find end of low outliers: the last of the diffs at the start that are below the cutoff
   low_outlier_cutoff = average_jockey_position_diff * 0.8
 
-  low_cutoff_index = 0
-
-  for (i,d) in enumerate(jockey_position_diffs):
-    if d < low_outlier_cutoff:
-      low_cutoff_index = i
-    else:
-      break
+  low_diffs = get_leading_count(jockey_position_diffs < low_outlier_cutoff)
+  low_cutoff_index = max(low_diffs - 1, 0)
 
   # Find end of high outliers
   high_outlier_cutoff = average_jockey_position_diff * 0.6
 
-  if "Exclude Cable Pull Greater Than (mm)" in data[0] \
-        and not np.isnan(data[0]["Exclude Cable Pull Greater Than (mm)"]):
-    exclude_cable_pull_greater_than = data[0]["Exclude Cable Pull Greater Than (mm)"] \
+  if "Exclude Cable Pull Greater Than (mm)" in columns \
+        and not np.isnan(columns["Exclude Cable Pull Greater Than (mm)"][0]):
+    exclude_cable_pull_greater_than = columns["Exclude Cable Pull Greater Than (mm)"][0] \
                                         + cable_pull[low_cutoff_index]
-    high_cutoff_index = low_cutoff_index + np.min([i for i,p in enumerate(cable_pull[low_cutoff_index:])
-                                if p > exclude_cable_pull_greater_than])
+    high_cutoff_index = low_cutoff_index + np.min(np.flatnonzero(cable_pull[low_cutoff_index:]
+                                                                 > exclude_cable_pull_greater_than))
   else:
-    high_cutoff_index = len(jockey_position)
-
-    for (i,d) in reversed([e for e in enumerate(jockey_position_diffs)]):
-      if d < high_outlier_cutoff:
-        high_cutoff_index = i + 2
-      else:
-        break
+    # Keep the first of the diffs at the end that are below the cutoff
+    high_diffs = get_leading_count((jockey_position_diffs < high_outlier_cutoff)[::-1])
+    if high_diffs == 0:
+      high_cutoff_index = len(jockey_position)
+    else:
+      high_cutoff_index = len(jockey_position_diffs) - high_diffs + 2
 
   cable_pull = cable_pull[low_cutoff_index:high_cutoff_index]
   jockey_position = jockey_position[low_cutoff_index:high_cutoff_index]
@@ -162,58 +145,95 @@ def analyze(info, input_file):
   cable_pull_raw = cable_pull_raw - cable_pull.min()
   cable_pull = cable_pull - cable_pull.min()
 
-  result = np.polynomial.Polynomial.fit(cable_pull, jockey_position, 3)
-  x_new = np.linspace(cable_pull[0], cable_pull[-1], 50)
-  y_new = result(x_new)
+  return {
+    "info": info,
+    "input_file": input_file,
+    "cable_pull": cable_pull,
+    "jockey_position": jockey_position,
+    "cable_pull_raw": cable_pull_raw,
+    "jockey_position_raw": jockey_position_raw,
+    "extrusion_to_carriage_slack": extrusion_to_carriage_slack,
+    "extrusion_to_carriage_max_pull": extrusion_to_carriage_max_pull,
+    "direction": direction,
+    "number_of_measurements": number_of_measurements,
+    "meas_method_percent_diff": meas_method_percent_diff
+  }
 
-  coef = [x for x in result.convert().coef]
+# Saves the pull ratio and chart of a run from analyze(), with the fit of its jockey position to its
+# cable pull
+def save_analysis(run, fit):
+  cable_pull = run["cable_pull"]
+  cable_pull_raw = run["cable_pull_raw"]
   max_pull = cable_pull_raw.max()
 
-  pull_ratio_calc = calc_pull_ratio(info, coef, max_pull)
+  curve = np.polynomial.Polynomial(fit["coef"])
+  x_new = np.linspace(cable_pull[0], cable_pull[-1], 50)
+  y_new = curve(x_new)
+
+  pull_ratio_calc = calc_pull_ratio(run["info"], fit["coef"], max_pull)
 
   result_info = {
-    "coef": coef,
-    "extrusion_to_carriage_slack": extrusion_to_carriage_slack,
-    "extrusion_to_carriage_max_pull": extrusion_to_carriage_max_pull,
+    "coef": fit["coef"],
+    "extrusion_to_carriage_slack": run["extrusion_to_carriage_slack"],
+    "extrusion_to_carriage_max_pull": run["extrusion_to_carriage_max_pull"],
     "max_pull": max_pull,
-    "direction": direction,
+    "direction": run["direction"],
     "pull_ratio": pull_ratio_calc.pull_ratio,
     "pull_ratio_calc": pull_ratio_calc.model_dump(),
-    "number_of_measurements": len(data),
-    "meas_method_percent_diff": meas_method_percent_diff,
-    
+    "number_of_measurements": run["number_of_measurements"],
+    "meas_method_percent_diff": run["meas_method_percent_diff"],
+    "fit_rms_error": fit["rms_error"],
+    "fit_max_residual": fit["max_residual"],
+    "fit_condition_number": fit["condition_number"]
   }
 
-  plt.clf()
-  plt.plot(cable_pull_raw,jockey_position_raw,'o', x_new, y_new)
-  plt.xlim([cable_pull_raw[0]-1, cable_pull_raw[-1] + 1 ])
+  graph_file = run["input_file"].replace('.csv', '.png')
 
-  graph_file = input_file.replace('.csv', '.png')
+  chart = charts.Chart(graph_file)
+  chart.plot(cable_pull_raw,run["jockey_position_raw"],'o', x_new, y_new)
+  chart.xlim([cable_pull_raw[0]-1, cable_pull_raw[-1] + 1 ])
+  chart.save()
 
-  plt.savefig(graph_file)
-  plt.close()
-
-  with open(input_file.replace('.csv', '.json'), "w") as infofile:
+  with open(run["input_file"].replace('.csv', '.json'), "w") as infofile:
     json.dump(result_info, infofile, indent=2)
 
 
 
-for dir in os.listdir('derailleurs'):
-  if dir == "template":
-    continue
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("dirs", nargs="*", help="Derailleur folders to process, instead of all of them")
+  parser.add_argument("--jobs", type=int, default=1, help="Number of worker processes to analyze runs with")
+  charts.add_arguments(parser)
+  args = parser.parse_args()
+
+  # Every run's CSV, so the runs of one derailleur can be spread across workers too
+  infos = []
+  input_files = []
+
+  for dir in args.dirs or list_part_folders('derailleurs'):
+    if dir == "template":
+      continue
+
+    # TESTING
+    #if dir != "Shimano Deore M6100":
+    #  continue
+    #if dir != "Campagnolo Ekar":
+    #  continue
+
+    print(dir)
+
+    with open(f"derailleurs/{dir}/info.json") as info_file:
+      info = json.load(info_file)
 
-  # TESTING
-  #if dir != "Shimano Deore M6100":
-  #  continue
-  #if dir != "Campagnolo Ekar":
-  #  continue
+    for datafile in sorted(os.listdir(f"derailleurs/{dir}/pullratio")):
+      if datafile.endswith('.csv'):
+        infos.append(info)
+        input_files.append(f"derailleurs/{dir}/pullratio/{datafile}")
 
-  print(dir)
+  csv_cache.update("pullratio", input_files)
+  runs = map_jobs(analyze, infos, input_files, jobs=args.jobs, initializer=charts.set_mode, initargs=(args.plots,))
 
-  with open(f"derailleurs/{dir}/info.json") as info_file:
-    info = json.load(info_file)
+  # Every run is fitted at once
+  fits = batch_fit.fit_polynomials([run["cable_pull"] for run in runs], [run["jockey_position"] for run in runs], 3)
 
-  for datafile in os.listdir(f"derailleurs/{dir}/pullratio"):
-    if datafile.endswith('.csv'):
-      print(f"Processing {datafile}")
-      analyze(info, f"derailleurs/{dir}/pullratio/{datafile}")
+  map_jobs(save_analysis, runs, fits, jobs=args.jobs, initializer=charts.set_mode, initargs=(args.plots,))
@@ -1,49 +1,73 @@
-import csv
 import numpy as np
-import matplotlib.pyplot as plt
 import os
+import argparse
 import json
 import math
-from util import convert_to_floats
+import charts
+import csv_cache
+import batch_fit
+from util import list_part_folders, map_jobs
 from typing import Iterable
 
-def analyze_yaw(input_file):
+# Rows marked as outliers. Only text counts as a mark, a number or an empty cell doesn't
+def get_outliers(column):
+  if column.dtype.kind == "f":
+    return np.zeros(len(column), dtype=bool)
+  return np.array([len(v) > 0 and not is_number(v) for v in column], dtype=bool)
 
-  with open(input_file, newline='') as csvfile: 
-    reader = csv.DictReader(csvfile)
-    data = [*reader]
+def is_number(value):
+  try:
+    float(value)
+    return True
+  except ValueError:
+    return False
 
-  convert_to_floats(data)
+# Reads a run and removes its outliers. Returns the run, for fitting and then save_yaw_analysis()
+def analyze_yaw(input_file):
+  print(f"Processing {input_file}")
 
-  # Remove outliers
-  data = [row for row in data if not isinstance(row["Is Outlier"], str)]
+  columns = csv_cache.load("yaw", input_file)
 
-  for row in data:
-    if math.isnan(row["Cable Pull (mm)"]):
-      row["Cable Pull (mm)"] = row["180 Deg. Turns"]
+  # Remove outliers
+  kept = ~get_outliers(columns["Is Outlier"])
+  turns = columns["180 Deg. Turns"][kept]
+  measured_cable_pull = columns["Cable Pull (mm)"][kept]
+
+  cable_pull_values = np.where(np.isnan(measured_cable_pull), turns, measured_cable_pull)
+  cable_pull = cable_pull_values - cable_pull_values[0]
+  yaw_angle = columns["Measurement (deg)"][kept]
+
+  return {
+    "input_file": input_file,
+    "cable_pull": cable_pull,
+    "yaw_angle": yaw_angle
+  }
 
-  cable_pull = [row["Cable Pull (mm)"] - data[0]["Cable Pull (mm)"] for row in data]
-  yaw_angle = [row["Measurement (deg)"] for row in data]
+# Saves the chart and fit of a run from analyze_yaw()
+def save_yaw_analysis(run, fit):
+  cable_pull = run["cable_pull"]
+  yaw_angle = run["yaw_angle"]
 
-  result = np.polynomial.Polynomial.fit(cable_pull, yaw_angle, 2)
+  curve = np.polynomial.Polynomial(fit["coef"])
   x_new = np.linspace(cable_pull[0], cable_pull[-1], 50)
-  y_new = result(x_new)
+  y_new = curve(x_new)
 
   result_info = {
-    "coef": [x for x in result.convert().coef],
-    "number_of_measurements": len(data)
+    "coef": fit["coef"],
+    "number_of_measurements": len(yaw_angle),
+    "fit_rms_error": fit["rms_error"],
+    "fit_max_residual": fit["max_residual"],
+    "fit_condition_number": fit["condition_number"]
   }
 
-  plt.clf()
-  plt.plot(cable_pull,yaw_angle,'o', x_new, y_new)
-  plt.xlim([cable_pull[0]-1, cable_pull[-1] + 1 ])
+  graph_file = run["input_file"].replace('.csv', '.png')
 
-  graph_file = input_file.replace('.csv', '.png')
+  chart = charts.Chart(graph_file)
+  chart.plot(cable_pull,yaw_angle,'o', x_new, y_new)
+  chart.xlim([cable_pull[0]-1, cable_pull[-1] + 1 ])
+  chart.save()
 
-  plt.savefig(graph_file)
-  plt.close()
-
-  with open(input_file.replace('.csv', '.json'), "w") as infofile:
+  with open(run["input_file"].replace('.csv', '.json'), "w") as infofile:
     json.dump(result_info, infofile, indent=2)
 
 def get_jockey_offset_curve(yaw_angle_curve):
@@ -68,21 +92,36 @@ def get_jockey_offset_curve(yaw_angle_curve):
 
   return yaw_offset_curve
 
-for dir in os.listdir('derailleurs'):
-  if dir == "template":
-    continue
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("dirs", nargs="*", help="Derailleur folders to process, instead of all of them")
+  parser.add_argument("--jobs", type=int, default=1, help="Number of worker processes to analyze runs with")
+  charts.add_arguments(parser)
+  args = parser.parse_args()
+
+  input_files = []
+
+  for dir in args.dirs or list_part_folders('derailleurs'):
+    if dir == "template":
+      continue
+
+    # TESTING
+    #if dir != "Shimano Deore M6100":
+    #  continue
+    #if dir != "Campagnolo Ekar":
+    #  continue
+
+    print(dir)
 
-  # TESTING
-  #if dir != "Shimano Deore M6100":
-  #  continue
-  #if dir != "Campagnolo Ekar":
-  #  continue
+    if os.path.exists(f"derailleurs/{dir}/yaw"):
+      for datafile in sorted(os.listdir(f"derailleurs/{dir}/yaw")):
+        if datafile.endswith('.csv'):
+          input_files.append(f"derailleurs/{dir}/yaw/{datafile}")
 
-  print(dir)
+  csv_cache.update("yaw", input_files)
+  runs = map_jobs(analyze_yaw, input_files, jobs=args.jobs, initializer=charts.set_mode, initargs=(args.plots,))
 
-  if os.path.exists(f"derailleurs/{dir}/yaw"):
-    for datafile in os.listdir(f"derailleurs/{dir}/yaw"):
-      if datafile.endswith('.csv'):
-        print(f"Processing {datafile}")
+  # Every run is fitted at once
+  fits = batch_fit.fit_polynomials([run["cable_pull"] for run in runs], [run["yaw_angle"] for run in runs], 2)
 
-        analyze_yaw(f"derailleurs/{dir}/yaw/{datafile}")
\ No newline at end of file
+  map_jobs(save_yaw_analysis, runs, fits, jobs=args.jobs, initializer=charts.set_mode, initargs=(args.plots,))
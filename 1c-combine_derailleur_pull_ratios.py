@@ -1,11 +1,13 @@
 import numpy as np
-import matplotlib.pyplot as plt
 import os
+import argparse
 import json
 import math
-from util import calc_pull_ratio
+import charts
+from util import calc_pull_ratio, list_part_folders, map_jobs
 
 def process_der(dir):
+  print(dir)
   
   with open(f"derailleurs/{dir}/info.json") as info_file:
     info = json.load(info_file)
@@ -81,14 +83,13 @@ def process_der(dir):
   x_new = np.linspace(0, max_pull, 50)
   y_new = curve(x_new)
   
-  plt.clf()
-  plt.plot(x_new, y_new)
-  plt.xlim([0, max_pull])
-  plt.ylim([0, curve(max_pull) + 10])
-  plt.xlabel("Cable Pull (mm)")
-  plt.ylabel("Guide Pulley Distance From Outside Of Dropout (mm)")
-  plt.savefig(f"derailleurs/{dir}/pull_curve.png")
-  plt.close()
+  chart = charts.Chart(f"derailleurs/{dir}/pull_curve.png")
+  chart.plot(x_new, y_new)
+  chart.xlim([0, max_pull])
+  chart.ylim([0, curve(max_pull) + 10])
+  chart.xlabel("Cable Pull (mm)")
+  chart.ylabel("Guide Pulley Distance From Outside Of Dropout (mm)")
+  chart.save()
   
   pull_ratio_curve = curve.deriv(1)
   pull_ratio_curve_prime = curve.deriv(1)
@@ -101,19 +102,18 @@ def process_der(dir):
   x_cogs = [pr_calc.second_smallest_cog_pull, pr_calc.second_biggest_cog_pull]
   y_cogs = [pr_calc.pull_ratio, pr_calc.pull_ratio]
   
-  plt.clf()
-  plt.plot(x_new, y_new, x_pr, y_pr, x_cogs, y_cogs, "o")
-  plt.xlim([0, max_pull])
-  plt.ylim([0, pr_calc.pull_ratio*1.4])
-  plt.xlabel("Cable Pull (mm)")
-  plt.ylabel("Pull Ratio")
-  plt.title(f"{info['brand']} {info['name']} {info['designSpeeds']}-speed Derailleur Pull Ratio")
+  chart = charts.Chart(f"derailleurs/{dir}/pull_ratio_curve.png")
+  chart.plot(x_new, y_new, x_pr, y_pr, x_cogs, y_cogs, "o")
+  chart.xlim([0, max_pull])
+  chart.ylim([0, pr_calc.pull_ratio*1.4])
+  chart.xlabel("Cable Pull (mm)")
+  chart.ylabel("Pull Ratio")
+  chart.title(f"{info['brand']} {info['name']} {info['designSpeeds']}-speed Derailleur Pull Ratio")
   avg_pull_ratio_annotation_x = np.min([r for r in (pull_ratio_curve_prime - pr_calc.pull_ratio).roots() if r > 0])
-  plt.annotate(f"Avg. Pull Ratio {round(pr_calc.pull_ratio, 2)}",
+  chart.annotate(f"Avg. Pull Ratio {round(pr_calc.pull_ratio, 2)}",
                  (avg_pull_ratio_annotation_x, pr_calc.pull_ratio),
                  xytext=(0, -12), textcoords="offset points")
-  plt.savefig(f"derailleurs/{dir}/pull_ratio_curve.png")
-  plt.close()
+  chart.save()
 
   # Info Output
   info_out = {
@@ -136,16 +136,17 @@ def process_der(dir):
     json.dump(info_out, info_file, indent=2)
 
 
-for dir in os.listdir('derailleurs'):
-  if dir == "template":
-    continue
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("dirs", nargs="*", help="Derailleur folders to process, instead of all of them")
+  parser.add_argument("--jobs", type=int, default=1, help="Number of worker processes to process derailleurs with")
+  charts.add_arguments(parser)
+  args = parser.parse_args()
 
-  # TESTING
-  #if dir != "Shimano Deore M6100":
-  #  continue
-  #if dir != "Campagnolo Ekar":
-  #  continue
+  dirs = [dir for dir in args.dirs or list_part_folders('derailleurs') if dir != "template"]
 
-  print(dir)
+  # TESTING
+  #dirs = ["Shimano Deore M6100"]
+  #dirs = ["Campagnolo Ekar"]
 
-  info_out = process_der(dir)
+  map_jobs(process_der, dirs, jobs=args.jobs, initializer=charts.set_mode, initargs=(args.plots,))
@@ -1,12 +1,14 @@
 
 import numpy as np
-import matplotlib.pyplot as plt
 import os
+import argparse
 import json
+import charts
 
-from util import get_jockey_offset_curve, get_jockey_offset_rate_curve
+from util import get_jockey_offset_curve, get_jockey_offset_rate_curve, list_part_folders, map_jobs
 
 def process_der_yaw(dir):
+  print(dir)
   
   coefs = []
   number_of_measurements = 0
@@ -40,14 +42,13 @@ def process_der_yaw(dir):
   x_new = np.linspace(0, max_pull, 50)
   y_new = curve(x_new)
   
-  plt.clf()
-  plt.plot(x_new, y_new)
-  plt.xlim([0, max_pull])
-  plt.ylim([curve(0) - 1, curve(max_pull) + 1])
-  plt.xlabel("Cable Pull (mm)")
-  plt.ylabel("Guide Pulley Yaw Angle (deg)")
-  plt.savefig(f"derailleurs/{dir}/yaw_curve.png")
-  plt.close()
+  chart = charts.Chart(f"derailleurs/{dir}/yaw_curve.png")
+  chart.plot(x_new, y_new)
+  chart.xlim([0, max_pull])
+  chart.ylim([curve(0) - 1, curve(max_pull) + 1])
+  chart.xlabel("Cable Pull (mm)")
+  chart.ylabel("Guide Pulley Yaw Angle (deg)")
+  chart.save()
 
   info_out = {
     "yawCoefficients": [*avg_coefs],
@@ -58,17 +59,17 @@ def process_der_yaw(dir):
     json.dump(info_out, info_file, indent=2)
 
 
-for dir in os.listdir('derailleurs'):
-  if dir == "template":
-    continue
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("dirs", nargs="*", help="Derailleur folders to process, instead of all of them")
+  parser.add_argument("--jobs", type=int, default=1, help="Number of worker processes to process derailleurs with")
+  charts.add_arguments(parser)
+  args = parser.parse_args()
 
-  # TESTING
-  #if dir != "Shimano Deore M6100":
-  #  continue
-  #if dir != "Campagnolo Ekar":
-  #  continue
+  dirs = [dir for dir in args.dirs or list_part_folders('derailleurs') if dir != "template"]
 
-  print(dir)
-
-  process_der_yaw(dir)
+  # TESTING
+  #dirs = ["Shimano Deore M6100"]
+  #dirs = ["Campagnolo Ekar"]
 
+  map_jobs(process_der_yaw, dirs, jobs=args.jobs, initializer=charts.set_mode, initargs=(args.plots,))
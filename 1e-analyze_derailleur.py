@@ -2,7 +2,9 @@ import numpy as np
 import os
 import json
 import datetime
+import argparse
 from jinja2 import Environment, FileSystemLoader, select_autoescape
+from util import list_part_folders, map_jobs
 
 # Template environment
 environment = Environment(loader=FileSystemLoader("."), autoescape=select_autoescape())
@@ -12,6 +14,7 @@ with open("overall_stats.json") as f:
   overall_stats = json.load(f)
 
 def process_der(dir):
+  print(dir)
   
   with open(f"derailleurs/{dir}/info.json") as info_file:
     info = json.load(info_file)
@@ -75,37 +78,37 @@ def process_der(dir):
   return info_out
 
 
-with open(f"other_derailleurs.json") as f:
-  all_info = json.load(f)
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--jobs", type=int, default=1, help="Number of worker processes to process derailleurs with")
+  args = parser.parse_args()
 
-meas_method_percent_diffs = []
+  with open(f"other_derailleurs.json") as f:
+    all_info = json.load(f)
 
-for dir in os.listdir('derailleurs'):
-  if dir == "template":
-    continue
+  dirs = list_part_folders('derailleurs')
 
   # TESTING
-  #if dir != "Shimano Deore M6100":
-  #  continue
-  #if dir != "Campagnolo Ekar":
-  #  continue
+  #dirs = ["Shimano Deore M6100"]
+  #dirs = ["Campagnolo Ekar"]
 
-  print(dir)
+  meas_method_percent_diffs = []
 
-  info_out = process_der(dir)
-  all_info.append(info_out)
-  meas_method_percent_diffs = meas_method_percent_diffs + info_out["meas_method_percent_diffs"]
+  # Merged in folder order, so all_derailleurs.json and overall_stats.json don't depend on the job count
+  for info_out in map_jobs(process_der, dirs, jobs=args.jobs):
+    all_info.append(info_out)
+    meas_method_percent_diffs = meas_method_percent_diffs + info_out["meas_method_percent_diffs"]
 
 
-avg_meas_method_percent_diff = np.mean(meas_method_percent_diffs)
-stdev_meas_method_percent_diff = np.std(meas_method_percent_diffs)
+  avg_meas_method_percent_diff = np.mean(meas_method_percent_diffs)
+  stdev_meas_method_percent_diff = np.std(meas_method_percent_diffs)
 
-with open("overall_stats.json", "w") as f:
-  json.dump({
-    "avg_meas_method_percent_diff": avg_meas_method_percent_diff,
-    "stdev_meas_method_percent_diff": stdev_meas_method_percent_diff,
-    "Caliper vs Indicator percent difference": f"Caliper vs Indicator percent difference: {avg_meas_method_percent_diff} +/- {stdev_meas_method_percent_diff * 2}"
-  }, f, indent=2)
+  with open("overall_stats.json", "w") as f:
+    json.dump({
+      "avg_meas_method_percent_diff": avg_meas_method_percent_diff,
+      "stdev_meas_method_percent_diff": stdev_meas_method_percent_diff,
+      "Caliper vs Indicator percent difference": f"Caliper vs Indicator percent difference: {avg_meas_method_percent_diff} +/- {stdev_meas_method_percent_diff * 2}"
+    }, f, indent=2)
 
-with open(f"all_derailleurs.json", "w") as info_file:
-  json.dump(all_info, info_file, indent=2)
\ No newline at end of file
+  with open(f"all_derailleurs.json", "w") as info_file:
+    json.dump(all_info, info_file, indent=2)
@@ -2,14 +2,15 @@ import numpy as np
 import matplotlib.pyplot as plt
 import json
 import scipy.stats
+from models import get_shifter_model, get_derailleur_model, get_cassette_model
 from util import calculate_max_chain_angle
 
 with open(f"all_shifters.json") as f:
-  shifters = json.load(f)
+  shifters = [get_shifter_model(s) for s in json.load(f)]
 with open(f"all_derailleurs.json") as f:
-  derailleurs = json.load(f)
+  derailleurs = [get_derailleur_model(d) for d in json.load(f)]
 with open(f"cassettes.json") as f:
-  cassettes = json.load(f)
+  cassettes = [get_cassette_model(c) for c in json.load(f)]
 with open(f"supported_combinations.json") as f:
   supported_combos = json.load(f)
 
@@ -35,6 +36,9 @@ for combo in supported_combos:
   max_chain_angle_results = calculate_max_chain_angle(shifter, derailleur, cassette)
   max_chain_angles.append(max_chain_angle_results["max_chain_angle"])
 
+  if not max_chain_angle_results["barrel_adjuster_converged"]:
+    raise Exception(f"Failed to converge for {combo['name']}")
+
   if max_chain_angle_results["barrel_adjuster_too_low"]:
     raise Exception("Barrel adjuster too low")
   
@@ -1,355 +1,134 @@
-
 import json
-import csv
-from scipy.stats import norm
-from util import calculate_max_chain_angle
-
-with open(f"all_shifters.json") as f:
-  shifters = json.load(f)
-with open(f"equivalent_shifters.json") as f:
-  equivalent_shifters = json.load(f)
-with open(f"all_derailleurs.json") as f:
-  derailleurs = json.load(f)
-with open(f"equivalent_derailleurs.json") as f:
-  equivalent_derailleurs = json.load(f)
-with open(f"cassettes.json") as f:
-  cassettes = json.load(f)
-with open(f"supported_combinations.json") as f:
-  supported_combos = json.load(f)
-with open(f"reviewed_combinations.json") as f:
-  reviewed_combos = json.load(f)
-with open(f"compatibility_ranges.json") as f:
-  compatibility_ranges = json.load(f)
-
-motion_multiplier_avg = compatibility_ranges["motionMultiplierAvg"]
-motion_multiplier_stdev = compatibility_ranges["motionMultiplierStdev"]
-max_chain_angle_max = compatibility_ranges["maxChainAngleMax"]
-
-combos = []
-combos_trimmed = []
-sensible_combos = []
-sensible_combos_trimmed = []
-partial_fail_combos = []
-partial_fail_combos_confidence_trimmed = []
-partial_fail_combos_chain_angle_trimmed = []
-partial_fail_combos_other_trimmed = []
-all_combos = []
-
-for shifter in shifters:
-  if "side" in shifter and shifter["side"] == "left":
-    continue
-
-  equiv_shifters = [s for s in equivalent_shifters if s["equivalentPartNumber"] == shifter["partNumber"]]
-
-  for derailleur in derailleurs:
-    equiv_derailleurs = [s for s in equivalent_derailleurs if s["equivalentPartNumber"] == derailleur["partNumber"]]
-
-    for speeds in range(9, 14):
-      shifter_name = shifter["brand"] + " " + shifter["name"]
-
-      if shifter["brand"] == derailleur["brand"]:
-        brand = shifter["brand"]
-        derailleur_name = derailleur["name"]
-      else:
-        brand = "Mixed"
-        derailleur_name = derailleur["brand"] + " " + derailleur["name"]
-
-      shifter_name = shifter_name + f' {shifter["speeds"]}-Speed'
-      derailleur_name = derailleur_name + f' {derailleur["designSpeeds"]}-Speed'
-      
-      if shifter["brand"] == derailleur["brand"] \
-        and shifter["name"] == derailleur["name"] \
-          and speeds == shifter["speeds"] and speeds == derailleur["designSpeeds"]:
-        # Same group
-        same_group = True
-        combo_name = partial_name = f"{shifter["brand"]} {shifter['name']} {speeds}-Speed group"
-      else:
-        same_group = False
-        partial_name = f"{shifter_name} shifter/{derailleur_name} derailleur"
-        combo_name = partial_name + f"/{speeds}-Speed cassette"
-
-      # Build combo info
-      combo = {
-        "brand": brand,
-        "name": combo_name,
-        "partialName": partial_name,
-        "shifterPartialName": shifter_name,
-        "derailleurPartialName": derailleur_name,
-        "speeds": speeds,
-        "accessibleSpeeds": min(shifter["speeds"], speeds),
-        "sameGroup": same_group,
-        "shifterPartNumber": shifter["partNumber"],
-        "shifterName": shifter["name"],
-        "shifterBrand": shifter["brand"],
-        "derailleurPartNumber": derailleur["partNumber"],
-        "derailleurName": derailleur["name"],
-        "derailleurBrand": derailleur["brand"],
-        "cassettes": [],
-        "shifterType": shifter["type"],
-        "noMatchingFrontShifter": shifter["hasMatchingFrontShifters"] == False
-          and derailleur["supportsMultipleFrontChainrings"],
-        "moreCogsThanShifts": shifter["speeds"] < speeds,
-        "moreShiftsThanCogs": shifter["speeds"] > speeds,
-        "maxToothAvailableAndCompatible": 0,
-        "maxToothAvailableAndUnofficiallyCompatible": 0,
-        "maxToothAvailableAndCompatibleWithGoatLink": 0,
-        "maxToothAvailableAndSupported": 0,
-        "supported": False,
-        "chainWrap": derailleur["chainWrap"],
-        "equivalentShifters": equiv_shifters,
-        "equivalentDerailleurs": equiv_derailleurs
-      }
-
-      # Look for compatible cassettes
-      for cassette in [c for c in cassettes if c["speeds"] == speeds]:
-        
-        # Check to see how close [cable pull] * [pull ratio] is to [cog pitch]
-        multiplier = cassette["averagePitch"] / (shifter["cablePull"] * derailleur["pullRatio"])
-
-        distFromMotionMultiplierAvg = abs(multiplier - motion_multiplier_avg)
-
-        # Confidence = how close to the average motion multiplier are we, assuming a normal distribution?
-        # 1.0 means we're dead on, < 0.05 means we're further away than 95% of all groupsets
-        confidence = 1 - norm.cdf(distFromMotionMultiplierAvg, scale=motion_multiplier_stdev) \
-                    + norm.cdf(-distFromMotionMultiplierAvg, scale=motion_multiplier_stdev)
-        
-        max_chain_angle_results = calculate_max_chain_angle(shifter, derailleur, cassette)
-
-        barrel_adjuster_too_low = max_chain_angle_results["barrel_adjuster_too_low"]
-        least_pull_too_low = max_chain_angle_results["least_pull_too_low"]
-        max_chain_angle_too_high = max_chain_angle_results["max_chain_angle"] > max_chain_angle_max
-        confidence_too_low = confidence < 0.05
-        not_enough_range_on_derailleur = max_chain_angle_results["derailleur_can_clear_cassette"] == False
-        smallest_cassette_too_big_official_max_tooth = "minMaxToothAvailable" in cassette and cassette["minMaxToothAvailable"] > derailleur["maxTooth"]
-        smallest_cassette_too_big_unofficial_max_tooth = cassette["minMaxToothAvailable"] > derailleur["maxToothUnofficial"] \
-          if "minMaxToothAvailable" in cassette and "maxToothUnofficial" in derailleur and derailleur["maxToothUnofficial"] != None \
-          else None
-        smallest_cassette_too_big_with_goat_link = cassette["minMaxToothAvailable"] > derailleur["maxToothWithGoatLink"] \
-          if "minMaxToothAvailable" in cassette and "maxToothWithGoatLink" in derailleur and derailleur["maxToothWithGoatLink"] != None \
-          else None
-        smallest_cassette_too_big = smallest_cassette_too_big_official_max_tooth \
-          and (smallest_cassette_too_big_unofficial_max_tooth or smallest_cassette_too_big_unofficial_max_tooth == None) \
-          and (smallest_cassette_too_big_with_goat_link or smallest_cassette_too_big_with_goat_link == None)
-
-        fail_criteria = [
-          confidence_too_low, max_chain_angle_too_high, barrel_adjuster_too_low,
-          least_pull_too_low, not_enough_range_on_derailleur, smallest_cassette_too_big
-        ]
-
-        all_combos.append({
-          "brand": brand,
-          "name": combo_name,
-          "shifterPartNumber": shifter["partNumber"],
-          "shifterName": shifter["name"],
-          "shifterBrand": shifter["brand"],
-          "shifterSpeeds": shifter["speeds"],
-          "shifterCablePull": round(shifter["cablePull"], 2),
-          "shifterType": shifter["type"],
-          "shifterSide": shifter["side"] if "side" in shifter else "",
-          "derailleurPartNumber": derailleur["partNumber"],
-          "derailleurName": derailleur["name"],
-          "derailleurBrand": derailleur["brand"],
-          "derailleurDesignSpeeds": derailleur["designSpeeds"],
-          "derailleurPullRatio": round(derailleur["pullRatio"], 2),
-          "derailleurSupportsMultipleFrontChainrings": derailleur["supportsMultipleFrontChainrings"],
-          "cassettePartNumber": cassette["partNumber"],
-          "cassetteName": cassette["name"],
-          "cassetteBrand": cassette["brand"],
-          "cassetteSpeeds": cassette["speeds"],
-          "cassettePitch": cassette["averagePitch"],
-          "cassetteMinMaxToothAvailable": cassette["minMaxToothAvailable"] if "minMaxToothAvailable" in cassette else "",
-          "cassetteMaxToothAvailable": cassette["maxToothAvailable"],
-          "confidence_too_low": bool(confidence_too_low),
-          "max_chain_angle_too_high": bool(max_chain_angle_too_high),
-          "barrel_adjuster_too_low": bool(barrel_adjuster_too_low),
-          "least_pull_too_low": bool(least_pull_too_low),
-          "not_enough_range_on_derailleur": bool(not_enough_range_on_derailleur),
-          "smallest_cassette_too_big_official_max_tooth": bool(smallest_cassette_too_big_official_max_tooth),
-          "smallest_cassette_too_big_unofficial_max_tooth": smallest_cassette_too_big_unofficial_max_tooth,
-          "smallest_cassette_too_big_with_goat_link": smallest_cassette_too_big_with_goat_link,
-          "smallest_cassette_too_big": bool(smallest_cassette_too_big),
-          "maxChainAngle": max_chain_angle_results["max_chain_angle"],
-          "motionMultiplier": multiplier,
-          "numberOfShiftsMatchesCogs": shifter["speeds"] == cassette["speeds"],
-          "moreCogsThanShifts": cassette["speeds"] > shifter["speeds"]
-        })
-
-        #Log combos that fail any, but not all criteria
-        if any(fail_criteria):
-          if not all(fail_criteria):
-            partial_fail_combos.append({
-              "confidence_too_low": bool(confidence_too_low),
-              "max_chain_angle_too_high": bool(max_chain_angle_too_high),
-              "barrel_adjuster_too_low": bool(barrel_adjuster_too_low),
-              "least_pull_too_low": bool(least_pull_too_low),
-              "not_enough_range_on_derailleur": bool(not_enough_range_on_derailleur),
-              "smallest_cassette_too_big_official_max_tooth": bool(smallest_cassette_too_big_official_max_tooth),
-              "smallest_cassette_too_big_unofficial_max_tooth": smallest_cassette_too_big_unofficial_max_tooth,
-              "smallest_cassette_too_big_with_goat_link": smallest_cassette_too_big_with_goat_link,
-              "smallest_cassette_too_big": bool(smallest_cassette_too_big),
-              **combo,
-              "cassettePartNumber": cassette["partNumber"],
-              "confidence": confidence,
-              "maxChainAngle": max_chain_angle_results["max_chain_angle"],
-              "maxAngleAnalysis": max_chain_angle_results,
-              "motionMultiplier": multiplier,
-              "equivalentShifters": [],
-              "equivalentDerailleurs": [],
-              "cassettes": []
-            })
-            partial_fail_info = {
-              "brand": brand,
-              "name": combo_name,
-              "shifterPartNumber": shifter["partNumber"],
-              "shifterName": shifter["name"],
-              "shifterBrand": shifter["brand"],
-              "derailleurPartNumber": derailleur["partNumber"],
-              "derailleurName": derailleur["name"],
-              "derailleurBrand": derailleur["brand"],
-              "cassettePartNumber": cassette["partNumber"],
-              "cassetteName": cassette["name"],
-              "cassetteBrand": cassette["brand"],
-              "confidence_too_low": bool(confidence_too_low),
-              "max_chain_angle_too_high": bool(max_chain_angle_too_high),
-              "barrel_adjuster_too_low": bool(barrel_adjuster_too_low),
-              "least_pull_too_low": bool(least_pull_too_low),
-              "not_enough_range_on_derailleur": bool(not_enough_range_on_derailleur),
-              "smallest_cassette_too_big_official_max_tooth": bool(smallest_cassette_too_big_official_max_tooth),
-              "smallest_cassette_too_big_unofficial_max_tooth": smallest_cassette_too_big_unofficial_max_tooth,
-              "smallest_cassette_too_big_with_goat_link": smallest_cassette_too_big_with_goat_link,
-              "smallest_cassette_too_big": bool(smallest_cassette_too_big),
-            }
-
-            if not confidence_too_low and not max_chain_angle_too_high:
-              partial_fail_combos_other_trimmed.append(partial_fail_info)
-            elif confidence_too_low:
-              partial_fail_combos_confidence_trimmed.append(partial_fail_info)
-            elif max_chain_angle_too_high: 
-              partial_fail_combos_chain_angle_trimmed.append(partial_fail_info)
-            
-        else:
-        
-          if max_chain_angle_results["most_pull_too_high"]:
-            print(f"Warning: most pull too high for {combo['name']} with cassette {cassette["partNumber"]}")
-          
-          maxToothAvailableAndCompatible = min(derailleur["maxTooth"], cassette["maxToothAvailable"])
-          maxToothAvailableAndUnofficiallyCompatible = min(derailleur["maxToothUnofficial"], cassette["maxToothAvailable"]) \
-            if "maxToothUnofficial" in derailleur and derailleur["maxToothUnofficial"] != None \
-            else 0
-          maxToothAvailableAndCompatibleWithGoatLink = min(derailleur["maxToothWithGoatLink"], cassette["maxToothAvailable"]) \
-            if "maxToothWithGoatLink" in derailleur and derailleur["maxToothWithGoatLink"] != None \
-            else 0
-
-          supported = any([combo for combo in supported_combos
-                if shifter["partNumber"] == combo["shifterPartNumber"]
-                and derailleur["partNumber"] == combo["derailleurPartNumber"]
-                and cassette["partNumber"] == combo["cassettePartNumber"]])
-
-          combo["cassettes"].append({
-            "cassettePartNumber": cassette["partNumber"],
-            "cassetteName": cassette["name"],
-            "cassetteBrand": cassette["brand"],
-            "confidence": confidence,
-            "supported": supported,
-            "maxToothAvailableAndCompatible": maxToothAvailableAndCompatible,
-            "maxToothAvailableAndUnofficiallyCompatible": maxToothAvailableAndUnofficiallyCompatible,
-            "maxToothAvailableAndCompatibleWithGoatLink": maxToothAvailableAndCompatibleWithGoatLink,
-            "maxChainAngle": max_chain_angle_results["max_chain_angle"],
-            "maxAngleAnalysis": max_chain_angle_results,
-            "motionMultiplier": multiplier,
-            "smallest_cassette_too_big_official_max_tooth": bool(smallest_cassette_too_big_official_max_tooth),
-            "smallest_cassette_too_big_unofficial_max_tooth": smallest_cassette_too_big_unofficial_max_tooth,
-            "smallest_cassette_too_big_with_goat_link": smallest_cassette_too_big_with_goat_link
-          })
-
-          # Update combo max tooth with cassette info
-          combo["maxToothAvailableAndCompatible"] = max(combo["maxToothAvailableAndCompatible"], maxToothAvailableAndCompatible)
-          combo["maxToothAvailableAndUnofficiallyCompatible"] = max(combo["maxToothAvailableAndUnofficiallyCompatible"], maxToothAvailableAndUnofficiallyCompatible)
-          combo["maxToothAvailableAndCompatibleWithGoatLink"] = max(combo["maxToothAvailableAndCompatibleWithGoatLink"], maxToothAvailableAndCompatibleWithGoatLink)
-          if supported:
-            combo["maxToothAvailableAndSupported"] = max(combo["maxToothAvailableAndSupported"], maxToothAvailableAndCompatible)
-          combo["supported"] = combo["supported"] or supported
-          trimmed_combo = {
-            "brand": brand,
-            "name": combo_name,
-            "shifterPartNumber": shifter["partNumber"],
-            "shifterName": shifter["name"],
-            "shifterBrand": shifter["brand"],
-            "derailleurPartNumber": derailleur["partNumber"],
-            "derailleurName": derailleur["name"],
-            "derailleurBrand": derailleur["brand"],
-            "cassettePartNumber": cassette["partNumber"],
-            "cassetteName": cassette["name"],
-            "cassetteBrand": cassette["brand"],
-          }
-          combos_trimmed.append(trimmed_combo)
-          if cassette["speeds"] <= shifter["speeds"]:
-            sensible_combos.append(combo)
-            sensible_combos_trimmed.append(trimmed_combo)
-      
-      # Save combo if compatible cassette was found
-      if len(combo["cassettes"]) > 0:
-        # Find reviews
-        reviews  = [r for r in reviewed_combos
-                    if (shifter["partNumber"] == r["shifterPartNumber"]
-                        or any([e for e in equiv_shifters
-                                if e["partNumber"] == r["shifterPartNumber"]])
-                      )
-                      and (derailleur["partNumber"] == r["derailleurPartNumber"]
-                        or any([e for e in equiv_derailleurs
-                                if e["partNumber"] == r["derailleurPartNumber"]])
-                      )
-                      and any([c for c in combo["cassettes"]
-                               if c["cassettePartNumber"] == r["cassettePartNumber"]])
-                  ]
-        
-        combo["reviews"] = reviews
-
-        if len(reviews) > 0:
-          positive_reviews = [r for r in reviews if r["sentiment"] == "positive"]
-          negative_reviews = [r for r in reviews if r["sentiment"] == "negative"]
-          if len(positive_reviews) > 0 and len(negative_reviews) > 0:
-            combo["reviewsSentiment"] = "mixed"
-          elif len(positive_reviews) > 0:
-            combo["reviewsSentiment"] = "positive"
-          else:
-            combo["reviewsSentiment"] = "negative"
-        else:
-          combo["reviewsSentiment"] = "none"
-        
-        combos.append(combo)
-
-
-
-with open(f"combinations.json", "w") as info_file:
-  json.dump(combos, info_file, indent=2)
-
-with open(f"combinations_trimmed.json", "w") as info_file:
-  json.dump(combos_trimmed, info_file, indent=2)
-
-with open(f"sensible_combinations.json", "w") as info_file:
-  json.dump(sensible_combos, info_file, indent=2)
-
-with open(f"sensible_combinations_trimmed.json", "w") as info_file:
-  json.dump(sensible_combos_trimmed, info_file, indent=2)
-
-with open(f"partial_fail_combos.json", "w") as info_file:
-  json.dump(partial_fail_combos, info_file, indent=2)
-
-with open(f"partial_fail_combos_other_trimmed.json", "w") as info_file:
-  json.dump(partial_fail_combos_other_trimmed, info_file, indent=2)
-
-with open(f"partial_fail_combos_confidence_trimmed.json", "w") as info_file:
-  json.dump(partial_fail_combos_confidence_trimmed, info_file, indent=2)
-
-with open(f"partial_fail_combos_chain_angle_trimmed.json", "w") as info_file:
-  json.dump(partial_fail_combos_chain_angle_trimmed, info_file, indent=2)
-
-with open(f"all_cassettes.json", "w") as info_file:
-  json.dump(cassettes, info_file, indent=2)
-
-with open(f"all_combos.csv", "w", newline='', encoding='utf-8') as f:
-  w = csv.DictWriter(f, all_combos[0].keys())
-  w.writeheader()
-  w.writerows(all_combos)
-  
\ No newline at end of file
+import argparse
+import time
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from combo_search import Catalog, cheap_fail_criteria, get_shard_stats, init_worker, \
+  iter_shifter_combos_in_worker, find_shifter_combos_in_worker
+from result_cache import ResultCache
+from streaming_output import ResultWriters
+from combo_database import ComboDatabaseWriter
+
+try:
+  import resource
+except ImportError:
+  # Not available on Windows
+  resource = None
+
+# Where each list of results is written
+output_file_names = {
+  "combos": "combinations.json",
+  "combos_trimmed": "combinations_trimmed.json",
+  "sensible_combos": "sensible_combinations.json",
+  "sensible_combos_trimmed": "sensible_combinations_trimmed.json",
+  "partial_fail_combos": "partial_fail_combos.json",
+  "partial_fail_combos_other_trimmed": "partial_fail_combos_other_trimmed.json",
+  "partial_fail_combos_confidence_trimmed": "partial_fail_combos_confidence_trimmed.json",
+  "partial_fail_combos_chain_angle_trimmed": "partial_fail_combos_chain_angle_trimmed.json",
+  "all_combos": "all_combos.csv"
+}
+
+# Yields results as they're found, for one derailleur at a time when searching serially and for
+# one shifter at a time from worker processes. Shards come back in shifter order, so the output
+# doesn't depend on how many jobs there are
+def find_all_combos(catalog, jobs, cache=None, prune=False, solve_pruned=False):
+  # One shard per shifter
+  shifter_indexes = [catalog.shifters.index(shifter) for shifter in catalog.get_searched_shifters()]
+  shard_stats = []
+
+  start = time.perf_counter()
+
+  if jobs > 1:
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(catalog, cache, prune, solve_pruned)) as executor:
+      for results, stats in executor.map(find_shifter_combos_in_worker, shifter_indexes):
+        shard_stats.append(stats)
+        yield results
+  else:
+    init_worker(catalog, cache, prune, solve_pruned)
+    for i in shifter_indexes:
+      stats = get_shard_stats()
+      yield from iter_shifter_combos_in_worker(i, stats)
+      shard_stats.append(stats)
+
+  elapsed = time.perf_counter() - start
+
+  shard_times = [s["time"] for s in shard_stats]
+  print(f"{len(shard_stats)} shards on {jobs} job(s) in {elapsed:.2f} s")
+  for i, t in zip(shifter_indexes, shard_times):
+    print(f"  {catalog.shifters[i]['partNumber']}: {t:.3f} s")
+  print(f"Total shard time {sum(shard_times):.2f} s, estimated speedup over serial {sum(shard_times) / elapsed:.2f}x")
+
+  if cache is not None:
+    evicted = cache.evict()
+    cache_stats = cache.stats()
+    cache_hits = sum(s["cacheHits"] for s in shard_stats)
+    cache_misses = sum(s["cacheMisses"] for s in shard_stats)
+    print(f"Result cache: {cache_hits} triples reused, {cache_misses} recalculated, {cache_stats['entries']} entries, "
+          f"{cache_stats['bytes'] / 1024 / 1024:.1f} of {cache_stats['maxBytes'] / 1024 / 1024:.0f} MB, {evicted} evicted")
+
+  print_prune_stats(shard_stats, prune)
+
+def print_prune_stats(shard_stats, prune):
+  triples = sum(s["triples"] for s in shard_stats)
+  solved = sum(s["solved"] for s in shard_stats)
+  pruned = sum(s["pruned"] for s in shard_stats)
+  solve_time = sum(s["solveTime"] for s in shard_stats)
+
+  print(f"{triples} triples, {solved} solved for chain angles in {solve_time:.2f} s")
+  for c in cheap_fail_criteria:
+    print(f"  {c}: {sum(s['rejectedBy'][c] for s in shard_stats)} triples rejected")
+
+  if prune:
+    pruned_solve_times = [s["prunedSolveTime"] for s in shard_stats if s["prunedSolveTime"] is not None]
+    if len(pruned_solve_times) > 0:
+      print(f"{pruned} triples pruned, saving {sum(pruned_solve_times):.2f} s of solving")
+    elif solved > 0:
+      # Batches are vectorized, so the time per triple is only a rough guide
+      print(f"{pruned} triples pruned, saving an estimated {pruned * solve_time / solved:.2f} s of solving")
+    else:
+      print(f"{pruned} triples pruned")
+
+def print_peak_memory():
+  if resource is None:
+    return
+  # ru_maxrss is in KB on Linux
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+  peak_workers = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+  print(f"Peak RSS {peak:.0f} MB" + (f", {peak_workers:.0f} MB in worker processes" if peak_workers > 0 else ""))
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--jobs", type=int, default=1,
+                      help="Number of worker processes to search shifters with")
+  parser.add_argument("--cache-dir", default=".combo_cache",
+                      help="Folder to keep per-triple results in, so unchanged triples aren't recalculated")
+  parser.add_argument("--cache-size", type=float, default=256,
+                      help="Maximum size of the result cache in MB")
+  parser.add_argument("--no-cache", action="store_true",
+                      help="Recalculate every triple without reading or writing the result cache")
+  parser.add_argument("--prune", action="store_true",
+                      help="Skip solving for chain angles when a triple already fails on confidence, max tooth "
+                           "or derailleur range. Pruned triples have blank chain angle results in all_combos.csv "
+                           "and are left out of the partial fail reports")
+  parser.add_argument("--solve-pruned", action="store_true",
+                      help="With --prune, still solve pruned triples afterwards, so the partial fail reports are "
+                           "complete and the time pruning saves is measured")
+  parser.add_argument("--database", default="combinations.db",
+                      help="SQLite database to write parts, triples and chain angles to")
+  parser.add_argument("--no-database", action="store_true",
+                      help="Don't write the SQLite database")
+  args = parser.parse_args()
+
+  catalog = Catalog()
+  cache = None if args.no_cache else ResultCache(args.cache_dir, int(args.cache_size * 1024 * 1024))
+  with ResultWriters(output_file_names) as writers, \
+    (ComboDatabaseWriter(args.database, catalog) if not args.no_database else nullcontext()) as database:
+    for results in find_all_combos(catalog, args.jobs, cache, args.prune, args.solve_pruned):
+      writers.write(results)
+      if database is not None:
+        database.write(results)
+
+  with open(f"all_cassettes.json", "w") as info_file:
+    json.dump([c.info for c in catalog.cassettes], info_file, indent=2)
+
+  print_peak_memory()
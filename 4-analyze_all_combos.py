@@ -1,44 +1,88 @@
-
 import json
+import argparse
+import time
+from combo_query import ComboIndex
 
+lowest_max_tooth = 35
+lowest_chain_wrap = 40
 
-with open(f"combinations.json") as f:
-  combos = json.load(f)
+def find_drop_bar_combos(index):
+  drop_bar_combos = index.query().shifter_type("drop-bar").listed().more_cogs_than_shifts(False)
 
-with open(f"supported_combinations.json") as f:
-  supported_combos = json.load(f)
+  lowest_gearing_with_drop_bar_shifters_combos = drop_bar_combos.min_max_tooth(lowest_max_tooth) \
+    .sorted("maxToothAvailableAndCompatible", reverse=True)
+  widest_range_with_drop_bar_shifters_combos = drop_bar_combos.min_chain_wrap(lowest_chain_wrap) \
+    .sorted("chainWrap", reverse=True)
 
-lowest_max_tooth = 35
-lowest_chain_wrap = 40
+  return lowest_gearing_with_drop_bar_shifters_combos, widest_range_with_drop_bar_shifters_combos
+
+# The original scan over combinations.json, kept to benchmark the index against
+def find_drop_bar_combos_by_scan(combos, supported_combos):
+  lowest_gearing_with_drop_bar_shifters_combos = []
+  widest_range_with_drop_bar_shifters_combos = []
+
+  for combo in combos:
+    if ((combo["shifterType"] == "drop-bar"
+          or any([s for s in combo["equivalentShifters"] if s["type"] == "drop-bar"]))
+        and (combo["brand"] == "Mixed"
+             or combo["sameGroup"] 
+             or combo["derailleurName"] != combo["shifterName"]
+             or (not combo["sameGroup"]
+                 and any([
+                  sc for sc in supported_combos
+                  if combo["shifterPartNumber"] == sc["shifterPartNumber"]
+                    and combo["derailleurPartNumber"] == sc["derailleurPartNumber"]
+      #sc["cassettePartNumber"]
+              ])))
+        and combo["moreCogsThanShifts"] == False):
+
+      if combo["maxToothAvailableAndCompatible"] >= lowest_max_tooth:
+        lowest_gearing_with_drop_bar_shifters_combos.append(combo)
+      if combo["chainWrap"] >= lowest_chain_wrap:
+        widest_range_with_drop_bar_shifters_combos.append(combo)
+
+  lowest_gearing_with_drop_bar_shifters_combos.sort(key=lambda combo: combo["maxToothAvailableAndCompatible"], reverse=True)
+  widest_range_with_drop_bar_shifters_combos.sort(key=lambda combo: combo["chainWrap"], reverse=True)
+
+  return lowest_gearing_with_drop_bar_shifters_combos, widest_range_with_drop_bar_shifters_combos
+
+def benchmark(index, repeats):
+  def time_per_call(f):
+    start = time.perf_counter()
+    for _ in range(repeats):
+      result = f()
+    return (time.perf_counter() - start) / repeats * 1000, result
+
+  supported_combos = [{"shifterPartNumber": s, "derailleurPartNumber": d, "cassettePartNumber": c}
+                      for s, d, c in sorted(index.supported_triples)]
+
+  scan_time, scan_result = time_per_call(lambda: find_drop_bar_combos_by_scan(index.combos, supported_combos))
+  index_build_time, _ = time_per_call(lambda: ComboIndex(index.combos, supported_combos,
+                                                         index.equivalent_shifters, index.equivalent_derailleurs))
+  query_time, query_result = time_per_call(lambda: find_drop_bar_combos(index))
+
+  if scan_result != query_result:
+    raise Exception("Indexed query results don't match the scan")
+
+  print(f"{len(index.combos)} combos, {repeats} repeats")
+  print(f"  Scan: {scan_time:.3f} ms")
+  print(f"  Index build: {index_build_time:.3f} ms")
+  print(f"  Indexed query: {query_time:.3f} ms, {scan_time / query_time:.1f}x faster than the scan")
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--benchmark", type=int, metavar="REPEATS", default=0,
+                      help="Also time the indexed query against the original scan over combinations.json")
+  args = parser.parse_args()
+
+  index = ComboIndex.load()
+  lowest_gearing_with_drop_bar_shifters_combos, widest_range_with_drop_bar_shifters_combos = find_drop_bar_combos(index)
+
+  with open(f"lowest_gearing_with_drop_bar_shifters_combos.json", "w") as info_file:
+    json.dump(lowest_gearing_with_drop_bar_shifters_combos, info_file, indent=2)
+
+  with open(f"widest_range_with_drop_bar_shifters_combos.json", "w") as info_file:
+    json.dump(widest_range_with_drop_bar_shifters_combos, info_file, indent=2)
 
-lowest_gearing_with_drop_bar_shifters_combos = []
-widest_range_with_drop_bar_shifters_combos = []
-
-for combo in combos:
-  if ((combo["shifterType"] == "drop-bar"
-        or any([s for s in combo["equivalentShifters"] if s["type"] == "drop-bar"]))
-      and (combo["brand"] == "Mixed"
-           or combo["sameGroup"] 
-           or combo["derailleurName"] != combo["shifterName"]
-           or (not combo["sameGroup"]
-               and any([
-                sc for sc in supported_combos
-                if combo["shifterPartNumber"] == sc["shifterPartNumber"]
-                  and combo["derailleurPartNumber"] == sc["derailleurPartNumber"]
-    #sc["cassettePartNumber"]
-            ])))
-      and combo["moreCogsThanShifts"] == False):
-
-    if combo["maxToothAvailableAndCompatible"] >= lowest_max_tooth:
-      lowest_gearing_with_drop_bar_shifters_combos.append(combo)
-    if combo["chainWrap"] >= lowest_chain_wrap:
-      widest_range_with_drop_bar_shifters_combos.append(combo)
-
-lowest_gearing_with_drop_bar_shifters_combos.sort(key=lambda combo: combo["maxToothAvailableAndCompatible"], reverse=True)
-widest_range_with_drop_bar_shifters_combos.sort(key=lambda combo: combo["chainWrap"], reverse=True)
-
-with open(f"lowest_gearing_with_drop_bar_shifters_combos.json", "w") as info_file:
-  json.dump(lowest_gearing_with_drop_bar_shifters_combos, info_file, indent=2)
-
-with open(f"widest_range_with_drop_bar_shifters_combos.json", "w") as info_file:
-  json.dump(widest_range_with_drop_bar_shifters_combos, info_file, indent=2)
\ No newline at end of file
+  if args.benchmark > 0:
+    benchmark(index, args.benchmark)
@@ -0,0 +1,82 @@
+import math
+import numpy as np
+
+# Least squares polynomial fits of many runs at once, where np.polynomial.Polynomial.fit() fits one.
+# Like Polynomial.fit(), each run's x is mapped onto [-1, 1] and each column of its Vandermonde matrix is
+# scaled to unit length before solving, so high powers of x don't make the system ill-conditioned, and the
+# coefficients are converted back to powers of x afterwards. Runs can have different lengths: they're
+# padded with zero rows, which don't change a least squares solution, and every run is solved by one
+# batched SVD
+
+# Fits a polynomial of degree to each run's xs and ys. Returns a dict for each run with:
+#   "coef": the coefficients, lowest power first, like Polynomial.fit(...).convert().coef
+#   "rms_error", "max_residual": the RMS and the largest absolute difference between the fit and ys
+#   "condition_number": of the scaled Vandermonde matrix that was solved. Big numbers mean that the
+#     coefficients barely depend on the data, like when a run has too few distinct xs for its degree
+# Values that aren't finite, like the condition number of a rank deficient run, are None, so they're
+# written to JSON as null
+def fit_polynomials(xs, ys, degree):
+  if len(xs) == 0:
+    return []
+
+  lengths = np.array([len(x) for x in xs])
+  rows = np.arange(lengths.max()) < lengths[:, None]
+
+  x = np.zeros(rows.shape)
+  y = np.zeros(rows.shape)
+  x[rows] = np.concatenate(xs)
+  y[rows] = np.concatenate(ys)
+
+  # Map each run onto [-1, 1]
+  low = np.where(rows, x, np.inf).min(axis=1)
+  high = np.where(rows, x, -np.inf).max(axis=1)
+  scale = 2 / (high - low)
+  offset = -(high + low) / (high - low)
+  t = offset[:, None] + scale[:, None] * x
+
+  vander = get_vandermonde(t, degree) * rows[:, :, None]
+  column_norms = np.sqrt(np.sum(vander ** 2, axis=1))
+  column_norms[column_norms == 0] = 1
+  scaled_vander = vander / column_norms[:, None, :]
+
+  # Least squares through the SVD, ignoring singular values that are too small to matter, as lstsq()
+  # does with the rcond that Polynomial.fit() uses
+  u, s, vt = np.linalg.svd(scaled_vander, full_matrices=False)
+  rcond = lengths * np.finfo(float).eps
+  inverse_s = np.divide(1, s, out=np.zeros_like(s), where=s > rcond[:, None] * s[:, :1])
+  scaled_coef = np.einsum("bkn,bk->bn", vt, np.einsum("bmk,bm->bk", u, y) * inverse_s)
+  window_coef = scaled_coef / column_norms
+
+  residuals = (y - np.einsum("bmn,bn->bm", vander, window_coef)) * rows
+  rms_error = np.sqrt(np.sum(residuals ** 2, axis=1) / lengths)
+  max_residual = np.abs(residuals).max(axis=1)
+  condition_number = np.divide(s[:, 0], s[:, -1], out=np.full(len(s), np.inf), where=s[:, -1] > 0)
+
+  coef = np.einsum("bk,bkj->bj", window_coef, get_conversion(offset, scale, degree))
+
+  return [{
+    "coef": c.tolist(),
+    "rms_error": to_json_number(e),
+    "max_residual": to_json_number(m),
+    "condition_number": to_json_number(n)
+  } for c, e, m, n in zip(coef, rms_error, max_residual, condition_number)]
+
+def to_json_number(value):
+  return float(value) if np.isfinite(value) else None
+
+# Powers 0 to degree of each value, in a new last axis
+def get_vandermonde(t, degree):
+  vander = np.ones(t.shape + (degree + 1,))
+  for power in range(1, degree + 1):
+    vander[..., power] = vander[..., power - 1] * t
+  return vander
+
+# Matrices that turn coefficients of powers of t = offset + scale * x into coefficients of powers of x,
+# from the binomial expansion of (offset + scale * x)^k
+def get_conversion(offset, scale, degree):
+  k, j = np.indices((degree + 1, degree + 1))
+  binomials = np.array([[math.comb(a, b) for b in range(degree + 1)] for a in range(degree + 1)])
+  powers = np.where(k >= j, k - j, 0)
+  return np.where(k >= j,
+                  binomials * offset[:, None, None] ** powers * scale[:, None, None] ** j,
+                  0)
@@ -0,0 +1,96 @@
+import os
+import sys
+import json
+import glob
+import time
+import shutil
+import argparse
+import datetime
+import platform
+import subprocess
+import tempfile
+import charts
+from util import map_jobs
+
+# Draws every chart of the derailleurs/ and shifters/ trees with the old pyplot renderer and with the
+# figure pool, and appends the charts per second of each to a JSON file, so runs can be compared
+# across commits. The charts are collected by running the stage 1 scripts with --plots-later on a
+# copy of the trees that has no PNGs
+
+script_folder = os.path.dirname(os.path.abspath(__file__))
+chart_scripts = ["1-analyze_shifter.py", "1a-analyze_derailleur_pull_ratio.py", "1b-analyze_derailleur_yaw.py",
+                 "1c-combine_derailleur_pull_ratios.py", "1d-combine_derailleur_yaws.py"]
+copied_files = ["overall_stats.json", "shifter_analysis.htm", "main_template.htm"]
+
+renderers = {
+  "pyplot": charts.render_chart_with_pyplot,
+  "figure pool": charts.render_chart_with_pool
+}
+
+def collect_charts(folder):
+  for tree in ["derailleurs", "shifters"]:
+    shutil.copytree(os.path.join(script_folder, tree), os.path.join(folder, tree),
+                    ignore=shutil.ignore_patterns("*.png"))
+  for f in copied_files:
+    shutil.copy(os.path.join(script_folder, f), folder)
+
+  for script in chart_scripts:
+    subprocess.run([sys.executable, os.path.join(script_folder, script), "--plots-later"], cwd=folder,
+                   stdout=subprocess.DEVNULL, check=True)
+
+  jobs = []
+  for queue_path in sorted(glob.glob(os.path.join(folder, charts.queue_folder, "*.json"))):
+    with open(queue_path) as f:
+      job = json.load(f)
+    job["path"] = os.path.join(folder, job["path"])
+    jobs.append(job)
+  return jobs
+
+def run_benchmark(jobs, job_count):
+  results = {}
+  for name, renderer in renderers.items():
+    start = time.perf_counter()
+    map_jobs(renderer, jobs, jobs=job_count)
+    elapsed = time.perf_counter() - start
+    results[name] = {"time": elapsed, "chartsPerSecond": len(jobs) / elapsed}
+    print(f"{name}: {len(jobs)} charts in {elapsed:.1f} s, {len(jobs) / elapsed:.1f} charts/s")
+  return results
+
+def get_commit():
+  try:
+    return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=script_folder, capture_output=True,
+                          text=True, check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--jobs", type=int, default=1, help="Number of worker processes to draw charts with")
+  parser.add_argument("--output", default="chart_benchmark.json",
+                      help="JSON file to append this run's results to")
+  args = parser.parse_args()
+
+  work_folder = tempfile.mkdtemp(prefix="chart_benchmark_")
+  try:
+    jobs = collect_charts(work_folder)
+    results = run_benchmark(jobs, args.jobs)
+  finally:
+    shutil.rmtree(work_folder)
+
+  runs = []
+  if os.path.exists(args.output):
+    with open(args.output) as f:
+      runs = json.load(f)
+
+  runs.append({
+    "commit": get_commit(),
+    "date": datetime.datetime.now().isoformat(timespec="seconds"),
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "jobs": args.jobs,
+    "charts": len(jobs),
+    "results": results
+  })
+
+  with open(args.output, "w") as f:
+    json.dump(runs, f, indent=2)
@@ -0,0 +1,323 @@
+import os
+import json
+import hashlib
+import numpy as np
+from importlib.metadata import version
+from PIL import Image
+
+# Charts are recorded as the list of pyplot calls that draw them instead of being drawn straight away.
+# A fingerprint of those calls is saved in the PNG, so a chart whose data and labels haven't changed
+# isn't drawn again. Recorded charts can also be queued, and drawn later by render_charts.py, so the
+# numeric results of an analysis stage don't have to wait for matplotlib
+#
+# How charts are saved:
+#   "now": draw charts that have changed
+#   "later": queue charts that have changed in queue_folder
+#   "off": don't draw or queue anything
+modes = ["now", "later", "off"]
+mode = "now"
+
+queue_folder = ".chart_queue"
+
+# These change how charts look, so they're part of each chart's fingerprint
+library_versions = {"matplotlib": version("matplotlib"), "pandas": version("pandas")}
+
+def set_mode(new_mode):
+  global mode
+  if new_mode not in modes:
+    raise Exception(f"Unknown chart mode {new_mode}")
+  mode = new_mode
+
+def add_arguments(parser):
+  group = parser.add_mutually_exclusive_group()
+  group.add_argument("--no-plots", action="store_const", dest="plots", const="off", default="now",
+                     help="Don't draw any charts")
+  group.add_argument("--plots-later", action="store_const", dest="plots", const="later",
+                     help="Queue changed charts for render_charts.py instead of drawing them")
+
+# numpy arrays and scalars as plain lists and numbers, so calls can be fingerprinted and queued as JSON
+def to_json(value):
+  if isinstance(value, (list, tuple)):
+    return [to_json(v) for v in value]
+  if isinstance(value, dict):
+    return dict((k, to_json(v)) for k, v in value.items())
+  if isinstance(value, np.ndarray):
+    return value.tolist()
+  if isinstance(value, np.generic):
+    return value.item()
+  return value
+
+# A pandas Series or DataFrame, for plot_bar()
+def frame_to_json(data):
+  frame = {
+    "index": data.index.tolist(),
+    "indexName": data.index.name,
+    "values": data.values.tolist()
+  }
+  if hasattr(data, "columns"):
+    frame["columns"] = data.columns.tolist()
+  else:
+    frame["name"] = data.name
+  return frame
+
+def frame_from_json(frame):
+  import pandas as pd
+
+  index = pd.Index(frame["index"], name=frame["indexName"])
+  if "columns" in frame:
+    return pd.DataFrame(frame["values"], index=index, columns=frame["columns"])
+  return pd.Series(frame["values"], index=index, name=frame["name"])
+
+class Chart:
+  def __init__(self, path):
+    self.path = path
+    self.calls = []
+
+  # chart.xlim([0, 10]) records plt.xlim([0, 10]), and so on for any other pyplot function
+  def __getattr__(self, name):
+    if name.startswith("_"):
+      raise AttributeError(name)
+
+    def record(*args, **kwargs):
+      self.calls.append([name, to_json(args), to_json(kwargs)])
+
+    return record
+
+  # Records data.plot.bar() for a pandas Series or DataFrame
+  def plot_bar(self, data, **kwargs):
+    self.calls.append(["plot_bar", [frame_to_json(data)], to_json(kwargs)])
+
+  def save(self, **savefig_kwargs):
+    if mode == "off":
+      return
+
+    job = {
+      "path": self.path,
+      "calls": self.calls,
+      "savefig": to_json(savefig_kwargs)
+    }
+    job["fingerprint"] = get_fingerprint(job)
+
+    if is_current(job):
+      remove_queued_chart(self.path)
+    elif mode == "later":
+      queue_chart(job)
+    else:
+      remove_queued_chart(self.path)
+      render_chart(job)
+
+def get_fingerprint(job):
+  fingerprinted = {
+    "path": job["path"],
+    "calls": job["calls"],
+    "savefig": job["savefig"],
+    **library_versions
+  }
+  return hashlib.sha256(json.dumps(fingerprinted, sort_keys=True).encode()).hexdigest()
+
+def get_saved_fingerprint(path):
+  try:
+    with Image.open(path) as image:
+      return image.info.get("Fingerprint")
+  except OSError:
+    return None
+
+def is_current(job):
+  return get_saved_fingerprint(job["path"]) == job["fingerprint"]
+
+# Figures that charts have been drawn on, by the layout of the chart (see get_layout()), oldest first. A
+# chart with the same layout as an earlier one is drawn on the same figure, axes and artists, with just
+# the data of its lines and bars updated, which saves building a new figure and axes for every chart
+figure_pool = {}
+figure_pool_size = 32
+
+# pyplot functions the figure pool can draw, and the Axes methods they call. Charts with anything else
+# are drawn with pyplot
+axes_methods = {
+  "plot": "plot",
+  "text": "text",
+  "annotate": "annotate",
+  "xlim": "set_xlim",
+  "ylim": "set_ylim",
+  "xlabel": "set_xlabel",
+  "ylabel": "set_ylabel",
+  "xticks": "set_xticks",
+  "title": "set_title"
+}
+
+# Always draw with Agg, so nothing depends on there being a display
+def use_agg():
+  import matplotlib
+  matplotlib.use("Agg")
+
+def render_chart(job):
+  if all(name in axes_methods or name in ["plot_bar", "tight_layout"] for name, _, _ in job["calls"]):
+    render_chart_with_pool(job)
+  else:
+    render_chart_with_pyplot(job)
+
+def render_chart_with_pyplot(job):
+  use_agg()
+  import matplotlib.pyplot as plt
+
+  for name, args, kwargs in job["calls"]:
+    if name == "plot_bar":
+      frame_from_json(args[0]).plot.bar(**kwargs)
+    else:
+      getattr(plt, name)(*args, **kwargs)
+
+  plt.savefig(job["path"], metadata={"Fingerprint": job["fingerprint"]}, **job["savefig"])
+  plt.close("all")
+
+# Splits plt.plot() args into the x, y and format of each line. x is None when only y is given
+def split_plot_args(args):
+  lines = []
+  i = 0
+  while i < len(args):
+    if i + 1 < len(args) and not isinstance(args[i + 1], str):
+      x, y = args[i], args[i + 1]
+      i += 2
+    else:
+      x, y = None, args[i]
+      i += 1
+
+    fmt = None
+    if i < len(args) and isinstance(args[i], str):
+      fmt = args[i]
+      i += 1
+
+    lines.append((x, y, fmt))
+  return lines
+
+# Everything about a chart except the data of its lines and bars, and the text of its text and
+# annotations. Charts with the same layout have the same artists, so they can share a figure
+def get_layout(job):
+  layout = []
+  for name, args, kwargs in job["calls"]:
+    if name == "plot":
+      structure = [[x is None, fmt] for x, _, fmt in split_plot_args(args)]
+    elif name == "plot_bar":
+      structure = dict((k, v) for k, v in args[0].items() if k != "values")
+    else:
+      structure = None
+    layout.append([name, structure, kwargs])
+  return json.dumps(layout, sort_keys=True)
+
+def get_labels(axes):
+  return {"xlabel": axes.get_xlabel(), "ylabel": axes.get_ylabel(), "title": axes.get_title()}
+
+def set_labels(axes, labels):
+  axes.set_xlabel(labels["xlabel"])
+  axes.set_ylabel(labels["ylabel"])
+  axes.set_title(labels["title"])
+
+# Makes one recorded call on the figure pool's figure and axes, and returns any artists it made. pandas
+# also labels the axes of bar charts, so those labels are kept with the bars
+def draw_call(figure, axes, name, args, kwargs):
+  if name == "plot_bar":
+    containers = len(axes.containers)
+    frame_from_json(args[0]).plot.bar(ax=axes, **kwargs)
+    return {"bars": axes.containers[containers:], "labels": get_labels(axes)}
+  if name == "tight_layout":
+    return figure.tight_layout(*args, **kwargs)
+  return getattr(axes, axes_methods[name])(*args, **kwargs)
+
+def draw_new_chart(job):
+  from matplotlib.figure import Figure
+  from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+  figure = Figure()
+  FigureCanvasAgg(figure)
+  axes = figure.add_subplot()
+  artists = [draw_call(figure, axes, name, args, kwargs) for name, args, kwargs in job["calls"]]
+
+  return {"figure": figure, "axes": axes, "artists": artists}
+
+# Draws a chart on the figure of an earlier chart with the same layout. The figure is first put back
+# the way it was before any calls, except for its lines and bars. Limits are autoscaled after each line
+# or bar update, and text is added and labels set in call order, so that later calls like ylim() and
+# tight_layout() see what they would on a new figure
+def redraw_chart(entry, job):
+  import matplotlib
+
+  figure = entry["figure"]
+  axes = entry["axes"]
+  artists = entry["artists"]
+
+  # Undo any tight_layout() from last time
+  figure.subplots_adjust(**dict((k, matplotlib.rcParams[f"figure.subplot.{k}"])
+                                for k in ["left", "right", "bottom", "top", "wspace", "hspace"]))
+  axes.set_autoscale_on(True)
+  set_labels(axes, {"xlabel": "", "ylabel": "", "title": ""})
+  for i, (name, _, _) in enumerate(job["calls"]):
+    if name in ["text", "annotate"]:
+      artists[i].remove()
+
+  for i, (name, args, kwargs) in enumerate(job["calls"]):
+    if name == "plot":
+      for line, (x, y, _) in zip(artists[i], split_plot_args(args)):
+        line.set_data(range(len(y)) if x is None else x, y)
+      axes.relim()
+      axes.autoscale_view()
+    elif name == "plot_bar":
+      frame = args[0]
+      # pandas draws missing values as empty bars
+      rows = np.nan_to_num(np.array(frame["values"], dtype=float).reshape(len(frame["index"]), -1))
+      for j, container in enumerate(artists[i]["bars"]):
+        for row, bar in zip(rows, container):
+          bar.set_height(row[j])
+      # pandas sets the x limits of bar charts itself
+      axes.set_autoscalex_on(False)
+      axes.relim()
+      axes.autoscale_view()
+      set_labels(axes, artists[i]["labels"])
+    elif name in ["text", "annotate"]:
+      artists[i] = draw_call(figure, axes, name, args, kwargs)
+    else:
+      draw_call(figure, axes, name, args, kwargs)
+
+def render_chart_with_pool(job):
+  use_agg()
+
+  layout = get_layout(job)
+  entry = figure_pool.pop(layout, None)
+  if entry is None:
+    entry = draw_new_chart(job)
+  else:
+    redraw_chart(entry, job)
+
+  figure_pool[layout] = entry
+  if len(figure_pool) > figure_pool_size:
+    del figure_pool[next(iter(figure_pool))]
+
+  entry["figure"].savefig(job["path"], metadata={"Fingerprint": job["fingerprint"]}, **job["savefig"])
+
+# One queued job per chart path, so queueing a chart again replaces the job from an earlier run
+def get_queue_path(path):
+  return os.path.join(queue_folder, hashlib.sha256(path.encode()).hexdigest() + ".json")
+
+def queue_chart(job):
+  os.makedirs(queue_folder, exist_ok=True)
+  queue_path = get_queue_path(job["path"])
+  with open(queue_path + ".tmp", "w") as f:
+    json.dump(job, f)
+  os.replace(queue_path + ".tmp", queue_path)
+
+def remove_queued_chart(path):
+  queue_path = get_queue_path(path)
+  if os.path.exists(queue_path):
+    os.remove(queue_path)
+
+def get_queued_charts():
+  if not os.path.exists(queue_folder):
+    return []
+  return sorted(os.path.join(queue_folder, f) for f in os.listdir(queue_folder) if f.endswith(".json"))
+
+def render_queued_chart(queue_path):
+  with open(queue_path) as f:
+    job = json.load(f)
+
+  if not is_current(job):
+    render_chart(job)
+  os.remove(queue_path)
+  return job["path"]
@@ -0,0 +1,177 @@
+import os
+import sqlite3
+from combo_search import fail_criteria_names
+
+# SQLite version of the stage 3 results, with one table per kind of part, one row per
+# (shifter, derailleur, cassette) triple, and the chain angle at each inner shift position.
+# For example, every drop bar shifter that works with a 13-speed cassette with a 51T cog:
+#
+#   select distinct s.* from triples t
+#   join shifters s on s.partNumber = t.shifterPartNumber
+#   join derailleurs d on d.partNumber = t.derailleurPartNumber
+#   join cassettes c on c.partNumber = t.cassettePartNumber
+#   where t.compatible and s.type = 'drop-bar' and c.speeds = 13
+#     and c.maxToothAvailable >= 51 and d.maxTooth >= 51
+
+
+schema = f"""
+create table shifters (
+  partNumber text primary key,
+  brand text,
+  name text,
+  type text,
+  side text,
+  speeds integer,
+  cablePull real,
+  hasMatchingFrontShifters integer
+);
+
+create table derailleurs (
+  partNumber text primary key,
+  brand text,
+  name text,
+  designSpeeds integer,
+  pullRatio real,
+  maxTooth integer,
+  maxToothUnofficial integer,
+  maxToothWithGoatLink integer,
+  chainWrap integer,
+  supportsMultipleFrontChainrings integer,
+  parallelogramStyle text
+);
+
+create table cassettes (
+  partNumber text primary key,
+  brand text,
+  name text,
+  speeds integer,
+  averagePitch real,
+  minMaxToothAvailable integer,
+  maxToothAvailable integer
+);
+
+create table triples (
+  id integer primary key,
+  name text,
+  brand text,
+  sameGroup integer,
+  shifterPartNumber text references shifters(partNumber),
+  derailleurPartNumber text references derailleurs(partNumber),
+  cassettePartNumber text references cassettes(partNumber),
+  compatible integer,
+  supported integer,
+  motionMultiplier real,
+  confidence real,
+  maxChainAngle real,
+  barrelAdjuster real,
+  {", ".join(f"{name} integer" for name in fail_criteria_names)}
+);
+
+create table chain_angles (
+  tripleId integer references triples(id),
+  position integer,
+  chainAngle real,
+  diff real,
+  primary key (tripleId, position)
+);
+"""
+
+indexes = [
+  ("shifters", ["brand"]),
+  ("shifters", ["speeds"]),
+  ("shifters", ["type"]),
+  ("derailleurs", ["brand"]),
+  ("derailleurs", ["designSpeeds"]),
+  ("derailleurs", ["maxTooth"]),
+  ("cassettes", ["brand"]),
+  ("cassettes", ["speeds"]),
+  ("cassettes", ["maxToothAvailable"]),
+  ("triples", ["shifterPartNumber"]),
+  ("triples", ["derailleurPartNumber"]),
+  ("triples", ["cassettePartNumber"]),
+  ("triples", ["compatible"]),
+  *[("triples", [name]) for name in fail_criteria_names]
+]
+
+# Writes the database in one transaction, to a temporary file that replaces file_name once it's
+# complete. Indexes are built once everything's been inserted, which is faster than keeping them
+# up to date row by row
+class ComboDatabaseWriter:
+  def __init__(self, file_name, catalog):
+    self.file_name = file_name
+    self.temp_file_name = file_name + ".tmp"
+    if os.path.exists(self.temp_file_name):
+      os.remove(self.temp_file_name)
+
+    self.connection = sqlite3.connect(self.temp_file_name, isolation_level=None)
+    self.connection.execute("pragma journal_mode = off")
+    self.connection.execute("pragma synchronous = off")
+    self.connection.execute("begin")
+    self.execute_script(schema)
+    self.next_triple_id = 1
+
+    self.connection.executemany("insert into shifters values (?, ?, ?, ?, ?, ?, ?, ?)", [(
+      s["partNumber"], s["brand"], s["name"], s["type"], s.get("side"), s["speeds"], s["cablePull"],
+      s.get("hasMatchingFrontShifters")
+    ) for s in catalog.shifters])
+
+    self.connection.executemany("insert into derailleurs values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", [(
+      d["partNumber"], d["brand"], d["name"], d["designSpeeds"], d["pullRatio"], d["maxTooth"],
+      d.get("maxToothUnofficial"), d.get("maxToothWithGoatLink"), d.get("chainWrap"),
+      d.get("supportsMultipleFrontChainrings"), d.get("parallelogramStyle")
+    ) for d in catalog.derailleurs])
+
+    self.connection.executemany("insert into cassettes values (?, ?, ?, ?, ?, ?, ?)", [(
+      c["partNumber"], c["brand"], c["name"], c["speeds"], c["averagePitch"], c.get("minMaxToothAvailable"),
+      c["maxToothAvailable"]
+    ) for c in catalog.cassettes])
+
+  def execute_script(self, script):
+    # executescript() would commit the open transaction, so run the statements one at a time
+    for statement in script.split(";"):
+      if statement.strip() != "":
+        self.connection.execute(statement)
+
+  def write(self, results):
+    triple_rows = []
+    chain_angle_rows = []
+
+    for t in results["triples"]:
+      triple_id = self.next_triple_id
+      self.next_triple_id = self.next_triple_id + 1
+
+      # Pruned triples weren't solved for chain angles
+      analysis = t["maxAngleAnalysis"]
+      triple_rows.append((
+        triple_id, t["name"], t["brand"], t["sameGroup"], t["shifterPartNumber"], t["derailleurPartNumber"],
+        t["cassettePartNumber"], t["compatible"], t["supported"], t["motionMultiplier"], t["confidence"],
+        analysis["max_chain_angle"] if analysis is not None else None,
+        analysis["barrel_adjuster"] if analysis is not None else None,
+        *[t[name] for name in fail_criteria_names]
+      ))
+
+      if analysis is not None:
+        # Only the inner positions are compared, starting from the second position
+        chain_angle_rows.extend((triple_id, i + 1, angle, diff)
+                                for i, (angle, diff) in enumerate(zip(analysis["chain_angles"], analysis["diffs"])))
+
+    self.connection.executemany(f"insert into triples values ({', '.join(['?'] * (13 + len(fail_criteria_names)))})",
+                                triple_rows)
+    self.connection.executemany("insert into chain_angles values (?, ?, ?, ?)", chain_angle_rows)
+
+  def close(self):
+    for table, columns in indexes:
+      self.connection.execute(f"create index {table}_{'_'.join(columns)} on {table} ({', '.join(columns)})")
+    self.connection.execute("commit")
+    self.connection.close()
+    os.replace(self.temp_file_name, self.file_name)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is None:
+      self.close()
+    else:
+      self.connection.close()
+      os.remove(self.temp_file_name)
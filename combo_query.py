@@ -0,0 +1,183 @@
+import bisect
+import heapq
+import json
+import os
+
+# Queries over the combos found by 3-find_all_combos.py. ComboIndex loads combinations.json once
+# and indexes it, and ComboQuery narrows the combos down with filters that can be chained:
+#
+#   index = ComboIndex.load()
+#   index.query().shifter_type("drop-bar").min_max_tooth(35).top(10, "maxToothAvailableAndCompatible", reverse=True)
+#
+# Part number and shifter type filters also match through equivalent parts, so a query for a
+# shifter finds the combos of the shifter it's equivalent to.
+
+class ComboIndex:
+  def __init__(self, combos, supported_combos=(), equivalent_shifters=(), equivalent_derailleurs=()):
+    self.combos = combos
+    self.equivalent_shifters = equivalent_shifters
+    self.equivalent_derailleurs = equivalent_derailleurs
+
+    equivalent_shifters_by_part_number = {}
+    for e in equivalent_shifters:
+      equivalent_shifters_by_part_number.setdefault(e["equivalentPartNumber"], []).append(e)
+
+    equivalent_derailleurs_by_part_number = {}
+    for e in equivalent_derailleurs:
+      equivalent_derailleurs_by_part_number.setdefault(e["equivalentPartNumber"], []).append(e)
+
+    self.supported_pairs = set((sc["shifterPartNumber"], sc["derailleurPartNumber"]) for sc in supported_combos)
+    self.supported_triples = set((sc["shifterPartNumber"], sc["derailleurPartNumber"], sc["cassettePartNumber"])
+                                 for sc in supported_combos)
+
+    # Each index maps a value to the set of indexes of the combos with it
+    self.by_shifter_part_number = {}
+    self.by_derailleur_part_number = {}
+    self.by_cassette_part_number = {}
+    self.by_shifter_type = {}
+    self.by_same_group = {}
+    self.by_more_cogs_than_shifts = {}
+    self.listed = []
+
+    for i, combo in enumerate(combos):
+      equiv_shifters = equivalent_shifters_by_part_number.get(combo["shifterPartNumber"], [])
+      equiv_derailleurs = equivalent_derailleurs_by_part_number.get(combo["derailleurPartNumber"], [])
+
+      for part_number in set([combo["shifterPartNumber"]] + [e["partNumber"] for e in equiv_shifters]):
+        self.by_shifter_part_number.setdefault(part_number, []).append(i)
+      for part_number in set([combo["derailleurPartNumber"]] + [e["partNumber"] for e in equiv_derailleurs]):
+        self.by_derailleur_part_number.setdefault(part_number, []).append(i)
+      for part_number in set(c["cassettePartNumber"] for c in combo["cassettes"]):
+        self.by_cassette_part_number.setdefault(part_number, []).append(i)
+      for shifter_type in set([combo["shifterType"]] + [e["type"] for e in equiv_shifters if "type" in e]):
+        self.by_shifter_type.setdefault(shifter_type, []).append(i)
+      self.by_same_group.setdefault(combo["sameGroup"], []).append(i)
+      self.by_more_cogs_than_shifts.setdefault(combo["moreCogsThanShifts"], []).append(i)
+      if self.is_listed(combo):
+        self.listed.append(i)
+
+    # Frozen sets, so filters intersect them without copying them first
+    for by_value in [self.by_shifter_part_number, self.by_derailleur_part_number, self.by_cassette_part_number,
+                     self.by_shifter_type, self.by_same_group, self.by_more_cogs_than_shifts]:
+      for value in by_value:
+        by_value[value] = frozenset(by_value[value])
+    self.listed = frozenset(self.listed)
+
+    # Combo indexes sorted by value, for range filters
+    self.sorted_by = {}
+    for field in ["maxToothAvailableAndCompatible", "chainWrap"]:
+      order = sorted(range(len(combos)), key=lambda i: combos[i][field])
+      self.sorted_by[field] = ([combos[i][field] for i in order], order)
+
+  @classmethod
+  def load(cls, folder="."):
+    def load(file_name):
+      with open(os.path.join(folder, file_name)) as f:
+        return json.load(f)
+
+    return cls(load("combinations.json"), load("supported_combinations.json"),
+               load("equivalent_shifters.json"), load("equivalent_derailleurs.json"))
+
+  def query(self):
+    return ComboQuery(self, None)
+
+  # Is the combo's shifter and derailleur pair listed as supported with any cassette?
+  def is_supported_pair(self, combo):
+    return (combo["shifterPartNumber"], combo["derailleurPartNumber"]) in self.supported_pairs
+
+  # Combos that go in the drop bar lists: mixed brands, same group, a shifter and derailleur from
+  # different groups of a brand, or a pair that's supported with some cassette
+  def is_listed(self, combo):
+    return (combo["brand"] == "Mixed"
+            or combo["sameGroup"]
+            or combo["derailleurName"] != combo["shifterName"]
+            or (not combo["sameGroup"] and self.is_supported_pair(combo)))
+
+  def at_least(self, field, value):
+    values, order = self.sorted_by[field]
+    return order[bisect.bisect_left(values, value):]
+
+# A set of combos from a ComboIndex. Filters return a new query, so queries can be reused
+class ComboQuery:
+  def __init__(self, index, combo_indexes):
+    self.index = index
+    # None means every combo, which saves building a set of all of them
+    self.combo_indexes = combo_indexes
+
+  # combo_indexes is a frozenset from the index
+  def filter_indexes(self, combo_indexes):
+    if self.combo_indexes is not None:
+      combo_indexes = self.combo_indexes & combo_indexes
+    return ComboQuery(self.index, combo_indexes)
+
+  # Once a query has been narrowed down, checking the combos left is cheaper than building a set of
+  # every combo in the range
+  def filter_at_least(self, field, value):
+    if self.combo_indexes is None:
+      return ComboQuery(self.index, frozenset(self.index.at_least(field, value)))
+    combos = self.index.combos
+    return ComboQuery(self.index, frozenset(i for i in self.combo_indexes if combos[i][field] >= value))
+
+  def shifter(self, part_number):
+    return self.filter_indexes(self.index.by_shifter_part_number.get(part_number, frozenset()))
+
+  def derailleur(self, part_number):
+    return self.filter_indexes(self.index.by_derailleur_part_number.get(part_number, frozenset()))
+
+  def cassette(self, part_number):
+    return self.filter_indexes(self.index.by_cassette_part_number.get(part_number, frozenset()))
+
+  def shifter_type(self, shifter_type):
+    return self.filter_indexes(self.index.by_shifter_type.get(shifter_type, frozenset()))
+
+  def same_group(self, same_group=True):
+    return self.filter_indexes(self.index.by_same_group.get(same_group, frozenset()))
+
+  def more_cogs_than_shifts(self, more_cogs_than_shifts=True):
+    return self.filter_indexes(self.index.by_more_cogs_than_shifts.get(more_cogs_than_shifts, frozenset()))
+
+  # Combos that ComboIndex.is_listed()
+  def listed(self):
+    return self.filter_indexes(self.index.listed)
+
+  def min_max_tooth(self, max_tooth):
+    return self.filter_at_least("maxToothAvailableAndCompatible", max_tooth)
+
+  def min_chain_wrap(self, chain_wrap):
+    return self.filter_at_least("chainWrap", chain_wrap)
+
+  # Filter with any function of a combo, for anything that isn't indexed
+  def where(self, predicate):
+    combos = self.index.combos
+    return ComboQuery(self.index, set(i for i in self.get_indexes() if predicate(combos[i])))
+
+  def union(self, other):
+    if self.combo_indexes is None or other.combo_indexes is None:
+      return ComboQuery(self.index, None)
+    return ComboQuery(self.index, self.combo_indexes | other.combo_indexes)
+
+  def get_indexes(self):
+    if self.combo_indexes is None:
+      return range(len(self.index.combos))
+    return sorted(self.combo_indexes)
+
+  # Matching combos, in combinations.json order
+  def all(self):
+    return [self.index.combos[i] for i in self.get_indexes()]
+
+  def count(self):
+    return len(self.index.combos) if self.combo_indexes is None else len(self.combo_indexes)
+
+  # Matching combos sorted by a field or key function. Ties stay in combinations.json order
+  def sorted(self, key, reverse=False):
+    return sorted(self.all(), key=get_key_function(key), reverse=reverse)
+
+  # The first k combos of sorted(key, reverse), without sorting all of them
+  def top(self, k, key, reverse=False):
+    select = heapq.nlargest if reverse else heapq.nsmallest
+    return select(k, self.all(), key=get_key_function(key))
+
+def get_key_function(key):
+  if callable(key):
+    return key
+  return lambda combo: combo[key]
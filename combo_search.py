@@ -0,0 +1,597 @@
+import json
+import os
+import time
+import numpy as np
+import util
+from models import get_shifter_model, get_derailleur_model, get_cassette_model, content_hash
+from util import calculate_max_chain_angles
+
+# Stage 3 combo search, split up by shifter so shifters can be searched in parallel.
+# 3-find_all_combos.py runs the search and writes out the results.
+
+# Lists produced by the search, in the order they're written out
+result_names = [
+  "combos",
+  "combos_trimmed",
+  "sensible_combos",
+  "sensible_combos_trimmed",
+  "partial_fail_combos",
+  "partial_fail_combos_other_trimmed",
+  "partial_fail_combos_confidence_trimmed",
+  "partial_fail_combos_chain_angle_trimmed",
+  "all_combos",
+  # Every triple's results, for combo_database.py
+  "triples"
+]
+
+# Reviews of an equivalent part count as reviews of the part it's equivalent to
+def get_part_numbers_reviewed(part_number, equivalents):
+  return [part_number] + [e["equivalentPartNumber"] for e in equivalents if e["partNumber"] == part_number]
+
+# All of the part and combo data the search reads, loaded once and indexed up front so
+# lookups in the search don't have to scan lists
+class Catalog:
+  def __init__(self, folder="."):
+    def load(file_name):
+      with open(os.path.join(folder, file_name)) as f:
+        return json.load(f)
+
+    self.shifters = [get_shifter_model(s) for s in load("all_shifters.json")]
+    self.equivalent_shifters = load("equivalent_shifters.json")
+    self.derailleurs = [get_derailleur_model(d) for d in load("all_derailleurs.json")]
+    self.equivalent_derailleurs = load("equivalent_derailleurs.json")
+    self.cassettes = [get_cassette_model(c) for c in load("cassettes.json")]
+    self.supported_combos = load("supported_combinations.json")
+    self.reviewed_combos = load("reviewed_combinations.json")
+    self.compatibility_ranges = load("compatibility_ranges.json")
+
+    self.cassettes_by_speeds = {}
+    for cassette in self.cassettes:
+      self.cassettes_by_speeds.setdefault(cassette["speeds"], []).append(cassette)
+
+    self.supported_combo_keys = set((sc["shifterPartNumber"], sc["derailleurPartNumber"], sc["cassettePartNumber"])
+                                    for sc in self.supported_combos)
+
+    self.equivalent_shifters_by_part_number = {}
+    for e in self.equivalent_shifters:
+      self.equivalent_shifters_by_part_number.setdefault(e["equivalentPartNumber"], []).append(e)
+
+    self.equivalent_derailleurs_by_part_number = {}
+    for e in self.equivalent_derailleurs:
+      self.equivalent_derailleurs_by_part_number.setdefault(e["equivalentPartNumber"], []).append(e)
+
+    # Index each review under every part number it applies to. Keep review indexes to preserve review order
+    self.reviews_by_combo_key = {}
+    for i, r in enumerate(self.reviewed_combos):
+      for shifter_part_number in get_part_numbers_reviewed(r["shifterPartNumber"], self.equivalent_shifters):
+        for derailleur_part_number in get_part_numbers_reviewed(r["derailleurPartNumber"], self.equivalent_derailleurs):
+          self.reviews_by_combo_key.setdefault(
+            (shifter_part_number, derailleur_part_number, r["cassettePartNumber"]), {})[i] = r
+
+  # Right shifters, in the order they're searched
+  def get_searched_shifters(self):
+    return [shifter for shifter in self.shifters
+            if not ("side" in shifter and shifter["side"] == "left")]
+
+# Fields of each part that a triple's results are calculated from. Change these, or
+# result_cache_version when the calculation changes, so cached results get recalculated
+shifter_result_fields = ["speeds", "shiftSpacings", "cablePull"]
+derailleur_result_fields = ["coefficients", "yawCoefficients", "pullRatio", "physicalLowLimit", "physicalHighLimit",
+                            "maxTooth", "maxToothUnofficial", "maxToothWithGoatLink"]
+cassette_result_fields = ["speeds", "pitches", "chainRollerWidth", "cogWidth", "averagePitch", "minMaxToothAvailable"]
+compatibility_range_result_fields = ["motionMultiplierAvg", "motionMultiplierStdev", "maxChainAngleMax"]
+util_result_constants = ["smallest_cog_position", "jockey_to_cog_links", "jockey_to_cog_distance", "max_cable_pull",
+                         "chain_max_free_yaw", "link_length"]
+result_cache_version = 3
+
+def get_triple_key(catalog, shifter, derailleur, cassette):
+  return content_hash({
+    "version": result_cache_version,
+    "shifter": dict((f, shifter.get(f)) for f in shifter_result_fields),
+    "derailleur": dict((f, derailleur.get(f)) for f in derailleur_result_fields),
+    "cassette": dict((f, cassette.get(f)) for f in cassette_result_fields),
+    "compatibilityRanges": dict((f, catalog.compatibility_ranges.get(f)) for f in compatibility_range_result_fields),
+    "constants": dict((c, getattr(util, c)) for c in util_result_constants)
+  })
+
+# Everything a triple can fail on. A triple is compatible when it fails none of them
+fail_criteria_names = [
+  "confidence_too_low",
+  "max_chain_angle_too_high",
+  "barrel_adjuster_too_low",
+  "barrel_adjuster_not_converged",
+  "least_pull_too_low",
+  "not_enough_range_on_derailleur",
+  "smallest_cassette_too_big"
+]
+
+# Fail criteria that only need the parts' scalar fields, so they can be checked before solving
+# for chain angles
+cheap_fail_criteria = ["confidence_too_low", "smallest_cassette_too_big", "not_enough_range_on_derailleur"]
+
+# Motion multiplier and confidence of many triples at once, as arrays
+def get_motion_multipliers(catalog, triples):
+  motion_multiplier_avg = catalog.compatibility_ranges["motionMultiplierAvg"]
+  motion_multiplier_stdev = catalog.compatibility_ranges["motionMultiplierStdev"]
+
+  average_pitches = np.array([c["averagePitch"] for _, _, c in triples], dtype=float)
+  cable_pulls = np.array([s["cablePull"] for s, _, _ in triples], dtype=float)
+  pull_ratios = np.array([d["pullRatio"] for _, d, _ in triples], dtype=float)
+
+  # Check to see how close [cable pull] * [pull ratio] is to [cog pitch]
+  multipliers = average_pitches / (cable_pulls * pull_ratios)
+
+  # Confidence = how close to the average motion multiplier are we, assuming a normal distribution?
+  # 1.0 means we're dead on, < 0.05 means we're further away than 95% of all groupsets
+  confidences = util.calc_two_sided_confidences(multipliers - motion_multiplier_avg, motion_multiplier_stdev)
+
+  return multipliers, confidences
+
+# Results for each triple that don't need solving for chain angles
+def get_all_cheap_triple_results(catalog, triples):
+  multipliers, confidences = get_motion_multipliers(catalog, triples)
+  return [get_cheap_triple_results(catalog, s, d, c, multiplier, confidence)
+          for (s, d, c), multiplier, confidence in zip(triples, multipliers.tolist(), confidences.tolist())]
+
+# The motion multiplier and confidence come from get_motion_multipliers(), and are worked out for
+# just this triple if they're not given
+def get_cheap_triple_results(catalog, shifter, derailleur, cassette, multiplier=None, confidence=None):
+  if multiplier is None or confidence is None:
+    multipliers, confidences = get_motion_multipliers(catalog, [(shifter, derailleur, cassette)])
+    multiplier, confidence = multipliers.item(), confidences.item()
+
+  smallest_cassette_too_big_official_max_tooth = "minMaxToothAvailable" in cassette and cassette["minMaxToothAvailable"] > derailleur["maxTooth"]
+  smallest_cassette_too_big_unofficial_max_tooth = cassette["minMaxToothAvailable"] > derailleur["maxToothUnofficial"] \
+    if "minMaxToothAvailable" in cassette and "maxToothUnofficial" in derailleur and derailleur["maxToothUnofficial"] != None \
+    else None
+  smallest_cassette_too_big_with_goat_link = cassette["minMaxToothAvailable"] > derailleur["maxToothWithGoatLink"] \
+    if "minMaxToothAvailable" in cassette and "maxToothWithGoatLink" in derailleur and derailleur["maxToothWithGoatLink"] != None \
+    else None
+  smallest_cassette_too_big = smallest_cassette_too_big_official_max_tooth \
+    and (smallest_cassette_too_big_unofficial_max_tooth or smallest_cassette_too_big_unofficial_max_tooth == None) \
+    and (smallest_cassette_too_big_with_goat_link or smallest_cassette_too_big_with_goat_link == None)
+
+  # Same arithmetic as derailleur_can_clear_cassette in util.calculate_max_chain_angles()
+  cog_positions = util.smallest_cog_position + cassette.cog_positions
+  cassette_total_pitch = cog_positions[-1] - cog_positions[0]
+  derailleur_range_of_motion = derailleur.physical_high_limit - derailleur.physical_low_limit
+
+  return {
+    "maxAngleAnalysis": None,
+    "motionMultiplier": multiplier,
+    "confidence": confidence,
+    "confidence_too_low": bool(confidence < 0.05),
+    "max_chain_angle_too_high": None,
+    "barrel_adjuster_too_low": None,
+    "barrel_adjuster_not_converged": None,
+    "least_pull_too_low": None,
+    "not_enough_range_on_derailleur": not bool(derailleur_range_of_motion * 1.03 > cassette_total_pitch),
+    "smallest_cassette_too_big_official_max_tooth": bool(smallest_cassette_too_big_official_max_tooth),
+    "smallest_cassette_too_big_unofficial_max_tooth": smallest_cassette_too_big_unofficial_max_tooth,
+    "smallest_cassette_too_big_with_goat_link": smallest_cassette_too_big_with_goat_link,
+    "smallest_cassette_too_big": bool(smallest_cassette_too_big)
+  }
+
+def add_solved_triple_results(catalog, triple_results, max_chain_angle_results):
+  max_chain_angle_max = catalog.compatibility_ranges["maxChainAngleMax"]
+
+  return {
+    **triple_results,
+    "maxAngleAnalysis": max_chain_angle_results,
+    "max_chain_angle_too_high": bool(max_chain_angle_results["max_chain_angle"] > max_chain_angle_max),
+    "barrel_adjuster_too_low": max_chain_angle_results["barrel_adjuster_too_low"],
+    "barrel_adjuster_not_converged": not max_chain_angle_results["barrel_adjuster_converged"],
+    "least_pull_too_low": max_chain_angle_results["least_pull_too_low"]
+  }
+
+# Stats for searching one shifter: how long it took, how many triples were found in and missing from
+# the result cache, and how many were solved, pruned and rejected by each cheap fail criterion
+def get_shard_stats():
+  return {
+    "time": 0.0,
+    "cacheHits": 0,
+    "cacheMisses": 0,
+    "triples": 0,
+    "solved": 0,
+    "pruned": 0,
+    "rejectedBy": dict((c, 0) for c in cheap_fail_criteria),
+    "solveTime": 0.0,
+    "prunedSolveTime": None
+  }
+
+# Results for each (shifter, derailleur, cassette) triple, keyed by part numbers. Triples found in
+# the cache are reused, and the rest are calculated in one batch and added to it.
+# With prune, triples that already fail one of cheap_fail_criteria skip solving for chain angles, so
+# their max_chain_angle_too_high, barrel_adjuster_too_low, barrel_adjuster_not_converged and
+# least_pull_too_low are left as None. Pruned results aren't cached. solve_pruned still solves
+# them afterwards, in their own batch, so the partial fail reports are complete and the time
+# pruning saves is measured instead of estimated. warn=False skips the warnings about cable pulls
+# without exactly one solution
+def get_all_triple_results(catalog, triples, cache=None, prune=False, solve_pruned=False, stats=None, warn=True):
+  stats = stats if stats is not None else get_shard_stats()
+  keys = [get_triple_key(catalog, *triple) for triple in triples]
+  triple_results = [cache.get(key) if cache is not None else None for key in keys]
+
+  missing = [i for i, r in enumerate(triple_results) if r is None]
+  for i, results in zip(missing, get_all_cheap_triple_results(catalog, [triples[i] for i in missing])):
+    triple_results[i] = results
+
+  pruned = [i for i in missing if prune and any(triple_results[i][c] for c in cheap_fail_criteria)]
+  pruned_indexes = set(pruned)
+  to_solve = [i for i in missing if i not in pruned_indexes]
+
+  def solve(indexes):
+    start = time.perf_counter()
+    max_chain_angle_results = calculate_max_chain_angles(*zip(*[triples[i] for i in indexes]), warn=warn)
+    elapsed = time.perf_counter() - start
+
+    for i, results in zip(indexes, max_chain_angle_results):
+      triple_results[i] = add_solved_triple_results(catalog, triple_results[i], results)
+      if cache is not None:
+        cache.put(keys[i], triple_results[i])
+
+    return elapsed
+
+  if len(to_solve) > 0:
+    stats["solveTime"] = stats["solveTime"] + solve(to_solve)
+
+  if solve_pruned and len(pruned) > 0:
+    stats["prunedSolveTime"] = (stats["prunedSolveTime"] or 0.0) + solve(pruned)
+
+  stats["triples"] = stats["triples"] + len(triples)
+  stats["solved"] = stats["solved"] + len(to_solve)
+  stats["pruned"] = stats["pruned"] + len(pruned)
+  for c in cheap_fail_criteria:
+    stats["rejectedBy"][c] = stats["rejectedBy"][c] + sum(1 for r in triple_results if r[c])
+
+  return dict(zip([(s["partNumber"], d["partNumber"], c["partNumber"]) for s, d, c in triples], triple_results))
+
+# Search one shifter, yielding the results for each derailleur as soon as they're done, so they can be
+# written out without holding on to the whole search
+def iter_shifter_combos(catalog, shifter, cache=None, prune=False, solve_pruned=False, stats=None):
+  derailleurs = catalog.derailleurs
+  cassettes_by_speeds = catalog.cassettes_by_speeds
+  supported_combo_keys = catalog.supported_combo_keys
+  reviews_by_combo_key = catalog.reviews_by_combo_key
+
+  # Calculate chain angles for all of this shifter's triples at once
+  triples = [(shifter, derailleur, cassette)
+             for derailleur in derailleurs
+             for speeds in range(9, 14)
+             for cassette in cassettes_by_speeds.get(speeds, [])]
+
+  triple_results_by_key = get_all_triple_results(catalog, triples, cache, prune, solve_pruned, stats)
+
+  equiv_shifters = catalog.equivalent_shifters_by_part_number.get(shifter["partNumber"], [])
+
+  for derailleur in derailleurs:
+    results = dict((name, []) for name in result_names)
+
+    combos = results["combos"]
+    combos_trimmed = results["combos_trimmed"]
+    sensible_combos = results["sensible_combos"]
+    sensible_combos_trimmed = results["sensible_combos_trimmed"]
+    partial_fail_combos = results["partial_fail_combos"]
+    partial_fail_combos_other_trimmed = results["partial_fail_combos_other_trimmed"]
+    partial_fail_combos_confidence_trimmed = results["partial_fail_combos_confidence_trimmed"]
+    partial_fail_combos_chain_angle_trimmed = results["partial_fail_combos_chain_angle_trimmed"]
+    all_combos = results["all_combos"]
+    triples_found = results["triples"]
+
+    equiv_derailleurs = catalog.equivalent_derailleurs_by_part_number.get(derailleur["partNumber"], [])
+
+    for speeds in range(9, 14):
+      shifter_name = shifter["brand"] + " " + shifter["name"]
+
+      if shifter["brand"] == derailleur["brand"]:
+        brand = shifter["brand"]
+        derailleur_name = derailleur["name"]
+      else:
+        brand = "Mixed"
+        derailleur_name = derailleur["brand"] + " " + derailleur["name"]
+
+      shifter_name = shifter_name + f' {shifter["speeds"]}-Speed'
+      derailleur_name = derailleur_name + f' {derailleur["designSpeeds"]}-Speed'
+      
+      if shifter["brand"] == derailleur["brand"] \
+        and shifter["name"] == derailleur["name"] \
+          and speeds == shifter["speeds"] and speeds == derailleur["designSpeeds"]:
+        # Same group
+        same_group = True
+        combo_name = partial_name = f"{shifter["brand"]} {shifter['name']} {speeds}-Speed group"
+      else:
+        same_group = False
+        partial_name = f"{shifter_name} shifter/{derailleur_name} derailleur"
+        combo_name = partial_name + f"/{speeds}-Speed cassette"
+
+      # Build combo info
+      combo = {
+        "brand": brand,
+        "name": combo_name,
+        "partialName": partial_name,
+        "shifterPartialName": shifter_name,
+        "derailleurPartialName": derailleur_name,
+        "speeds": speeds,
+        "accessibleSpeeds": min(shifter["speeds"], speeds),
+        "sameGroup": same_group,
+        "shifterPartNumber": shifter["partNumber"],
+        "shifterName": shifter["name"],
+        "shifterBrand": shifter["brand"],
+        "derailleurPartNumber": derailleur["partNumber"],
+        "derailleurName": derailleur["name"],
+        "derailleurBrand": derailleur["brand"],
+        "cassettes": [],
+        "shifterType": shifter["type"],
+        "noMatchingFrontShifter": shifter["hasMatchingFrontShifters"] == False
+          and derailleur["supportsMultipleFrontChainrings"],
+        "moreCogsThanShifts": shifter["speeds"] < speeds,
+        "moreShiftsThanCogs": shifter["speeds"] > speeds,
+        "maxToothAvailableAndCompatible": 0,
+        "maxToothAvailableAndUnofficiallyCompatible": 0,
+        "maxToothAvailableAndCompatibleWithGoatLink": 0,
+        "maxToothAvailableAndSupported": 0,
+        "supported": False,
+        "chainWrap": derailleur["chainWrap"],
+        "equivalentShifters": equiv_shifters,
+        "equivalentDerailleurs": equiv_derailleurs
+      }
+
+      # Look for compatible cassettes
+      for cassette in cassettes_by_speeds.get(speeds, []):
+        
+        triple_results = triple_results_by_key[
+          (shifter["partNumber"], derailleur["partNumber"], cassette["partNumber"])]
+        max_chain_angle_results = triple_results["maxAngleAnalysis"]
+        pruned = max_chain_angle_results is None
+
+        multiplier = triple_results["motionMultiplier"]
+        confidence = triple_results["confidence"]
+        confidence_too_low = triple_results["confidence_too_low"]
+        max_chain_angle_too_high = triple_results["max_chain_angle_too_high"]
+        barrel_adjuster_too_low = triple_results["barrel_adjuster_too_low"]
+        barrel_adjuster_not_converged = triple_results["barrel_adjuster_not_converged"]
+        least_pull_too_low = triple_results["least_pull_too_low"]
+        not_enough_range_on_derailleur = triple_results["not_enough_range_on_derailleur"]
+        smallest_cassette_too_big_official_max_tooth = triple_results["smallest_cassette_too_big_official_max_tooth"]
+        smallest_cassette_too_big_unofficial_max_tooth = triple_results["smallest_cassette_too_big_unofficial_max_tooth"]
+        smallest_cassette_too_big_with_goat_link = triple_results["smallest_cassette_too_big_with_goat_link"]
+        smallest_cassette_too_big = triple_results["smallest_cassette_too_big"]
+
+        fail_criteria = [
+          confidence_too_low, max_chain_angle_too_high, barrel_adjuster_too_low, barrel_adjuster_not_converged,
+          least_pull_too_low, not_enough_range_on_derailleur, smallest_cassette_too_big
+        ]
+
+        all_combos.append({
+          "brand": brand,
+          "name": combo_name,
+          "shifterPartNumber": shifter["partNumber"],
+          "shifterName": shifter["name"],
+          "shifterBrand": shifter["brand"],
+          "shifterSpeeds": shifter["speeds"],
+          "shifterCablePull": round(shifter["cablePull"], 2),
+          "shifterType": shifter["type"],
+          "shifterSide": shifter["side"] if "side" in shifter else "",
+          "derailleurPartNumber": derailleur["partNumber"],
+          "derailleurName": derailleur["name"],
+          "derailleurBrand": derailleur["brand"],
+          "derailleurDesignSpeeds": derailleur["designSpeeds"],
+          "derailleurPullRatio": round(derailleur["pullRatio"], 2),
+          "derailleurSupportsMultipleFrontChainrings": derailleur["supportsMultipleFrontChainrings"],
+          "cassettePartNumber": cassette["partNumber"],
+          "cassetteName": cassette["name"],
+          "cassetteBrand": cassette["brand"],
+          "cassetteSpeeds": cassette["speeds"],
+          "cassettePitch": cassette["averagePitch"],
+          "cassetteMinMaxToothAvailable": cassette["minMaxToothAvailable"] if "minMaxToothAvailable" in cassette else "",
+          "cassetteMaxToothAvailable": cassette["maxToothAvailable"],
+          "confidence_too_low": bool(confidence_too_low),
+          "max_chain_angle_too_high": max_chain_angle_too_high,
+          "barrel_adjuster_too_low": barrel_adjuster_too_low,
+          "barrel_adjuster_not_converged": barrel_adjuster_not_converged,
+          "least_pull_too_low": least_pull_too_low,
+          "not_enough_range_on_derailleur": bool(not_enough_range_on_derailleur),
+          "smallest_cassette_too_big_official_max_tooth": bool(smallest_cassette_too_big_official_max_tooth),
+          "smallest_cassette_too_big_unofficial_max_tooth": smallest_cassette_too_big_unofficial_max_tooth,
+          "smallest_cassette_too_big_with_goat_link": smallest_cassette_too_big_with_goat_link,
+          "smallest_cassette_too_big": bool(smallest_cassette_too_big),
+          "maxChainAngle": max_chain_angle_results["max_chain_angle"] if not pruned else None,
+          "motionMultiplier": multiplier,
+          "numberOfShiftsMatchesCogs": shifter["speeds"] == cassette["speeds"],
+          "moreCogsThanShifts": cassette["speeds"] > shifter["speeds"]
+        })
+
+        triples_found.append({
+          "name": combo_name,
+          "brand": brand,
+          "sameGroup": same_group,
+          "shifterPartNumber": shifter["partNumber"],
+          "derailleurPartNumber": derailleur["partNumber"],
+          "cassettePartNumber": cassette["partNumber"],
+          "compatible": not any(fail_criteria),
+          "supported": (shifter["partNumber"], derailleur["partNumber"], cassette["partNumber"]) in supported_combo_keys,
+          **triple_results
+        })
+
+        #Log combos that fail any, but not all criteria. Pruned combos can't be told apart from ones that fail everything
+        if any(fail_criteria):
+          if not pruned and not all(fail_criteria):
+            partial_fail_combos.append({
+              "confidence_too_low": bool(confidence_too_low),
+              "max_chain_angle_too_high": bool(max_chain_angle_too_high),
+              "barrel_adjuster_too_low": bool(barrel_adjuster_too_low),
+              "barrel_adjuster_not_converged": bool(barrel_adjuster_not_converged),
+              "least_pull_too_low": bool(least_pull_too_low),
+              "not_enough_range_on_derailleur": bool(not_enough_range_on_derailleur),
+              "smallest_cassette_too_big_official_max_tooth": bool(smallest_cassette_too_big_official_max_tooth),
+              "smallest_cassette_too_big_unofficial_max_tooth": smallest_cassette_too_big_unofficial_max_tooth,
+              "smallest_cassette_too_big_with_goat_link": smallest_cassette_too_big_with_goat_link,
+              "smallest_cassette_too_big": bool(smallest_cassette_too_big),
+              **combo,
+              "cassettePartNumber": cassette["partNumber"],
+              "confidence": confidence,
+              "maxChainAngle": max_chain_angle_results["max_chain_angle"],
+              "maxAngleAnalysis": max_chain_angle_results,
+              "motionMultiplier": multiplier,
+              "equivalentShifters": [],
+              "equivalentDerailleurs": [],
+              "cassettes": []
+            })
+            partial_fail_info = {
+              "brand": brand,
+              "name": combo_name,
+              "shifterPartNumber": shifter["partNumber"],
+              "shifterName": shifter["name"],
+              "shifterBrand": shifter["brand"],
+              "derailleurPartNumber": derailleur["partNumber"],
+              "derailleurName": derailleur["name"],
+              "derailleurBrand": derailleur["brand"],
+              "cassettePartNumber": cassette["partNumber"],
+              "cassetteName": cassette["name"],
+              "cassetteBrand": cassette["brand"],
+              "confidence_too_low": bool(confidence_too_low),
+              "max_chain_angle_too_high": bool(max_chain_angle_too_high),
+              "barrel_adjuster_too_low": bool(barrel_adjuster_too_low),
+              "barrel_adjuster_not_converged": bool(barrel_adjuster_not_converged),
+              "least_pull_too_low": bool(least_pull_too_low),
+              "not_enough_range_on_derailleur": bool(not_enough_range_on_derailleur),
+              "smallest_cassette_too_big_official_max_tooth": bool(smallest_cassette_too_big_official_max_tooth),
+              "smallest_cassette_too_big_unofficial_max_tooth": smallest_cassette_too_big_unofficial_max_tooth,
+              "smallest_cassette_too_big_with_goat_link": smallest_cassette_too_big_with_goat_link,
+              "smallest_cassette_too_big": bool(smallest_cassette_too_big),
+            }
+
+            if not confidence_too_low and not max_chain_angle_too_high:
+              partial_fail_combos_other_trimmed.append(partial_fail_info)
+            elif confidence_too_low:
+              partial_fail_combos_confidence_trimmed.append(partial_fail_info)
+            elif max_chain_angle_too_high: 
+              partial_fail_combos_chain_angle_trimmed.append(partial_fail_info)
+            
+        else:
+        
+          if max_chain_angle_results["most_pull_too_high"]:
+            print(f"Warning: most pull too high for {combo['name']} with cassette {cassette["partNumber"]}")
+          
+          maxToothAvailableAndCompatible = min(derailleur["maxTooth"], cassette["maxToothAvailable"])
+          maxToothAvailableAndUnofficiallyCompatible = min(derailleur["maxToothUnofficial"], cassette["maxToothAvailable"]) \
+            if "maxToothUnofficial" in derailleur and derailleur["maxToothUnofficial"] != None \
+            else 0
+          maxToothAvailableAndCompatibleWithGoatLink = min(derailleur["maxToothWithGoatLink"], cassette["maxToothAvailable"]) \
+            if "maxToothWithGoatLink" in derailleur and derailleur["maxToothWithGoatLink"] != None \
+            else 0
+
+          supported = (shifter["partNumber"], derailleur["partNumber"], cassette["partNumber"]) in supported_combo_keys
+
+          combo["cassettes"].append({
+            "cassettePartNumber": cassette["partNumber"],
+            "cassetteName": cassette["name"],
+            "cassetteBrand": cassette["brand"],
+            "confidence": confidence,
+            "supported": supported,
+            "maxToothAvailableAndCompatible": maxToothAvailableAndCompatible,
+            "maxToothAvailableAndUnofficiallyCompatible": maxToothAvailableAndUnofficiallyCompatible,
+            "maxToothAvailableAndCompatibleWithGoatLink": maxToothAvailableAndCompatibleWithGoatLink,
+            "maxChainAngle": max_chain_angle_results["max_chain_angle"],
+            "maxAngleAnalysis": max_chain_angle_results,
+            "motionMultiplier": multiplier,
+            "smallest_cassette_too_big_official_max_tooth": bool(smallest_cassette_too_big_official_max_tooth),
+            "smallest_cassette_too_big_unofficial_max_tooth": smallest_cassette_too_big_unofficial_max_tooth,
+            "smallest_cassette_too_big_with_goat_link": smallest_cassette_too_big_with_goat_link
+          })
+
+          # Update combo max tooth with cassette info
+          combo["maxToothAvailableAndCompatible"] = max(combo["maxToothAvailableAndCompatible"], maxToothAvailableAndCompatible)
+          combo["maxToothAvailableAndUnofficiallyCompatible"] = max(combo["maxToothAvailableAndUnofficiallyCompatible"], maxToothAvailableAndUnofficiallyCompatible)
+          combo["maxToothAvailableAndCompatibleWithGoatLink"] = max(combo["maxToothAvailableAndCompatibleWithGoatLink"], maxToothAvailableAndCompatibleWithGoatLink)
+          if supported:
+            combo["maxToothAvailableAndSupported"] = max(combo["maxToothAvailableAndSupported"], maxToothAvailableAndCompatible)
+          combo["supported"] = combo["supported"] or supported
+          trimmed_combo = {
+            "brand": brand,
+            "name": combo_name,
+            "shifterPartNumber": shifter["partNumber"],
+            "shifterName": shifter["name"],
+            "shifterBrand": shifter["brand"],
+            "derailleurPartNumber": derailleur["partNumber"],
+            "derailleurName": derailleur["name"],
+            "derailleurBrand": derailleur["brand"],
+            "cassettePartNumber": cassette["partNumber"],
+            "cassetteName": cassette["name"],
+            "cassetteBrand": cassette["brand"],
+          }
+          combos_trimmed.append(trimmed_combo)
+          if cassette["speeds"] <= shifter["speeds"]:
+            sensible_combos.append(combo)
+            sensible_combos_trimmed.append(trimmed_combo)
+      
+      # Save combo if compatible cassette was found
+      if len(combo["cassettes"]) > 0:
+        # Find reviews
+        reviews_by_index = {}
+        for c in combo["cassettes"]:
+          reviews_by_index.update(reviews_by_combo_key.get(
+            (shifter["partNumber"], derailleur["partNumber"], c["cassettePartNumber"]), {}))
+        reviews = [reviews_by_index[i] for i in sorted(reviews_by_index)]
+        
+        combo["reviews"] = reviews
+
+        if len(reviews) > 0:
+          positive_reviews = [r for r in reviews if r["sentiment"] == "positive"]
+          negative_reviews = [r for r in reviews if r["sentiment"] == "negative"]
+          if len(positive_reviews) > 0 and len(negative_reviews) > 0:
+            combo["reviewsSentiment"] = "mixed"
+          elif len(positive_reviews) > 0:
+            combo["reviewsSentiment"] = "positive"
+          else:
+            combo["reviewsSentiment"] = "negative"
+        else:
+          combo["reviewsSentiment"] = "none"
+        
+        combos.append(combo)
+
+    yield results
+
+def extend_results(results, more_results):
+  for name in result_names:
+    results[name].extend(more_results[name])
+
+def find_shifter_combos(catalog, shifter, cache=None, prune=False, solve_pruned=False, stats=None):
+  results = dict((name, []) for name in result_names)
+  for derailleur_results in iter_shifter_combos(catalog, shifter, cache, prune, solve_pruned, stats):
+    extend_results(results, derailleur_results)
+  return results
+
+# Process pool workers get the catalog and result cache once, when they start, instead of with every shifter
+worker_catalog = None
+worker_cache = None
+worker_prune = False
+worker_solve_pruned = False
+
+def init_worker(catalog, cache=None, prune=False, solve_pruned=False):
+  global worker_catalog, worker_cache, worker_prune, worker_solve_pruned
+  worker_catalog = catalog
+  worker_cache = cache
+  worker_prune = prune
+  worker_solve_pruned = solve_pruned
+
+# Search one shifter in this worker, yielding each derailleur's results. Fills in stats from get_shard_stats()
+def iter_shifter_combos_in_worker(shifter_index, stats):
+  start = time.perf_counter()
+  hits, misses = (worker_cache.hits, worker_cache.misses) if worker_cache is not None else (0, 0)
+
+  yield from iter_shifter_combos(worker_catalog, worker_catalog.shifters[shifter_index], worker_cache,
+                                 worker_prune, worker_solve_pruned, stats)
+
+  if worker_cache is not None:
+    stats["cacheHits"] = worker_cache.hits - hits
+    stats["cacheMisses"] = worker_cache.misses - misses
+  stats["time"] = time.perf_counter() - start
+
+# Returns the shifter's results and stats, for process pools
+def find_shifter_combos_in_worker(shifter_index):
+  stats = get_shard_stats()
+  results = dict((name, []) for name in result_names)
+  for derailleur_results in iter_shifter_combos_in_worker(shifter_index, stats):
+    extend_results(results, derailleur_results)
+  return results, stats
@@ -0,0 +1,302 @@
+import json
+import math
+import argparse
+import threading
+import time
+import urllib.request
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from combo_search import Catalog, fail_criteria_names, get_all_triple_results
+from combo_query import ComboIndex
+from models import ShifterModel, DerailleurModel, CassetteModel
+
+# Local HTTP service for compatibility questions. The catalog and the stage 3 combos are loaded
+# once at startup.
+#
+#   GET  /combos?shifter=...&derailleur=...&cassette=...&shifterType=...&sameGroup=true
+#               &minMaxTooth=...&minChainWrap=...&limit=...
+#     Combos from combinations.json, through combo_query
+#   POST /evaluate  {"shifter": {...}} or {"derailleur": {...}} or {"cassette": {...}}
+#     Scores a hypothetical part against every part in the catalog it could be combined with,
+#     the same way 3-find_all_combos.py does. Add "details": true for the chain angle analysis
+#   GET  /stats
+#     Request counts, latency and throughput for each endpoint
+#
+# Bad requests get a 400 with the reason, and anything that goes wrong evaluating a request that
+# looked valid gets a 500, both as {"error": ...}
+
+# Fields a hypothetical part needs to be evaluated, with their types. Optional fields can also be left
+# out or null. Numbers have to be finite, and the motion multiplier divides by cablePull and pullRatio
+part_fields = {
+  "shifter": {"partNumber": "string", "speeds": "integer", "cablePull": "positive", "shiftSpacings": "numbers"},
+  "derailleur": {"partNumber": "string", "pullRatio": "positive", "coefficients": "curve",
+                 "physicalLowLimit": "number", "physicalHighLimit": "number", "maxTooth": "number"},
+  "cassette": {"partNumber": "string", "speeds": "integer", "pitches": "numbers", "averagePitch": "positive",
+               "chainRollerWidth": "number", "cogWidth": "number"}
+}
+optional_part_fields = {
+  "shifter": {},
+  "derailleur": {"yawCoefficients": "numbers", "maxToothUnofficial": "number", "maxToothWithGoatLink": "number"},
+  "cassette": {"minMaxToothAvailable": "number"}
+}
+field_type_names = {"string": "string", "integer": "positive integer", "number": "finite number",
+                    "positive": "positive finite number", "numbers": "non-empty list of finite numbers",
+                    "curve": "list of at least two finite numbers, for a polynomial of degree 1 or more"}
+# Models are built directly rather than through the model caches, so hypothetical parts don't push
+# catalog parts out of them
+part_model_types = {"shifter": ShifterModel, "derailleur": DerailleurModel, "cassette": CassetteModel}
+
+def is_number(value):
+  return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+def has_type(value, field_type):
+  if field_type == "string":
+    return isinstance(value, str)
+  if field_type == "integer":
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+  if field_type == "number":
+    return is_number(value)
+  if field_type == "positive":
+    return is_number(value) and value > 0
+  min_length = 2 if field_type == "curve" else 1
+  return isinstance(value, list) and len(value) >= min_length and all(is_number(v) for v in value)
+
+# JSON has no NaN or Infinity, so non-finite numbers in a response, like the max chain angle of a
+# triple that didn't converge, are sent as null
+def replace_non_finite(value):
+  if isinstance(value, float):
+    return value if math.isfinite(value) else None
+  if isinstance(value, dict):
+    return dict((k, replace_non_finite(v)) for k, v in value.items())
+  if isinstance(value, (list, tuple)):
+    return [replace_non_finite(v) for v in value]
+  return value
+
+# Raises ValueError, which becomes a 400, for a part that's missing a field or has one of the wrong type
+def validate_part(kind, info):
+  if not isinstance(info, dict):
+    raise ValueError(f"Expected {kind} to be an object")
+  for field, field_type in part_fields[kind].items():
+    if field not in info or not has_type(info[field], field_type):
+      raise ValueError(f"Expected {kind} field {field} to be a {field_type_names[field_type]}")
+  for field, field_type in optional_part_fields[kind].items():
+    if info.get(field) is not None and not has_type(info[field], field_type):
+      raise ValueError(f"Expected {kind} field {field} to be a {field_type_names[field_type]} or null")
+
+class CompatibilityService:
+  def __init__(self, folder="."):
+    self.catalog = Catalog(folder)
+    self.index = ComboIndex.load(folder)
+    self.start_time = time.perf_counter()
+    self.stats_lock = threading.Lock()
+    self.latencies = {}
+    self.request_counts = {}
+    # Models and the batched solver aren't thread safe, so evaluations run one at a time
+    self.evaluate_lock = threading.Lock()
+
+  def record(self, endpoint, latency):
+    with self.stats_lock:
+      self.latencies.setdefault(endpoint, deque(maxlen=10000)).append(latency)
+      self.request_counts[endpoint] = self.request_counts.get(endpoint, 0) + 1
+
+  def get_stats(self):
+    with self.stats_lock:
+      uptime = time.perf_counter() - self.start_time
+      stats = {"uptime": uptime, "endpoints": {}}
+      for endpoint, latencies in self.latencies.items():
+        ordered = sorted(latencies)
+        stats["endpoints"][endpoint] = {
+          "requests": self.request_counts[endpoint],
+          "requestsPerSecond": self.request_counts[endpoint] / uptime,
+          "meanLatencyMs": sum(ordered) / len(ordered) * 1000,
+          "p50LatencyMs": ordered[len(ordered) // 2] * 1000,
+          "p95LatencyMs": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+          "maxLatencyMs": ordered[-1] * 1000
+        }
+      return stats
+
+  def find_combos(self, params):
+    query = self.index.query()
+    if "shifter" in params:
+      query = query.shifter(params["shifter"])
+    if "derailleur" in params:
+      query = query.derailleur(params["derailleur"])
+    if "cassette" in params:
+      query = query.cassette(params["cassette"])
+    if "shifterType" in params:
+      query = query.shifter_type(params["shifterType"])
+    if "sameGroup" in params:
+      query = query.same_group(params["sameGroup"] == "true")
+    if "minMaxTooth" in params:
+      query = query.min_max_tooth(int(params["minMaxTooth"]))
+    if "minChainWrap" in params:
+      query = query.min_chain_wrap(int(params["minChainWrap"]))
+
+    combos = query.all()
+    if "limit" in params:
+      combos = combos[:int(params["limit"])]
+    return combos
+
+  # The validated model of the hypothetical part in a request, and which kind of part it is
+  def get_hypothetical_part(self, request):
+    if not isinstance(request, dict):
+      raise ValueError("Expected a JSON object")
+    kinds = [kind for kind in part_fields if kind in request]
+    if len(kinds) != 1:
+      raise ValueError("Expected one shifter, derailleur or cassette to evaluate")
+
+    kind = kinds[0]
+    validate_part(kind, request[kind])
+    return kind, part_model_types[kind](request[kind])
+
+  # Triples of a hypothetical part with every part it could be combined with in the search
+  def get_hypothetical_triples(self, kind, part):
+    catalog = self.catalog
+    speeds_searched = range(9, 14)
+
+    if kind == "shifter":
+      return [(part, d, c) for d in catalog.derailleurs
+              for speeds in speeds_searched for c in catalog.cassettes_by_speeds.get(speeds, [])]
+    if kind == "derailleur":
+      return [(s, part, c) for s in catalog.get_searched_shifters()
+              for speeds in speeds_searched for c in catalog.cassettes_by_speeds.get(speeds, [])]
+    return [(s, d, part) for s in catalog.get_searched_shifters() for d in catalog.derailleurs]
+
+  def evaluate(self, request):
+    kind, part = self.get_hypothetical_part(request)
+    with self.evaluate_lock:
+      triples = self.get_hypothetical_triples(kind, part)
+      triple_results = get_all_triple_results(self.catalog, triples, warn=False)
+
+    evaluated = []
+    for s, d, c in triples:
+      results = triple_results[(s["partNumber"], d["partNumber"], c["partNumber"])]
+      analysis = results["maxAngleAnalysis"]
+      evaluated.append({
+        "shifterPartNumber": s["partNumber"],
+        "derailleurPartNumber": d["partNumber"],
+        "cassettePartNumber": c["partNumber"],
+        # Not converging is one of the fail criteria
+        "compatible": not any(results[name] for name in fail_criteria_names),
+        "barrelAdjusterConverged": analysis["barrel_adjuster_converged"],
+        "confidence": results["confidence"],
+        "motionMultiplier": results["motionMultiplier"],
+        "maxChainAngle": analysis["max_chain_angle"],
+        **dict((name, results[name]) for name in fail_criteria_names),
+        **({"maxAngleAnalysis": analysis} if request.get("details") else {})
+      })
+
+    return {
+      "triples": len(evaluated),
+      "compatible": sum(1 for e in evaluated if e["compatible"]),
+      "results": evaluated
+    }
+
+class CompatibilityRequestHandler(BaseHTTPRequestHandler):
+  # Set on the handler class by create_server()
+  service = None
+
+  def do_GET(self):
+    url = urlparse(self.path)
+    params = dict((k, v[-1]) for k, v in parse_qs(url.query).items())
+    if url.path == "/combos":
+      self.respond(url.path, lambda: self.service.find_combos(params))
+    elif url.path == "/stats":
+      self.respond(url.path, self.service.get_stats)
+    else:
+      self.respond(url.path, None)
+
+  def do_POST(self):
+    url = urlparse(self.path)
+    if url.path == "/evaluate":
+      length = int(self.headers.get("Content-Length", 0))
+      body = self.rfile.read(length)
+      self.respond(url.path, lambda: self.service.evaluate(json.loads(body)))
+    else:
+      self.respond(url.path, None)
+
+  def respond(self, endpoint, get_response):
+    start = time.perf_counter()
+
+    if get_response is None:
+      status, response = 404, {"error": f"Unknown endpoint {endpoint}"}
+    else:
+      try:
+        status, response = 200, get_response()
+      except ValueError as e:
+        # Bad JSON, missing or mistyped part fields or bad query parameters
+        status, response = 400, {"error": f"{type(e).__name__}: {e}"}
+      except Exception as e:
+        status, response = 500, {"error": f"{type(e).__name__}: {e}"}
+
+    body = json.dumps(replace_non_finite(response), allow_nan=False).encode()
+    latency = time.perf_counter() - start
+
+    self.send_response(status)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(body)))
+    self.send_header("X-Response-Time-Ms", f"{latency * 1000:.3f}")
+    self.end_headers()
+    self.wfile.write(body)
+
+    if get_response is not None:
+      self.service.record(endpoint, latency)
+    if not self.server.quiet:
+      self.log_message('"%s" %s %.1f ms', self.requestline, status, latency * 1000)
+
+  # Requests are logged by respond(), with their latency
+  def log_request(self, code="-", size="-"):
+    pass
+
+def create_server(service, host="127.0.0.1", port=8000, quiet=False):
+  handler = type("Handler", (CompatibilityRequestHandler,), {"service": service})
+  server = ThreadingHTTPServer((host, port), handler)
+  server.quiet = quiet
+  return server
+
+# Run a server on localhost in the background and time requests to it
+def benchmark(service, requests):
+  server = create_server(service, port=0, quiet=True)
+  thread = threading.Thread(target=server.serve_forever, daemon=True)
+  thread.start()
+  url = f"http://127.0.0.1:{server.server_address[1]}"
+
+  derailleur = service.catalog.derailleurs[0].info
+  hypothetical = {"derailleur": dict(derailleur, partNumber="hypothetical", pullRatio=derailleur["pullRatio"] * 1.02)}
+  cases = [
+    ("GET /combos", lambda: urllib.request.urlopen(f"{url}/combos?shifterType=drop-bar&minMaxTooth=35").read()),
+    ("POST /evaluate", lambda: urllib.request.urlopen(urllib.request.Request(
+      f"{url}/evaluate", data=json.dumps(hypothetical).encode(), headers={"Content-Type": "application/json"})).read())
+  ]
+
+  for name, send in cases:
+    start = time.perf_counter()
+    for _ in range(requests):
+      send()
+    elapsed = time.perf_counter() - start
+    print(f"{name}: {requests} requests in {elapsed:.2f} s, {requests / elapsed:.1f} requests/s")
+
+  print(json.dumps(json.loads(urllib.request.urlopen(f"{url}/stats").read()), indent=2))
+  server.shutdown()
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8000)
+  parser.add_argument("--quiet", action="store_true", help="Don't log each request")
+  parser.add_argument("--benchmark", type=int, metavar="REQUESTS", default=0,
+                      help="Instead of serving, time this many requests to each endpoint on localhost")
+  args = parser.parse_args()
+
+  service = CompatibilityService()
+
+  if args.benchmark > 0:
+    benchmark(service, args.benchmark)
+  else:
+    server = create_server(service, args.host, args.port, args.quiet)
+    print(f"Serving on http://{args.host}:{server.server_address[1]}")
+    try:
+      server.serve_forever()
+    except KeyboardInterrupt:
+      pass
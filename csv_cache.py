@@ -0,0 +1,156 @@
+import io
+import os
+import glob
+import json
+import hashlib
+import tempfile
+import numpy as np
+from util import parse_csv_columns
+
+# Parsed measurement CSVs, so the stage 1 scripts don't parse every CSV again on every run. Each script
+# has an archive of the CSVs it reads: every number column of every CSV, one after another in a single
+# .npy file that's memory-mapped, so loading a CSV from it is just a slice, and a JSON index with where
+# each CSV's columns are, their string columns, and the size, modification time and content hash of
+# the CSV they came from
+#
+# A CSV's entry is used while its size and modification time match, or if only the time changed, while
+# its content hash does. Anything else is parsed again. update() brings an archive up to date before the
+# analysis starts, and load() can be called from any worker
+cache_folder = ".csv_cache"
+cache_version = 1
+
+# Archives loaded by this process, by name
+archives = {}
+
+def get_index_path(name):
+  return os.path.join(cache_folder, f"{name}.json")
+
+def get_archive(name):
+  if name not in archives:
+    try:
+      with open(get_index_path(name)) as f:
+        index = json.load(f)
+      if index["version"] != cache_version:
+        raise ValueError(index["version"])
+      values = np.load(os.path.join(cache_folder, index["values"]), mmap_mode="r")
+    except (OSError, ValueError, KeyError):
+      index = {"version": cache_version, "values": None, "files": {}}
+      values = np.empty(0)
+    archives[name] = (index, values)
+  return archives[name]
+
+def hash_data(data):
+  return hashlib.sha256(data).hexdigest()
+
+def parse_data(data, transposed):
+  return parse_csv_columns(io.StringIO(data.decode(), newline=''), transposed)
+
+# The archive entry of input_file if it still matches the file, with its modification time updated if
+# only that changed, otherwise None
+def get_current_entry(entry, input_file, stat, transposed):
+  if entry is None or entry["transposed"] != transposed or entry["size"] != stat.st_size:
+    return None
+  if entry["mtime"] == stat.st_mtime_ns:
+    return entry
+
+  with open(input_file, "rb") as f:
+    data = f.read()
+  if entry["sha256"] != hash_data(data):
+    return None
+  return {**entry, "mtime": stat.st_mtime_ns}
+
+def get_entry_columns(entry, values):
+  columns = {}
+  for name, kind, column in entry["columns"]:
+    if kind == "numbers":
+      offset, length = column
+      columns[name] = values[offset:offset + length]
+    else:
+      columns[name] = np.array(column, dtype=str)
+  return columns
+
+# The columns of a CSV, like read_csv_columns() returns. Number columns from the archive are read-only
+def load(name, input_file, transposed=False):
+  index, values = get_archive(name)
+  entry = get_current_entry(index["files"].get(input_file), input_file, os.stat(input_file), transposed)
+  if entry is not None:
+    return get_entry_columns(entry, values)
+
+  with open(input_file, "rb") as f:
+    return parse_data(f.read(), transposed)
+
+# Adds the CSVs that are new or have changed since they were archived to the archive, and drops the
+# ones that no longer exist. Returns how many CSVs were parsed
+def update(name, input_files, transposed=False):
+  index, values = get_archive(name)
+
+  files = {}
+  columns_by_file = {}
+  changed = False
+  for input_file, entry in index["files"].items():
+    if os.path.exists(input_file):
+      files[input_file] = entry
+    else:
+      changed = True
+
+  for input_file in input_files:
+    stat = os.stat(input_file)
+    entry = files.get(input_file)
+    current_entry = get_current_entry(entry, input_file, stat, transposed)
+    if current_entry is not None:
+      changed = changed or current_entry is not entry
+      files[input_file] = current_entry
+      continue
+
+    with open(input_file, "rb") as f:
+      data = f.read()
+    files[input_file] = {"transposed": transposed, "size": stat.st_size, "mtime": stat.st_mtime_ns,
+                         "sha256": hash_data(data)}
+    columns_by_file[input_file] = parse_data(data, transposed)
+    changed = True
+
+  if not changed:
+    return 0
+
+  # Lay out the number columns of every CSV again, whether they came from the old archive or were
+  # just parsed
+  numbers = []
+  offset = 0
+  for input_file, entry in files.items():
+    if input_file in columns_by_file:
+      columns = columns_by_file[input_file]
+    else:
+      columns = get_entry_columns(entry, values)
+    entry["columns"] = []
+    for column_name, column in columns.items():
+      if column.dtype.kind == "f":
+        entry["columns"].append([column_name, "numbers", [offset, len(column)]])
+        numbers.append(column)
+        offset = offset + len(column)
+      else:
+        entry["columns"].append([column_name, "strings", column.tolist()])
+
+  save_archive(name, {"version": cache_version, "files": files},
+               np.concatenate(numbers) if numbers else np.empty(0))
+  return len(columns_by_file)
+
+# Writes the values under a new name before the index that points to them, so an archive that's being
+# read is never changed underneath its reader
+def save_archive(name, index, values):
+  os.makedirs(cache_folder, exist_ok=True)
+
+  fd, values_path = tempfile.mkstemp(dir=cache_folder, prefix=f"{name}-", suffix=".npy")
+  with os.fdopen(fd, "wb") as f:
+    np.save(f, values)
+  index["values"] = os.path.basename(values_path)
+
+  fd, temp_path = tempfile.mkstemp(dir=cache_folder, suffix=".tmp")
+  with os.fdopen(fd, "w") as f:
+    json.dump(index, f)
+  os.replace(temp_path, get_index_path(name))
+
+  for old_values_path in glob.glob(os.path.join(cache_folder, f"{name}-*.npy")):
+    if os.path.basename(old_values_path) != index["values"]:
+      os.remove(old_values_path)
+
+  archives[name] = (index, np.load(values_path, mmap_mode="r"))
@@ -0,0 +1,147 @@
+import numpy as np
+from typing import NamedTuple
+
+# Solve curve(x) = y for x, for many y values at once. Pull curves are polynomials that are
+# monotone over almost all of their range, so instead of finding every root of (curve - y),
+# split [low, high] into monotone pieces at the derivative's roots, look up each y in a dense
+# table of each piece, and then refine the bracketing table interval with Newton's method,
+# falling back to bisection whenever a Newton step leaves the bracket.
+
+class InverseCurveResult(NamedTuple):
+  # Smallest x in [low, high] with curve(x) = y, or nan if there isn't one
+  x: np.ndarray
+  # How many separate solutions there are in [low, high]
+  num_solutions: np.ndarray
+  iterations: int
+
+  @property
+  def no_solution(self):
+    return self.num_solutions == 0
+
+  @property
+  def multiple_solutions(self):
+    return self.num_solutions > 1
+
+class InverseCurve:
+  def __init__(self, curve, low, high, num_points=1025, tolerance=1e-12, max_iterations=50):
+    self.curve = curve
+    self.deriv = curve.deriv()
+    self.low = low
+    self.high = high
+    self.tolerance = tolerance
+    self.max_iterations = max_iterations
+
+    turning_points = [r.real for r in self.deriv.roots()
+                      if np.isreal(r) and low < r.real < high]
+    breakpoints = np.unique([low, *turning_points, high])
+
+    # Table of each monotone piece, stored with y increasing so it can be binary searched
+    self.pieces = []
+    points_per_piece = max(2, num_points // (len(breakpoints) - 1))
+    for start, end in zip(breakpoints[:-1], breakpoints[1:]):
+      xs = np.linspace(start, end, points_per_piece)
+      ys = curve(xs)
+      if ys[-1] < ys[0]:
+        xs, ys = xs[::-1], ys[::-1]
+      self.pieces.append((xs, ys))
+
+  def __call__(self, y):
+    return self.solve(y).x
+
+  def solve(self, y):
+    y = np.asarray(y, dtype=float)
+    shape = y.shape
+    y = y.ravel()
+
+    x = np.full(y.shape, np.nan)
+    num_solutions = np.zeros(y.shape, dtype=int)
+    iterations = 0
+
+    for i, (xs, ys) in enumerate(self.pieces):
+      # Neighbouring pieces share a turning point, so only the first piece includes its start
+      if i == 0:
+        in_piece = (y >= ys[0]) & (y <= ys[-1])
+      else:
+        shared_y = self.curve(xs[0]) if xs[0] < xs[-1] else self.curve(xs[-1])
+        in_piece = (y >= ys[0]) & (y <= ys[-1]) & (y != shared_y)
+
+      if not in_piece.any():
+        continue
+
+      targets = y[in_piece]
+      j = np.clip(np.searchsorted(ys, targets) - 1, 0, len(ys) - 2)
+      piece_x, piece_iterations = self.refine(targets, xs[j], xs[j + 1], ys[j], ys[j + 1])
+      iterations = max(iterations, piece_iterations)
+
+      num_solutions[in_piece] += 1
+      # Pieces go from low to high, so the first solution found is the smallest
+      first = np.isnan(x[in_piece])
+      x[np.flatnonzero(in_piece)[first]] = piece_x[first]
+
+    return InverseCurveResult(x.reshape(shape), num_solutions.reshape(shape), iterations)
+
+  def refine(self, targets, a, b, ya, yb):
+    fa = ya - targets
+    fb = yb - targets
+
+    # Start from linear interpolation within the table interval
+    span = np.where(fb != fa, fb - fa, 1)
+    x = np.where(fb != fa, a - fa * (b - a) / span, a)
+
+    # Stop updating each solution once it has converged, so a solution doesn't depend
+    # on what else was solved in the same call
+    active = np.arange(len(x))
+    iteration = 0
+
+    while len(active) > 0 and iteration < self.max_iterations:
+      iteration = iteration + 1
+      t, xa = targets[active], x[active]
+      fx = self.curve(xa) - t
+      dfx = self.deriv(xa)
+
+      # Keep [a, b] bracketing the solution
+      same_side_as_a = np.sign(fx) == np.sign(fa[active])
+      a[active] = np.where(same_side_as_a, xa, a[active])
+      fa[active] = np.where(same_side_as_a, fx, fa[active])
+      b[active] = np.where(same_side_as_a, b[active], xa)
+      aa, ba = a[active], b[active]
+
+      with np.errstate(divide="ignore", invalid="ignore"):
+        newton_x = xa - fx / dfx
+      outside_bracket = ~((newton_x >= np.minimum(aa, ba)) & (newton_x <= np.maximum(aa, ba)))
+      next_x = np.where(outside_bracket, (aa + ba) / 2, newton_x)
+      next_x = np.where(fx == 0, xa, next_x)
+
+      x[active] = next_x
+      active = active[np.abs(next_x - xa) > self.tolerance * (1 + np.abs(xa))]
+
+    return x, iteration
+
+# Smallest and largest value of many polynomials on [low, high] at once, one polynomial per row of
+# coefficients, lowest power first. InverseCurve(curve, low, high) has a solution for exactly the y
+# values in between, so this answers whether it does without building an InverseCurve for each row.
+# Like InverseCurve, the range comes from the ends and the real roots of the derivative in between
+def get_curve_ranges(coefficients, low, high):
+  coefficients = np.asarray(coefficients, dtype=float)
+  rows, width = coefficients.shape
+  deriv = coefficients[:, 1:] * np.arange(1, width)
+
+  # Turning points of each row, NaN where there's no real one in (low, high). The roots of a
+  # derivative of degree n are the eigenvalues of its companion matrix, so rows are grouped by degree
+  turning_points = np.full((rows, max(width - 2, 0)), np.nan)
+  degrees = np.where(deriv != 0, np.arange(width - 1), -1).max(axis=1) if width > 1 else np.full(rows, -1)
+  for degree in np.unique(degrees[degrees > 0]):
+    in_degree = np.flatnonzero(degrees == degree)
+    companion = np.zeros((len(in_degree), degree, degree))
+    companion[:, np.arange(1, degree), np.arange(degree - 1)] = 1
+    companion[:, :, -1] = -deriv[in_degree, :degree] / deriv[in_degree, degree, None]
+    roots = np.linalg.eigvals(companion)
+    inside = (roots.imag == 0) & (roots.real > low) & (roots.real < high)
+    turning_points[in_degree, :degree] = np.where(inside, roots.real, np.nan)
+
+  x = np.concatenate([np.full((rows, 1), low), np.full((rows, 1), high), turning_points], axis=1)
+  y = np.zeros(x.shape)
+  for c in coefficients.T[::-1]:
+    y = y * x + c[:, None]
+
+  return np.where(np.isnan(x), np.inf, y).min(axis=1), np.where(np.isnan(x), -np.inf, y).max(axis=1)
@@ -0,0 +1,129 @@
+import numpy as np
+import json
+import hashlib
+from collections import OrderedDict
+from collections.abc import Mapping
+
+# Compiled versions of the shifter, derailleur and cassette dicts. Everything that only depends
+# on the part itself is calculated once here, instead of on every call into util.py.
+# Models still behave like the read-only dicts they were built from, so model["speeds"] works.
+
+class PartModel(Mapping):
+  def __init__(self, info):
+    self.info = info
+    self.part_number = info.get("partNumber")
+
+  def __getitem__(self, key):
+    return self.info[key]
+
+  def __iter__(self):
+    return iter(self.info)
+
+  def __len__(self):
+    return len(self.info)
+
+  def __repr__(self):
+    return f"{type(self).__name__}({self.part_number!r})"
+
+class DerailleurModel(PartModel):
+  def __init__(self, info):
+    super().__init__(info)
+    self.coefficients = np.array(info["coefficients"], dtype=float)
+    self.pull_curve = np.polynomial.Polynomial(self.coefficients)
+    self.pull_ratio_curve = self.pull_curve.deriv()
+
+    if "yawCoefficients" in info:
+      self.yaw_coefficients = np.array(info["yawCoefficients"], dtype=float)
+      self.yaw_angle_curve = np.polynomial.Polynomial(self.yaw_coefficients)
+      self.yaw_angle_rate_curve = self.yaw_angle_curve.deriv()
+    else:
+      self.yaw_coefficients = None
+      self.yaw_angle_curve = None
+      self.yaw_angle_rate_curve = None
+
+    self.physical_low_limit = info.get("physicalLowLimit")
+    self.physical_high_limit = info.get("physicalHighLimit")
+
+    # Built on first use by util.get_inverse_pull_curve()
+    self.inverse_pull_curve = None
+
+class ShifterModel(PartModel):
+  def __init__(self, info):
+    super().__init__(info)
+    self.shift_spacings = np.array(info["shiftSpacings"], dtype=float)
+    # Cable pull at each shifter position, relative to the first position
+    self.shift_positions = np.concatenate([[0], np.cumsum(self.shift_spacings)])
+
+class CassetteModel(PartModel):
+  def __init__(self, info):
+    super().__init__(info)
+    self.pitches = np.array(info["pitches"], dtype=float)
+    # Position of each cog relative to the smallest cog. util.py adds smallest_cog_position,
+    # so the models don't need rebuilding when that changes
+    self.cog_positions = np.concatenate([[0], np.cumsum(self.pitches)])
+
+def content_hash(info):
+  return hashlib.sha1(json.dumps(info, sort_keys=True, default=str).encode()).hexdigest()
+
+# Least-recently-used cache of compiled models, keyed by part number plus a hash of the part's
+# contents, so an edited part gets recompiled even though its part number didn't change
+class ModelCache:
+  def __init__(self, model_type, maxsize=256):
+    self.model_type = model_type
+    self.maxsize = maxsize
+    self.models = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, info):
+    if isinstance(info, self.model_type):
+      return info
+
+    key = (info.get("partNumber"), content_hash(info))
+
+    if key in self.models:
+      self.hits = self.hits + 1
+      self.models.move_to_end(key)
+      return self.models[key]
+
+    self.misses = self.misses + 1
+    model = self.model_type(info)
+    self.models[key] = model
+
+    if len(self.models) > self.maxsize:
+      self.models.popitem(last=False)
+
+    return model
+
+  def stats(self):
+    return {
+      "hits": self.hits,
+      "misses": self.misses,
+      "size": len(self.models),
+      "maxsize": self.maxsize
+    }
+
+  def clear(self):
+    self.models.clear()
+    self.hits = 0
+    self.misses = 0
+
+derailleur_models = ModelCache(DerailleurModel)
+shifter_models = ModelCache(ShifterModel)
+cassette_models = ModelCache(CassetteModel)
+
+def get_derailleur_model(info):
+  return derailleur_models.get(info)
+
+def get_shifter_model(info):
+  return shifter_models.get(info)
+
+def get_cassette_model(info):
+  return cassette_models.get(info)
+
+def get_cache_stats():
+  return {
+    "derailleurs": derailleur_models.stats(),
+    "shifters": shifter_models.stats(),
+    "cassettes": cassette_models.stats()
+  }
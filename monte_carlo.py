@@ -0,0 +1,265 @@
+import numpy as np
+import json
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import util
+from inverse_curve import get_curve_ranges
+from combo_search import Catalog, fail_criteria_names, get_all_cheap_triple_results, get_all_triple_results
+
+# Propagates the spread of the measurements behind each part into the fail criteria of stage 3.
+# For every (shifter, derailleur, cassette) triple, samples parts around the catalog values:
+#
+#   - Shifter spacings, with each shift's standard deviation across runs from 1-analyze_shifter.py
+#   - Derailleur pull curve coefficients and pull ratio, from a normal distribution with the
+#     covariance of the per-run fits in pullratio/*.json
+#   - Cassette pitches, with a fixed standard deviation since there's no measured spread for them
+#
+# and solves all the samples at once for max chain angle and motion multiplier. Each triple's
+# samples come from their own seeded generator, so results don't depend on --jobs.
+
+# Per-run pull curve coefficients with the run's pull ratio on the end, for each derailleur in the
+# derailleurs folder by part number
+def load_derailleur_runs(folder):
+  runs = {}
+  for dir in sorted(os.listdir(os.path.join(folder, "derailleurs"))):
+    if dir == "template":
+      continue
+    with open(os.path.join(folder, "derailleurs", dir, "info.json")) as f:
+      info = json.load(f)
+
+    pull_ratio_folder = os.path.join(folder, "derailleurs", dir, "pullratio")
+    run_fits = []
+    for datafile in sorted(os.listdir(pull_ratio_folder)):
+      if datafile.endswith(".csv"):
+        with open(os.path.join(pull_ratio_folder, datafile.replace(".csv", ".json"))) as f:
+          result = json.load(f)
+        run_fits.append(result["coef"] + [result["pull_ratio"]])
+    runs[info["partNumber"]] = np.array(run_fits)
+  return runs
+
+def load_measurement_spread(folder="."):
+  return {
+    "derailleurRuns": load_derailleur_runs(folder)
+  }
+
+# samples copies of a triple's parts, as arrays with one row per sample
+def sample_triple(rng, shifter, derailleur, cassette, spread, samples, cassette_pitch_stdev):
+  shift_spacings = shifter.shift_spacings
+  # Shifters analyzed before stage 1 saved shiftSpacingStdevs get no spread
+  shift_stdevs = shifter.get("shiftSpacingStdevs")
+  if shift_stdevs is not None and len(shift_stdevs) == len(shift_spacings):
+    shift_spacings = shift_spacings + rng.standard_normal((samples, len(shift_spacings))) * np.array(shift_stdevs)
+  else:
+    shift_spacings = np.broadcast_to(shift_spacings, (samples, len(shift_spacings)))
+
+  # Cable pull is the average of the inner shifts in 1-analyze_shifter.py, so it moves with them
+  cable_pull = shifter["cablePull"] + shift_spacings[:, 1:-1].mean(axis=1) - shifter.shift_spacings[1:-1].mean()
+
+  # Multiplying standard normals by the deviations of the runs from their mean gives the runs'
+  # covariance, including how the coefficients and pull ratio move together
+  nominal_fit = np.concatenate([derailleur.coefficients, [derailleur["pullRatio"]]])
+  runs = spread["derailleurRuns"].get(derailleur["partNumber"])
+  if runs is not None and len(runs) > 1 and runs.shape[1] == len(nominal_fit):
+    deviations = runs - runs.mean(axis=0)
+    fits = nominal_fit + rng.standard_normal((samples, len(runs))) @ deviations / np.sqrt(len(runs))
+  else:
+    fits = np.broadcast_to(nominal_fit, (samples, len(nominal_fit)))
+
+  pitches = cassette.pitches + rng.standard_normal((samples, len(cassette.pitches))) * cassette_pitch_stdev
+  average_pitch = cassette["averagePitch"] + pitches.mean(axis=1) - cassette.pitches.mean()
+  cog_positions = np.concatenate([np.zeros((samples, 1)), np.cumsum(pitches, axis=1)], axis=1)
+
+  return {
+    "shift_positions": np.concatenate([np.zeros((samples, 1)), np.cumsum(shift_spacings, axis=1)], axis=1),
+    "cable_pull": cable_pull,
+    "average_pitch": average_pitch,
+    "coefficients": fits[:, :-1],
+    "pull_ratio": fits[:, -1],
+    "cog_positions": util.smallest_cog_position + cog_positions,
+    "pitches": pitches
+  }
+
+# Stack rows of different widths, repeating each row's last value like util.stack_rows(fill=None)
+def pad_edge(arrays):
+  width = max(a.shape[1] for a in arrays)
+  return np.concatenate([np.pad(a, ((0, 0), (0, width - a.shape[1])), mode="edge") for a in arrays])
+
+# Sample each triple and evaluate the fail criteria of every sample at once. Returns, for each
+# criterion, a (triples, samples) array, plus the motion multipliers and max chain angles
+def evaluate_samples(catalog, spread, triples, seeds, samples, cassette_pitch_stdev):
+  motion_multiplier_avg = catalog.compatibility_ranges["motionMultiplierAvg"]
+  motion_multiplier_stdev = catalog.compatibility_ranges["motionMultiplierStdev"]
+  max_chain_angle_max = catalog.compatibility_ranges["maxChainAngleMax"]
+
+  sampled = [sample_triple(np.random.default_rng(seed), s, d, c, spread, samples, cassette_pitch_stdev)
+             for (s, d, c), seed in zip(triples, seeds)]
+  shifters, derailleurs, cassettes = zip(*triples)
+
+  def per_sample(values):
+    return np.repeat(np.array(values), samples)
+
+  shift_positions = pad_edge([t["shift_positions"] for t in sampled])
+  cog_positions = pad_edge([t["cog_positions"] for t in sampled])
+  coefficients = np.concatenate([t["coefficients"] for t in sampled])
+  _, yaw_coefficients = util.stack_derailleur_curves(derailleurs)
+  yaw_coefficients = np.repeat(yaw_coefficients, samples, axis=0)
+  pull_ratios = np.concatenate([t["pull_ratio"] for t in sampled])
+  first_pitches = np.concatenate([t["pitches"][:, 0] for t in sampled])
+  total_pitches = np.concatenate([t["cog_positions"][:, -1] - t["cog_positions"][:, 0] for t in sampled])
+  roller_cog_free_play = per_sample([c["chainRollerWidth"] - c["cogWidth"] for c in cassettes])
+  num_positions = per_sample(np.minimum([c["speeds"] for c in cassettes], [s["speeds"] for s in shifters]))
+  derailleur_range_of_motion = per_sample([d.physical_high_limit - d.physical_low_limit for d in derailleurs])
+
+  width = min(shift_positions.shape[1], cog_positions.shape[1])
+  columns = np.arange(width)
+  inner_mask = (columns >= 1) & (columns < num_positions[:, None] - 1)
+
+  # Samples far out in the tails can send the barrel adjuster off to infinity, which just means they
+  # don't converge
+  with np.errstate(over="ignore", invalid="ignore"):
+    solution = util.solve_barrel_adjusters(shift_positions, cog_positions, inner_mask, coefficients,
+                                           yaw_coefficients, pull_ratios)
+    _, chain_angles = util.get_chain_angle_rows(solution.diffs, roller_cog_free_play)
+  max_chain_angle = np.where(inner_mask, chain_angles, -np.inf).max(axis=1)
+
+  # Like stage 3, least pull is too low when no cable pull between 0 and max_cable_pull reaches the
+  # least pull position on the sampled pull curve
+  least_pull_jockey_positions = solution.jockey_positions[:, 1] - first_pitches
+  lowest_jockey_positions, highest_jockey_positions = get_curve_ranges(coefficients, 0, util.max_cable_pull)
+  least_pull_too_low = ~((least_pull_jockey_positions >= lowest_jockey_positions)
+                         & (least_pull_jockey_positions <= highest_jockey_positions))
+
+  motion_multiplier = np.concatenate([t["average_pitch"] / (t["cable_pull"] * t["pull_ratio"])
+                                      for t in sampled])
+  confidence = util.calc_two_sided_confidences(motion_multiplier - motion_multiplier_avg, motion_multiplier_stdev)
+
+  smallest_cassette_too_big = per_sample([r["smallest_cassette_too_big"]
+                                          for r in get_all_cheap_triple_results(catalog, triples)])
+
+  failures = {
+    "confidence_too_low": confidence < 0.05,
+    "max_chain_angle_too_high": max_chain_angle > max_chain_angle_max,
+    "barrel_adjuster_too_low": solution.barrel_adjuster < 0,
+    "barrel_adjuster_not_converged": ~solution.converged,
+    "least_pull_too_low": least_pull_too_low,
+    "not_enough_range_on_derailleur": ~(derailleur_range_of_motion * 1.03 > total_pitches),
+    "smallest_cassette_too_big": smallest_cassette_too_big
+  }
+
+  shape = (len(triples), samples)
+  return {
+    "failures": dict((name, failures[name].reshape(shape)) for name in fail_criteria_names),
+    "converged": solution.converged.reshape(shape),
+    "motion_multiplier": motion_multiplier.reshape(shape),
+    "max_chain_angle": max_chain_angle.reshape(shape)
+  }
+
+def summarize(triple, nominal_results, evaluated, i):
+  s, d, c = triple
+  failures = dict((name, evaluated["failures"][name][i]) for name in fail_criteria_names)
+  converged = evaluated["converged"][i]
+  compatible = ~np.any(list(failures.values()), axis=0)
+  max_chain_angle = evaluated["max_chain_angle"][i]
+  motion_multiplier = evaluated["motion_multiplier"][i]
+
+  return {
+    "shifterPartNumber": s["partNumber"],
+    "derailleurPartNumber": d["partNumber"],
+    "cassettePartNumber": c["partNumber"],
+    "nominalCompatible": not any(nominal_results[name] for name in fail_criteria_names),
+    "compatibleProbability": float(compatible.mean()),
+    "notConvergedProbability": float(1 - converged.mean()),
+    "failProbabilities": dict((name, float(f.mean())) for name, f in failures.items()),
+    "motionMultiplierMean": float(motion_multiplier.mean()),
+    "motionMultiplierStdev": float(motion_multiplier.std()),
+    "maxChainAngleMean": float(np.nanmean(max_chain_angle)) if not np.all(np.isnan(max_chain_angle)) else None,
+    "maxChainAngleStdev": float(np.nanstd(max_chain_angle)) if not np.all(np.isnan(max_chain_angle)) else None,
+    "maxChainAngle95thPercentile": float(np.nanpercentile(max_chain_angle, 95))
+      if not np.all(np.isnan(max_chain_angle)) else None
+  }
+
+worker_catalog = None
+worker_spread = None
+worker_options = None
+
+def init_worker(catalog, spread, options):
+  global worker_catalog, worker_spread, worker_options
+  worker_catalog = catalog
+  worker_spread = spread
+  worker_options = options
+
+# Every triple of one shifter, in the same order as stage 3, solved in chunks of about chunk_rows samples
+def evaluate_shifter_in_worker(shifter_index):
+  catalog = worker_catalog
+  samples = worker_options["samples"]
+  shifter = catalog.shifters[shifter_index]
+
+  triples = []
+  seeds = []
+  for d_index, derailleur in enumerate(catalog.derailleurs):
+    for speeds in range(9, 14):
+      for cassette in catalog.cassettes_by_speeds.get(speeds, []):
+        triples.append((shifter, derailleur, cassette))
+        seeds.append([worker_options["seed"], shifter_index, d_index, catalog.cassettes.index(cassette)])
+
+  nominal_results = get_all_triple_results(catalog, triples, warn=False)
+
+  summaries = []
+  triples_per_chunk = max(1, worker_options["chunkRows"] // samples)
+  for start in range(0, len(triples), triples_per_chunk):
+    chunk = triples[start:start + triples_per_chunk]
+    evaluated = evaluate_samples(catalog, worker_spread, chunk, seeds[start:start + triples_per_chunk],
+                                 samples, worker_options["cassettePitchStdev"])
+    for i, (s, d, c) in enumerate(chunk):
+      summaries.append(summarize((s, d, c), nominal_results[(s["partNumber"], d["partNumber"], c["partNumber"])],
+                                 evaluated, i))
+  return summaries
+
+def run_monte_carlo(catalog, spread, options, jobs=1):
+  shifter_indexes = [catalog.shifters.index(shifter) for shifter in catalog.get_searched_shifters()]
+
+  if jobs > 1:
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker,
+                             initargs=(catalog, spread, options)) as executor:
+      return [s for summaries in executor.map(evaluate_shifter_in_worker, shifter_indexes) for s in summaries]
+
+  init_worker(catalog, spread, options)
+  return [s for i in shifter_indexes for s in evaluate_shifter_in_worker(i)]
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--samples", type=int, default=1000, help="Samples per triple")
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--cassette-pitch-stdev", type=float, default=0.02,
+                      help="Standard deviation of each cassette pitch in mm")
+  parser.add_argument("--jobs", type=int, default=os.cpu_count(),
+                      help="Worker processes, each evaluating one shifter's triples at a time")
+  parser.add_argument("--chunk-rows", type=int, default=100000,
+                      help="About how many samples to solve in each batch")
+  parser.add_argument("--output", default="monte_carlo.json")
+  args = parser.parse_args()
+
+  options = {
+    "samples": args.samples,
+    "seed": args.seed,
+    "cassettePitchStdev": args.cassette_pitch_stdev,
+    "chunkRows": args.chunk_rows
+  }
+
+  start = time.perf_counter()
+  combos = run_monte_carlo(Catalog(), load_measurement_spread(), options, args.jobs)
+  elapsed = time.perf_counter() - start
+
+  with open(args.output, "w") as f:
+    json.dump({**options, "combos": combos}, f, indent=2)
+
+  print(f"{len(combos)} triples x {args.samples} samples on {args.jobs} job(s) in {elapsed:.1f} s")
+  print(f"Nominally compatible: {sum(1 for c in combos if c['nominalCompatible'])}, "
+        f"of which {sum(1 for c in combos if c['nominalCompatible'] and c['compatibleProbability'] < 0.95)} "
+        f"are compatible in less than 95% of samples")
+  print(f"Nominally incompatible but compatible in at least 5% of samples: "
+        f"{sum(1 for c in combos if not c['nominalCompatible'] and c['compatibleProbability'] >= 0.05)}")
+  for name in fail_criteria_names:
+    print(f"  {name}: mean fail probability {np.mean([c['failProbabilities'][name] for c in combos]):.3f}")
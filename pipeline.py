@@ -0,0 +1,342 @@
+import os
+import sys
+import ast
+import glob
+import json
+import time
+import fnmatch
+import hashlib
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Runs the numbered scripts in dependency order, skipping the ones whose inputs haven't changed
+# since they last ran. Content hashes of each stage's inputs and outputs are kept in
+# .pipeline_manifest.json. Stages that work through the shifters or derailleurs folders are run on
+# just the part folders whose files changed, and stages that don't depend on each other run at the
+# same time.
+#
+# Patterns are globs relative to the repo, or for part_inputs and part_outputs, relative to each
+# part folder. Patterns starting with ! leave files out. A stage runs after any stage whose outputs
+# it reads. feedback_inputs are hashed like inputs but don't order the stages, for files a stage
+# reads that a later stage writes. The local modules a script imports are found from its import
+# statements, and count as its inputs.
+
+stages = [
+  {
+    "name": "1-analyze_shifter",
+    "script": "1-analyze_shifter.py",
+    "inputs": ["shifter_analysis.htm"],
+    "parts_folder": "shifters",
+    "part_inputs": ["info.json", "measurements.csv"],
+    "part_outputs": ["info_out.json", "default.htm", "*.png"],
+    "outputs": ["all_shifters.json"]
+  },
+  {
+    "name": "1a-analyze_derailleur_pull_ratio",
+    "script": "1a-analyze_derailleur_pull_ratio.py",
+    "inputs": [],
+    # Only used to warn about runs where the caliper and indicator disagree
+    "feedback_inputs": ["overall_stats.json"],
+    "parts_folder": "derailleurs",
+    "part_inputs": ["info.json", "pullratio/*.csv"],
+    "part_outputs": ["pullratio/*.json", "!pullratio/pull_ratio_info.json", "pullratio/*.png"],
+    "outputs": []
+  },
+  {
+    "name": "1b-analyze_derailleur_yaw",
+    "script": "1b-analyze_derailleur_yaw.py",
+    "inputs": [],
+    "parts_folder": "derailleurs",
+    "part_inputs": ["yaw/*.csv"],
+    "part_outputs": ["yaw/*.json", "!yaw/yaw_info.json", "yaw/*.png"],
+    "outputs": []
+  },
+  {
+    "name": "1c-combine_derailleur_pull_ratios",
+    "script": "1c-combine_derailleur_pull_ratios.py",
+    "inputs": [],
+    "parts_folder": "derailleurs",
+    "part_inputs": ["info.json", "pullratio/*.json"],
+    "part_outputs": ["pullratio/pull_ratio_info.json", "pull_curve.png", "pull_ratio_curve.png"],
+    "outputs": []
+  },
+  {
+    "name": "1d-combine_derailleur_yaws",
+    "script": "1d-combine_derailleur_yaws.py",
+    "inputs": [],
+    "parts_folder": "derailleurs",
+    "part_inputs": ["pullratio/pull_ratio_info.json", "yaw/*.json"],
+    "part_outputs": ["yaw/yaw_info.json", "yaw_curve.png"],
+    "outputs": []
+  },
+  {
+    "name": "1e-analyze_derailleur",
+    "script": "1e-analyze_derailleur.py",
+    "inputs": ["derailleur_analysis.htm", "other_derailleurs.json", "derailleurs/*/info.json",
+               "derailleurs/*/pullratio/pull_ratio_info.json", "derailleurs/*/yaw/yaw_info.json",
+               "derailleurs/*/pullratio/*.csv", "derailleurs/*/yaw/*.csv", "!derailleurs/template/**"],
+    "outputs": ["derailleurs/*/info_out.json", "derailleurs/*/default.htm", "overall_stats.json",
+                "all_derailleurs.json", "!derailleurs/template/**"]
+  },
+  {
+    "name": "2-analyze_supported_combos",
+    "script": "2-analyze_supported_combos.py",
+    "inputs": ["all_shifters.json", "all_derailleurs.json", "cassettes.json", "supported_combinations.json"],
+    "outputs": ["compatibility_ranges.json", "motion_multiplier.png", "motion_multiplier_histogram.png"]
+  },
+  {
+    "name": "3-find_all_combos",
+    "script": "3-find_all_combos.py",
+    "inputs": ["all_shifters.json", "all_derailleurs.json", "cassettes.json", "equivalent_shifters.json",
+               "equivalent_derailleurs.json", "supported_combinations.json", "reviewed_combinations.json",
+               "compatibility_ranges.json"],
+    "outputs": ["combinations.json", "combinations_trimmed.json", "sensible_combinations.json",
+                "sensible_combinations_trimmed.json", "partial_fail_combos.json",
+                "partial_fail_combos_other_trimmed.json", "partial_fail_combos_confidence_trimmed.json",
+                "partial_fail_combos_chain_angle_trimmed.json", "all_combos.csv", "all_cassettes.json",
+                "combinations.db"]
+  },
+  {
+    "name": "4-analyze_all_combos",
+    "script": "4-analyze_all_combos.py",
+    "inputs": ["combinations.json", "supported_combinations.json", "equivalent_shifters.json",
+               "equivalent_derailleurs.json"],
+    "outputs": ["lowest_gearing_with_drop_bar_shifters_combos.json", "widest_range_with_drop_bar_shifters_combos.json"]
+  },
+  {
+    "name": "5-export",
+    "script": "5-export.py",
+    "inputs": ["README.md.jinja", "all_shifters.json", "all_derailleurs.json", "all_cassettes.json",
+               "combinations.json", "lowest_gearing_with_drop_bar_shifters_combos.json",
+               "widest_range_with_drop_bar_shifters_combos.json", "compatibility_ranges.json",
+               "equivalent_derailleurs.json", "equivalent_shifters.json"],
+    "outputs": ["export/*", "README.md"]
+  }
+]
+
+manifest_file_name = ".pipeline_manifest.json"
+
+# Files matching patterns, relative to folder, sorted so hashes don't depend on listing order
+def find_files(folder, patterns):
+  files = set()
+  for pattern in patterns:
+    if not pattern.startswith("!"):
+      files.update(os.path.relpath(f, folder) for f in glob.glob(os.path.join(folder, pattern), recursive=True)
+                   if os.path.isfile(f))
+  excluded = [p[1:] for p in patterns if p.startswith("!")]
+  return sorted(f for f in files if not any(fnmatch.fnmatch(f, p) for p in excluded))
+
+def hash_files(folder, file_names):
+  h = hashlib.sha1()
+  for file_name in file_names:
+    h.update(file_name.encode() + b"\0")
+    with open(os.path.join(folder, file_name), "rb") as f:
+      h.update(hashlib.sha1(f.read()).digest())
+  return h.hexdigest()
+
+def get_part_folders(folder, stage):
+  parts_folder = os.path.join(folder, stage["parts_folder"])
+  return sorted(d for d in os.listdir(parts_folder)
+                if d != "template" and os.path.isdir(os.path.join(parts_folder, d)))
+
+# Every file a stage reads or writes, for working out which stages depend on which
+def get_patterns(stage, kind):
+  patterns = list(stage[kind])
+  if "parts_folder" in stage:
+    patterns = patterns + [f"{stage['parts_folder']}/*/{p}" if not p.startswith("!")
+                           else f"!{stage['parts_folder']}/*/{p[1:]}" for p in stage[f"part_{kind}"]]
+  return [p for p in patterns if not p.startswith("!")]
+
+def patterns_overlap(a, b):
+  return fnmatch.fnmatch(a, b) or fnmatch.fnmatch(b, a)
+
+def get_dependencies(stages):
+  dependencies = {}
+  for i, stage in enumerate(stages):
+    inputs = get_patterns(stage, "inputs")
+    dependencies[stage["name"]] = [upstream["name"] for upstream in stages[:i]
+                                   if any(patterns_overlap(p, o) for p in inputs
+                                          for o in get_patterns(upstream, "outputs"))]
+  return dependencies
+
+# Modules in folder that a script imports, directly or through each other, including imports inside
+# functions
+def get_modules(folder, script):
+  modules = []
+  to_read = [script]
+  while len(to_read) > 0:
+    with open(os.path.join(folder, to_read.pop())) as f:
+      tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+      if isinstance(node, ast.Import):
+        names = [alias.name for alias in node.names]
+      elif isinstance(node, ast.ImportFrom) and node.level == 0:
+        names = [node.module]
+      else:
+        continue
+      for name in names:
+        module = name.split(".")[0] + ".py"
+        if module != script and module not in modules and os.path.isfile(os.path.join(folder, module)):
+          modules.append(module)
+          to_read.append(module)
+  return sorted(modules)
+
+# Hashes of what a stage depends on: its script and modules and inputs, and for per-part stages,
+# each part folder's inputs. A stage's own outputs are never counted as its inputs
+def get_input_hashes(folder, stage):
+  own_outputs = set(find_files(folder, stage["outputs"]))
+  inputs = [f for f in find_files(folder, stage["inputs"] + stage.get("feedback_inputs", []))
+            if f not in own_outputs]
+  hashes = {"stage": hash_files(folder, [stage["script"]] + get_modules(folder, stage["script"]) + inputs)}
+
+  if "parts_folder" in stage:
+    hashes["parts"] = {}
+    for part in get_part_folders(folder, stage):
+      part_folder = os.path.join(folder, stage["parts_folder"], part)
+      part_outputs = set(find_files(part_folder, stage["part_outputs"]))
+      part_inputs = [f for f in find_files(part_folder, stage["part_inputs"]) if f not in part_outputs]
+      hashes["parts"][part] = hash_files(part_folder, part_inputs)
+  return hashes
+
+def get_output_hashes(folder, stage):
+  hashes = {"stage": hash_files(folder, find_files(folder, stage["outputs"]))}
+  if "parts_folder" in stage:
+    hashes["parts"] = dict((part, hash_files(os.path.join(folder, stage["parts_folder"], part),
+                                             find_files(os.path.join(folder, stage["parts_folder"], part),
+                                                        stage["part_outputs"])))
+                           for part in get_part_folders(folder, stage))
+  return hashes
+
+# What needs running: None if nothing, [] for the whole stage, or the part folders to redo. A part
+# folder that's been removed since the last run has no folder to redo, and can change the stage's
+# combined outputs, so the whole stage runs
+def get_stale_parts(stage, record, input_hashes, output_hashes):
+  if record is None or record["inputs"]["stage"] != input_hashes["stage"] \
+      or record["outputs"]["stage"] != output_hashes["stage"]:
+    return []
+  if "parts_folder" not in stage:
+    return None
+  if any(part not in input_hashes["parts"] for part in record["inputs"]["parts"]):
+    return []
+
+  stale = [part for part in input_hashes["parts"]
+           if record["inputs"]["parts"].get(part) != input_hashes["parts"][part]
+           or record["outputs"]["parts"].get(part) != output_hashes["parts"][part]]
+  if len(stale) == len(input_hashes["parts"]):
+    return []
+  return stale if len(stale) > 0 else None
+
+def run_stage(folder, stage, parts, log_folder):
+  start = time.perf_counter()
+  log_file_name = os.path.join(log_folder, f"{stage['name']}.log")
+  with open(log_file_name, "w") as log:
+    result = subprocess.run([sys.executable, stage["script"], *parts], cwd=folder, stdout=log,
+                            stderr=subprocess.STDOUT)
+  return result.returncode, time.perf_counter() - start, log_file_name
+
+def load_manifest(folder):
+  path = os.path.join(folder, manifest_file_name)
+  if not os.path.exists(path):
+    return {}
+  with open(path) as f:
+    return json.load(f)
+
+def save_manifest(folder, manifest):
+  path = os.path.join(folder, manifest_file_name)
+  with open(path + ".tmp", "w") as f:
+    json.dump(manifest, f, indent=2)
+  os.replace(path + ".tmp", path)
+
+# Runs the selected stages that are out of date, as soon as the stages they depend on are done.
+# Returns the names of the stages that failed
+def run_pipeline(folder, selected, jobs=1, force=False, dry_run=False, touch=False):
+  manifest = load_manifest(folder)
+  dependencies = get_dependencies(stages)
+  stages_by_name = dict((stage["name"], stage) for stage in stages)
+  log_folder = os.path.join(folder, ".pipeline_logs")
+  os.makedirs(log_folder, exist_ok=True)
+
+  pending = [stage["name"] for stage in stages if stage["name"] in selected]
+  done = set(stage["name"] for stage in stages if stage["name"] not in selected)
+  failed = []
+  running = {}
+
+  def record(stage, input_hashes):
+    manifest[stage["name"]] = {"inputs": input_hashes, "outputs": get_output_hashes(folder, stage)}
+    save_manifest(folder, manifest)
+
+  with ThreadPoolExecutor(max_workers=jobs) as executor:
+    while len(pending) > 0 or len(running) > 0:
+      ready = [name for name in pending if all(d in done for d in dependencies[name])]
+      for name in ready:
+        if len(running) >= jobs:
+          break
+        pending.remove(name)
+        stage = stages_by_name[name]
+
+        # Inputs are hashed once the stages before have finished, and recorded as they were before
+        # this stage ran
+        input_hashes = get_input_hashes(folder, stage)
+        stale_parts = [] if force else get_stale_parts(stage, manifest.get(name), input_hashes,
+                                                       get_output_hashes(folder, stage))
+        if stale_parts is None:
+          print(f"{name}: up to date")
+          done.add(name)
+          continue
+
+        description = "all" if len(stale_parts) == 0 else ", ".join(stale_parts)
+        if dry_run or touch:
+          print(f"{name}: {'would run' if dry_run else 'marked as built'} ({description})")
+          if touch:
+            record(stage, input_hashes)
+          done.add(name)
+          continue
+
+        print(f"{name}: running ({description})")
+        running[executor.submit(run_stage, folder, stage, stale_parts, log_folder)] = (stage, input_hashes)
+
+      if len(running) == 0:
+        if len(pending) > 0 and len(ready) == 0:
+          # Only stages downstream of a failure are left
+          for name in pending:
+            print(f"{name}: skipped")
+          break
+        continue
+
+      finished, _ = wait(running, return_when=FIRST_COMPLETED)
+      for future in finished:
+        stage, input_hashes = running.pop(future)
+        returncode, elapsed, log_file_name = future.result()
+        if returncode == 0:
+          print(f"{stage['name']}: done in {elapsed:.1f} s")
+          record(stage, input_hashes)
+          done.add(stage["name"])
+        else:
+          print(f"{stage['name']}: failed with exit code {returncode} after {elapsed:.1f} s, see {log_file_name}")
+          failed.append(stage["name"])
+
+  return failed
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("stages", nargs="*", help="Stages to run, by name or number prefix like 1a or 3. Default is all")
+  parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="How many stages can run at once")
+  parser.add_argument("--force", action="store_true", help="Run the stages even if they're up to date")
+  parser.add_argument("--dry-run", action="store_true", help="Only print what would run")
+  parser.add_argument("--touch", action="store_true",
+                      help="Record the stages' current inputs and outputs as built, without running them")
+  args = parser.parse_args()
+
+  selected = set(stage["name"] for stage in stages
+                 if len(args.stages) == 0 or any(stage["name"] == s or stage["name"].split("-")[0] == s
+                                                 for s in args.stages))
+  if len(selected) == 0:
+    parser.error(f"No stages named {', '.join(args.stages)}")
+
+  start = time.perf_counter()
+  failed = run_pipeline(os.path.dirname(os.path.abspath(__file__)), selected, args.jobs, args.force,
+                        args.dry_run, args.touch)
+  print(f"Finished in {time.perf_counter() - start:.2f} s")
+  if len(failed) > 0:
+    sys.exit(1)
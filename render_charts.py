@@ -0,0 +1,20 @@
+import time
+import argparse
+import charts
+from util import map_jobs
+
+# Draws the charts that the analysis scripts queued with --plots-later
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--jobs", type=int, default=1, help="Number of worker processes to draw charts with")
+  args = parser.parse_args()
+
+  queued_charts = charts.get_queued_charts()
+
+  start = time.perf_counter()
+  for path in map_jobs(charts.render_queued_chart, queued_charts, jobs=args.jobs):
+    print(path)
+  elapsed = time.perf_counter() - start
+
+  print(f"{len(queued_charts)} charts in {elapsed:.1f} s")
@@ -0,0 +1,75 @@
+import json
+import os
+import tempfile
+
+# Persistent cache of results on disk, one JSON file per key. Keys are content hashes of
+# everything a result depends on, so entries never go stale, they just stop being used.
+# Files are written atomically, so several processes can share a cache folder.
+# Reading an entry touches its file, and evict() removes the least recently used entries
+# once the cache is bigger than max_bytes.
+
+class ResultCache:
+  def __init__(self, folder, max_bytes=256 * 1024 * 1024):
+    self.folder = folder
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+
+  def get_path(self, key):
+    return os.path.join(self.folder, key[:2], key + ".json")
+
+  def get(self, key):
+    path = self.get_path(key)
+    try:
+      with open(path) as f:
+        value = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+      self.misses = self.misses + 1
+      return None
+
+    self.hits = self.hits + 1
+    os.utime(path)
+    return value
+
+  def put(self, key, value):
+    path = self.get_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+      json.dump(value, f)
+    os.replace(temp_path, path)
+
+  def get_entries(self):
+    entries = []
+    if not os.path.isdir(self.folder):
+      return entries
+    for folder, _, file_names in os.walk(self.folder):
+      for file_name in file_names:
+        if file_name.endswith(".json"):
+          path = os.path.join(folder, file_name)
+          stat = os.stat(path)
+          entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+  # Remove least recently used entries until the cache fits in max_bytes. Returns how many were removed
+  def evict(self):
+    entries = sorted(self.get_entries())
+    size = sum(e[1] for e in entries)
+    evicted = 0
+    for _, entry_size, path in entries:
+      if size <= self.max_bytes:
+        break
+      os.remove(path)
+      size = size - entry_size
+      evicted = evicted + 1
+    return evicted
+
+  def stats(self):
+    entries = self.get_entries()
+    return {
+      "hits": self.hits,
+      "misses": self.misses,
+      "entries": len(entries),
+      "bytes": sum(e[1] for e in entries),
+      "maxBytes": self.max_bytes
+    }
@@ -0,0 +1,129 @@
+import json
+import os
+import sys
+import time
+import shutil
+import argparse
+import datetime
+import platform
+import subprocess
+import tempfile
+from synthetic_catalog import generate_catalog
+
+# Runs stages 2 and 3 on synthetic catalogs of increasing size, and appends their wall time and peak
+# memory, and stage 3's time per triple, to a JSON file, so runs can be compared across commits.
+# Stage 2 only analyzes the supported combos, which don't grow with the catalog, so its time should
+# stay flat. Stage 3 uses the compatibility ranges stage 2 writes
+
+script_folder = os.path.dirname(os.path.abspath(__file__))
+stage_scripts = ["2-analyze_supported_combos.py", "3-find_all_combos.py"]
+
+# Triples stage 3 searches: right shifters with every derailleur and 9- to 13-speed cassette
+def count_triples(catalog):
+  searched_shifters = [s for s in catalog["all_shifters.json"] if s.get("side") != "left"]
+  cassettes = [c for c in catalog["cassettes.json"] if 9 <= c["speeds"] <= 13]
+  return len(searched_shifters) * len(catalog["all_derailleurs.json"]) * len(cassettes)
+
+# Wall time and peak RSS of running a script in folder. os.wait4() gives the resource usage of
+# just that process, where getrusage(RUSAGE_CHILDREN) would give the peak over every run so far.
+# It's not available on Windows, where the peak RSS is None
+def run_stage(script, folder, args):
+  command = [sys.executable, os.path.join(script_folder, script), *args]
+  start = time.perf_counter()
+  if hasattr(os, "wait4"):
+    process = subprocess.Popen(command, cwd=folder, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = process.stderr.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in KB on Linux
+    peak_rss_mb = usage.ru_maxrss / 1024
+  else:
+    process = subprocess.run(command, cwd=folder, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = process.stderr
+    returncode = process.returncode
+    peak_rss_mb = None
+  wall_time = time.perf_counter() - start
+
+  if returncode != 0:
+    raise Exception(f"{script} failed in {folder}:\n{stderr.decode()}")
+
+  return {"wallTime": wall_time, "peakRssMb": peak_rss_mb}
+
+def format_stage(script, stage):
+  peak_rss = "" if stage["peakRssMb"] is None else f" {stage['peakRssMb']:.0f} MB"
+  return f"{script} {stage['wallTime']:.1f} s{peak_rss}"
+
+# The commit the benchmark ran on, ending in -dirty if the tree had uncommitted changes
+def get_commit():
+  try:
+    return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=script_folder, capture_output=True,
+                          text=True, check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+# stage_args are the arguments for each stage script
+def run_benchmark(scales, seed, stage_args, work_folder):
+  results = []
+  for scale in scales:
+    folder = os.path.join(work_folder, f"scale-{scale:g}")
+    catalog = generate_catalog(script_folder, folder, scale, seed)
+    triples = count_triples(catalog)
+
+    stages = {}
+    for script in stage_scripts:
+      stages[script] = run_stage(script, folder, stage_args.get(script, []))
+    stage_3 = stages["3-find_all_combos.py"]
+    stage_3["timePerTripleMs"] = stage_3["wallTime"] / triples * 1000
+
+    result = {
+      "scale": scale,
+      "shifters": len(catalog["all_shifters.json"]),
+      "derailleurs": len(catalog["all_derailleurs.json"]),
+      "cassettes": len(catalog["cassettes.json"]),
+      "triples": triples,
+      "stages": stages
+    }
+    results.append(result)
+
+    print(f"{scale:g}x: {triples} triples, " + ", ".join(format_stage(script, stages[script]) for script in stages))
+
+  return results
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--scales", type=float, nargs="+", default=[1, 10, 100],
+                      help="Catalog sizes to run, as multiples of the real catalog's triples")
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--jobs", type=int, default=1, help="--jobs for stage 3")
+  parser.add_argument("--output", default="scale_benchmark.json",
+                      help="JSON file to append this run's results to")
+  parser.add_argument("--keep", metavar="FOLDER",
+                      help="Generate catalogs in this folder and keep them, instead of a temporary folder")
+  args = parser.parse_args()
+
+  work_folder = args.keep if args.keep is not None else tempfile.mkdtemp(prefix="scale_benchmark_")
+  try:
+    # Stage 3 without the result cache, so every run does the whole search
+    stage_args = {"3-find_all_combos.py": ["--no-cache", "--jobs", str(args.jobs)]}
+    results = run_benchmark(args.scales, args.seed, stage_args, work_folder)
+  finally:
+    if args.keep is None:
+      shutil.rmtree(work_folder)
+
+  runs = []
+  if os.path.exists(args.output):
+    with open(args.output) as f:
+      runs = json.load(f)
+
+  runs.append({
+    "commit": get_commit(),
+    "date": datetime.datetime.now().isoformat(timespec="seconds"),
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "seed": args.seed,
+    "jobs": args.jobs,
+    "results": results
+  })
+
+  with open(args.output, "w") as f:
+    json.dump(runs, f, indent=2)
@@ -0,0 +1,206 @@
+import numpy as np
+import json
+import time
+import argparse
+import itertools
+import copy
+import util
+from combo_search import Catalog, cheap_fail_criteria, get_all_cheap_triple_results, get_motion_multipliers
+
+# Sweeps the geometry constants at the top of util.py over a grid, and shows how each
+# (shifter, derailleur, cassette) triple's compatible verdict changes across it. The thresholds that
+# compatibility_ranges.json holds are re-derived from the supported combos the way
+# 2-analyze_supported_combos.py does, so nothing needs editing or re-running between points, and a
+# stale compatibility_ranges.json doesn't skew the verdicts.
+#
+# The motion multiplier range, and so confidence, and the max tooth and derailleur range checks don't
+# depend on these constants, so they're worked out once. maxChainAngleMax is re-derived at each grid
+# point. jockey_to_cog_links only scales the chain angles, so every value of it
+# reuses the same barrel adjuster solutions. The solves for the other constants are batched, with
+# many grid points' triples stacked into each call to util.calculate_max_chain_angle_arrays()
+
+swept_constants = ["smallest_cog_position", "jockey_to_cog_links", "chain_max_free_yaw", "link_length"]
+
+# Shifter, derailleur and cassette models of each supported combo, matched the same way as in stage 2
+def get_supported_triples(catalog):
+  triples = []
+  for combo in catalog.supported_combos:
+    shifter = [s for s in catalog.shifters if s["partNumber"] == combo["shifterPartNumber"]
+               and s["brand"] == combo["brand"]][0]
+    derailleur = [d for d in catalog.derailleurs if d["partNumber"] == combo["derailleurPartNumber"]
+                  and d["brand"] == combo["brand"]][0]
+    cassette = [c for c in catalog.cassettes if c["partNumber"] == combo["cassettePartNumber"]
+                and (c["brand"] == combo["brand"]
+                     or ("cassetteBrand" in combo and c["brand"] == combo["cassetteBrand"]))][0]
+    triples.append((shifter, derailleur, cassette))
+  return triples
+
+# Triples stage 3 searches, in the same order
+def get_searched_triples(catalog):
+  return [(s, d, c) for s in catalog.get_searched_shifters()
+          for d in catalog.derailleurs
+          for speeds in range(9, 14)
+          for c in catalog.cassettes_by_speeds.get(speeds, [])]
+
+# Solve every triple at each (smallest_cog_position, chain_max_free_yaw, link_length) point, with as
+# many points per batch as fit in about chunk_rows rows. Returns arrays of shape (points, triples)
+def solve_points(triples, points, chunk_rows):
+  shifters, derailleurs, cassettes = [list(t) for t in zip(*triples)]
+  n = len(triples)
+  points_per_chunk = max(1, chunk_rows // n)
+
+  max_diffs = np.empty((len(points), n))
+  solved = np.empty((len(points), n), dtype=bool)
+
+  for start in range(0, len(points), points_per_chunk):
+    chunk = np.array(points[start:start + points_per_chunk])
+    k = len(chunk)
+    arrays = util.calculate_max_chain_angle_arrays(
+      shifters * k, derailleurs * k, cassettes * k,
+      smallest_cog_positions=np.repeat(chunk[:, 0], n),
+      max_free_yaws=np.repeat(chunk[:, 1], n),
+      link_lengths=np.repeat(chunk[:, 2], n),
+      warn=False)
+
+    # Biggest signed diff beyond the free play, which gives the max chain angle for any jockey_to_cog_links
+    max_diffs[start:start + k] = np.where(arrays["inner_mask"], arrays["diffs_minus_free_play"],
+                                          -np.inf).max(axis=1).reshape(k, n)
+    solved[start:start + k] = (arrays["solution"].converged
+                               & ~arrays["barrel_adjuster_too_low"]
+                               & ~arrays["least_pull_too_low"]).reshape(k, n)
+
+  return max_diffs, solved
+
+def get_max_chain_angles(max_diffs, links):
+  return np.arcsin(max_diffs / (links * 25.4 / 2)) * 180 / np.pi
+
+def sweep(catalog, grid, baseline, chunk_rows):
+  triples = get_searched_triples(catalog)
+  supported_triples = get_supported_triples(catalog)
+  num_supported = len(supported_triples)
+
+  # Population standard deviation, like stage 2
+  supported_multipliers, _ = get_motion_multipliers(catalog, supported_triples)
+  motion_multiplier_ranges = {
+    "motionMultiplierAvg": float(np.mean(supported_multipliers)),
+    "motionMultiplierStdev": float(np.std(supported_multipliers))
+  }
+  sweep_catalog = copy.copy(catalog)
+  sweep_catalog.compatibility_ranges = {**catalog.compatibility_ranges, **motion_multiplier_ranges}
+
+  cheap_fails = np.array([any(results[name] for name in cheap_fail_criteria)
+                          for results in get_all_cheap_triple_results(sweep_catalog, triples)])
+
+  # The baseline is solved as one more point, after the grid
+  solve_grid = list(itertools.product(grid["smallest_cog_position"], grid["chain_max_free_yaw"],
+                                      grid["link_length"]))
+  solve_points_list = solve_grid + [(baseline["smallest_cog_position"], baseline["chain_max_free_yaw"],
+                                     baseline["link_length"])]
+  max_diffs, solved = solve_points(supported_triples + triples, solve_points_list, chunk_rows)
+
+  def evaluate(point_index, links):
+    max_chain_angles = get_max_chain_angles(max_diffs[point_index], links)
+    supported_angles = max_chain_angles[:num_supported]
+    thresholds = {
+      **motion_multiplier_ranges,
+      "maxChainAngleAvg": float(np.mean(supported_angles)),
+      "maxChainAngleStdev": float(np.std(supported_angles)),
+    }
+    thresholds["maxChainAngleMax"] = thresholds["maxChainAngleAvg"] + 2 * thresholds["maxChainAngleStdev"]
+    thresholds["supportedCombosOutOfRange"] = int(np.sum(~(supported_angles <= thresholds["maxChainAngleMax"])
+                                                         | ~solved[point_index, :num_supported]))
+
+    # A NaN angle, from a solve that didn't find the cable pulls, isn't compatible
+    triple_angles = max_chain_angles[num_supported:]
+    compatible = solved[point_index, num_supported:] & ~cheap_fails \
+      & np.isfinite(triple_angles) & (triple_angles <= thresholds["maxChainAngleMax"])
+    return thresholds, compatible
+
+  grid_points = []
+  verdicts = []
+  # Grid points in the order of itertools.product() over swept_constants
+  for scp_index, links, yaw_index, link_length_index in itertools.product(
+      range(len(grid["smallest_cog_position"])), grid["jockey_to_cog_links"],
+      range(len(grid["chain_max_free_yaw"])), range(len(grid["link_length"]))):
+    point_index = np.ravel_multi_index((scp_index, yaw_index, link_length_index),
+                                       (len(grid["smallest_cog_position"]), len(grid["chain_max_free_yaw"]),
+                                        len(grid["link_length"])))
+    thresholds, compatible = evaluate(point_index, links)
+    scp, yaw, link_length = solve_grid[point_index]
+    grid_points.append({
+      "smallest_cog_position": scp,
+      "jockey_to_cog_links": links,
+      "chain_max_free_yaw": yaw,
+      "link_length": link_length,
+      **thresholds,
+      "compatible": int(compatible.sum())
+    })
+    verdicts.append(compatible)
+
+  baseline_thresholds, baseline_compatible = evaluate(len(solve_grid), baseline["jockey_to_cog_links"])
+  verdicts = np.array(verdicts)
+  pass_fractions = verdicts.mean(axis=0)
+  flips = (verdicts != baseline_compatible).sum(axis=0)
+
+  combos = []
+  for i, (s, d, c) in enumerate(triples):
+    if pass_fractions[i] == 1:
+      verdict = "always compatible"
+    elif pass_fractions[i] == 0:
+      verdict = "never compatible"
+    else:
+      verdict = "sensitive"
+
+    combos.append({
+      "name": f"{s['brand']} {s['name']} shifter/{d['brand']} {d['name']} derailleur/{c['brand']} {c['name']} cassette",
+      "shifterPartNumber": s["partNumber"],
+      "derailleurPartNumber": d["partNumber"],
+      "cassettePartNumber": c["partNumber"],
+      "baseline": bool(baseline_compatible[i]),
+      "passFraction": float(pass_fractions[i]),
+      "flips": int(flips[i]),
+      "verdict": verdict,
+      # One character per grid point, in gridPoints order
+      "verdicts": "".join("1" if v else "0" for v in verdicts[:, i])
+    })
+
+  return {
+    "grid": grid,
+    "baseline": {**baseline, **baseline_thresholds, "compatible": int(baseline_compatible.sum())},
+    "gridPoints": grid_points,
+    "combos": combos
+  }
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  defaults = {
+    "smallest_cog_position": [13, 17, 5],
+    "jockey_to_cog_links": [2, 3, 5],
+    "chain_max_free_yaw": [0.5, 2.5, 5],
+    "link_length": [util.link_length, util.link_length, 1]
+  }
+  for constant in swept_constants:
+    parser.add_argument(f"--{constant.replace('_', '-')}", type=float, nargs=3, metavar=("START", "STOP", "NUM"),
+                        default=defaults[constant], help=f"Values of util.{constant} to sweep, like numpy.linspace()")
+  parser.add_argument("--chunk-rows", type=int, default=20000,
+                      help="About how many triples to solve in each batch")
+  parser.add_argument("--output", default="sensitivity_sweep.json")
+  args = parser.parse_args()
+
+  grid = dict((constant, np.linspace(start, stop, int(num)).tolist())
+              for constant, (start, stop, num) in ((c, getattr(args, c)) for c in swept_constants))
+  baseline = dict((constant, getattr(util, constant)) for constant in swept_constants)
+
+  start = time.perf_counter()
+  results = sweep(Catalog(), grid, baseline, args.chunk_rows)
+  elapsed = time.perf_counter() - start
+
+  with open(args.output, "w") as f:
+    json.dump(results, f, indent=2)
+
+  combos = results["combos"]
+  print(f"{len(results['gridPoints'])} grid points x {len(combos)} triples in {elapsed:.1f} s")
+  print(f"Baseline: {results['baseline']['compatible']} compatible, "
+        f"maxChainAngleMax {results['baseline']['maxChainAngleMax']:.3f}")
+  for verdict in ["always compatible", "never compatible", "sensitive"]:
+    print(f"{verdict}: {sum(1 for c in combos if c['verdict'] == verdict)}")
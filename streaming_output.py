@@ -0,0 +1,88 @@
+import os
+import csv
+import json
+
+# Writers that write out results one item at a time, so a whole list never needs to be in memory.
+# The files come out the same as json.dump(items, f, indent=2) and csv.DictWriter would write them.
+# Each file is written to a temporary file that replaces it once it's complete, so a run that fails
+# partway leaves the previous results in place
+
+class JsonArrayWriter:
+  def __init__(self, file_name):
+    self.file_name = file_name
+    self.temp_file_name = file_name + ".tmp"
+    self.file = open(self.temp_file_name, "w")
+    self.count = 0
+
+  def write(self, item):
+    self.file.write("[\n  " if self.count == 0 else ",\n  ")
+    # Strings in JSON can't contain newlines, so every newline is indentation
+    self.file.write(json.dumps(item, indent=2).replace("\n", "\n  "))
+    self.count = self.count + 1
+
+  def close(self):
+    self.file.write("\n]" if self.count > 0 else "[]")
+    self.file.close()
+    os.replace(self.temp_file_name, self.file_name)
+
+  def abort(self):
+    self.file.close()
+    os.remove(self.temp_file_name)
+
+# Uses the keys of the first row as the header, like DictWriter(f, rows[0].keys())
+class CsvRowWriter:
+  def __init__(self, file_name):
+    self.file_name = file_name
+    self.temp_file_name = file_name + ".tmp"
+    self.file = open(self.temp_file_name, "w", newline='', encoding='utf-8')
+    self.writer = None
+    self.count = 0
+
+  def write(self, row):
+    if self.writer is None:
+      self.writer = csv.DictWriter(self.file, row.keys())
+      self.writer.writeheader()
+    self.writer.writerow(row)
+    self.count = self.count + 1
+
+  def close(self):
+    self.file.close()
+    os.replace(self.temp_file_name, self.file_name)
+
+  def abort(self):
+    self.file.close()
+    os.remove(self.temp_file_name)
+
+# One writer per result list, keyed by result name
+class ResultWriters:
+  def __init__(self, file_names_by_result):
+    self.writers = {}
+    try:
+      for name, file_name in file_names_by_result.items():
+        self.writers[name] = CsvRowWriter(file_name) if file_name.endswith(".csv") else JsonArrayWriter(file_name)
+    except:
+      self.abort()
+      raise
+
+  def write(self, results):
+    for name, writer in self.writers.items():
+      for item in results[name]:
+        writer.write(item)
+
+  def close(self):
+    for writer in self.writers.values():
+      writer.close()
+
+  # Removes the temporary files, leaving the previous results in place
+  def abort(self):
+    for writer in self.writers.values():
+      writer.abort()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is None:
+      self.close()
+    else:
+      self.abort()
@@ -0,0 +1,106 @@
+import numpy as np
+import json
+import os
+import shutil
+import argparse
+
+# Generates bigger catalogs for benchmarking, by adding perturbed copies of the real shifters,
+# derailleurs and cassettes. The real parts are always included unchanged, so the supported,
+# reviewed and equivalent combos still refer to parts that exist and stage 2 still works.
+
+# Files stage 2 and stage 3 read that are copied over as they are
+copied_file_names = [
+  "equivalent_shifters.json",
+  "equivalent_derailleurs.json",
+  "supported_combinations.json",
+  "reviewed_combinations.json",
+  "compatibility_ranges.json"
+]
+
+def perturb_shifter(shifter, rng, k):
+  shifter = dict(shifter)
+  # Scale the whole cable pull a little, then each shift a little less
+  scale = rng.normal(1, 0.02)
+  spacings = np.array(shifter["shiftSpacings"]) * scale * rng.normal(1, 0.005, len(shifter["shiftSpacings"]))
+  shifter["shiftSpacings"] = spacings.tolist()
+  shifter["cablePull"] = shifter["cablePull"] * scale
+  shifter["partNumber"] = f'{shifter["partNumber"]}-syn{k}'
+  shifter["name"] = f'{shifter["name"]} Synthetic {k}'
+  return shifter
+
+def perturb_derailleur(derailleur, rng, k):
+  derailleur = dict(derailleur)
+  # Scaling every coefficient but the constant scales the pull ratio along the whole curve
+  scale = rng.normal(1, 0.03)
+  coefficients = np.array(derailleur["coefficients"])
+  coefficients[1:] = coefficients[1:] * scale
+  derailleur["coefficients"] = coefficients.tolist()
+  derailleur["pullRatio"] = derailleur["pullRatio"] * scale
+
+  # Yaw coefficients are optional, so drop them from some derailleurs
+  if "yawCoefficients" in derailleur:
+    if rng.random() < 0.25:
+      del derailleur["yawCoefficients"]
+      derailleur.pop("yawNumberOfMeasurements", None)
+    else:
+      yaw_coefficients = np.array(derailleur["yawCoefficients"])
+      yaw_coefficients[1:] = yaw_coefficients[1:] * rng.normal(1, 0.1)
+      derailleur["yawCoefficients"] = yaw_coefficients.tolist()
+
+  derailleur["partNumber"] = f'{derailleur["partNumber"]}-syn{k}'
+  derailleur["name"] = f'{derailleur["name"]} Synthetic {k}'
+  return derailleur
+
+def perturb_cassette(cassette, rng, k):
+  cassette = dict(cassette)
+  pitches = np.array(cassette["pitches"]) * rng.normal(1, 0.01) * rng.normal(1, 0.003, len(cassette["pitches"]))
+  cassette["pitches"] = pitches.tolist()
+  cassette["averagePitch"] = float(np.mean(pitches))
+  cassette["partNumber"] = f'{cassette["partNumber"]}-syn{k}'
+  cassette["name"] = f'{cassette["name"]} Synthetic {k}'
+  return cassette
+
+# count parts, starting with the real ones and then cycling through perturbed copies of them
+def generate_parts(parts, count, perturb, rng):
+  return [parts[i] if i < len(parts) else perturb(parts[i % len(parts)], rng, i // len(parts))
+          for i in range(count)]
+
+# A catalog with about scale times as many (shifter, derailleur, cassette) triples as the real one,
+# by growing each kind of part by the cube root of scale
+def generate_catalog(source_folder, folder, scale, seed=0):
+  rng = np.random.default_rng(seed)
+  growth = scale ** (1 / 3)
+
+  def load(file_name):
+    with open(os.path.join(source_folder, file_name)) as f:
+      return json.load(f)
+
+  def save(file_name, parts):
+    with open(os.path.join(folder, file_name), "w") as f:
+      json.dump(parts, f, indent=2)
+
+  os.makedirs(folder, exist_ok=True)
+
+  catalog = {}
+  for file_name, perturb in [("all_shifters.json", perturb_shifter),
+                             ("all_derailleurs.json", perturb_derailleur),
+                             ("cassettes.json", perturb_cassette)]:
+    parts = load(file_name)
+    catalog[file_name] = generate_parts(parts, max(len(parts), round(len(parts) * growth)), perturb, rng)
+    save(file_name, catalog[file_name])
+
+  for file_name in copied_file_names:
+    shutil.copy(os.path.join(source_folder, file_name), folder)
+
+  return catalog
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("folder", help="Folder to write the catalog to")
+  parser.add_argument("--scale", type=float, default=10,
+                      help="About how many times as many triples as the real catalog to generate")
+  parser.add_argument("--seed", type=int, default=0)
+  args = parser.parse_args()
+
+  catalog = generate_catalog(".", args.folder, args.scale, args.seed)
+  print(", ".join(f"{len(parts)} in {file_name}" for file_name, parts in catalog.items()))
@@ -1,7 +1,12 @@
 import numpy as np
-from pydantic import BaseModel
-from typing import Iterable
 import math
+import os
+import csv
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+from pydantic import BaseModel
+from models import get_derailleur_model, get_shifter_model, get_cassette_model
+from inverse_curve import InverseCurve
 
 # Could calculate using dropout thickness (7 to 8 mm for shimano?) and then use the distance from 
 # end of cassette to dropout to figure out the first cog position, maybe
@@ -12,126 +17,405 @@ max_cable_pull = 50 # Assume that no shifter will be able to pull 50 mm of cable
 chain_max_free_yaw = 1.5
 link_length = 12.7
 
-def calculate_max_chain_angle(shifter, derailleur, cassette):
-  derailleur_curve = get_combined_pull_curve(derailleur)
-  shift_spacings = np.array(shifter["shiftSpacings"])
-  cassette_pitches = cassette["pitches"]
-  roller_cog_free_play = cassette["chainRollerWidth"] - cassette["cogWidth"]
-  num_positions = min([cassette["speeds"], shifter["speeds"]])
-
-  # Calculate barrel adjuster
-  barrel_adjuster = 0
-  barrel_adjuster_values = [barrel_adjuster]
-
-  # Use Newton's method to find the barrel adjuster amount that will minimize distance
-  # from jockey to cog for all shifts
-  for i in range(0, 5):
-    shift_positions = [barrel_adjuster + np.sum([shift_spacings[0:i]])
-                      for i in range(0, len(shift_spacings) + 1) ]
-    jockey_positions = derailleur_curve(shift_positions)
-    cog_positions = [smallest_cog_position + np.sum([cassette_pitches[0:i]])
-                    for i in range(0, len(cassette_pitches) + 1) ]
-    
-    diffs = cog_positions[1:num_positions - 1] - jockey_positions[1:num_positions - 1]
-    
-    average_diff = np.mean([diffs.min(), diffs.max()])
-
-    barrel_adjuster = barrel_adjuster + average_diff/derailleur["pullRatio"]
-    barrel_adjuster_values.append(barrel_adjuster)
-
-  # Review results
-  if np.abs(average_diff) > 0.1:
-    raise Exception("Failed to converge")
+def calculate_max_chain_angle(shifter, derailleur, cassette, **kwargs):
+  return calculate_max_chain_angles([shifter], [derailleur], [cassette], **kwargs)[0]
+
+# Pad ragged rows into a 2D array, along with a mask of which entries are real values.
+# A fill of None repeats the last value of each row
+def stack_rows(rows, fill=0.0):
+  rows = [np.asarray(r, dtype=float) for r in rows]
+  lengths = np.array([len(r) for r in rows])
+  mask = np.arange(lengths.max(initial=0)) < lengths[:, None]
+  stacked = np.full(mask.shape, 0.0 if fill is None else fill)
+  stacked[mask] = np.concatenate(rows) if len(rows) > 0 else []
+  if fill is None:
+    stacked = np.where(mask, stacked, stacked[np.arange(len(rows)), lengths - 1][:, None])
+  return stacked, mask
+
+# Compile each distinct part once, even when it shows up in many triples
+def get_models(parts, get_model):
+  models = {}
+  for part in parts:
+    if id(part) not in models:
+      models[id(part)] = get_model(part)
+  return [models[id(part)] for part in parts]
+
+# Evaluate one polynomial per row of x, using Horner's method like Polynomial.__call__()
+def polyval_rows(coefficients, x):
+  x = np.asarray(x, dtype=float)
+  shape = (-1,) + (1,) * (x.ndim - 1)
+  y = coefficients[:, -1].reshape(shape) + x*0
+  for i in range(coefficients.shape[1] - 2, -1, -1):
+    y = coefficients[:, i].reshape(shape) + y*x
+  return y
+
+def stack_derailleur_curves(derailleurs):
+  derailleurs = get_models(derailleurs, get_derailleur_model)
+  coefficients, _ = stack_rows([d.coefficients for d in derailleurs])
+  yaw_coefficients, _ = stack_rows([d.yaw_coefficients if d.yaw_coefficients is not None else [0]
+                                    for d in derailleurs])
+  return coefficients, yaw_coefficients
+
+# Reshape one value per row so it broadcasts against x like polyval_rows() does. None and
+# scalars are passed through
+def per_row(values, x):
+  if values is None or np.ndim(values) == 0:
+    return values
+  return np.asarray(values, dtype=float).reshape((-1,) + (1,) * (np.ndim(x) - 1))
+
+# Chance of landing at least distances away from the mean of a normal distribution, in either
+# direction. Same as 1 - norm.cdf(d, scale=stdev) + norm.cdf(-d, scale=stdev), to within rounding.
+# scipy.special is imported on first use, so scripts that never score confidence don't load it
+def calc_two_sided_confidences(distances, stdev):
+  from scipy.special import erfc
+  return erfc(np.abs(np.asarray(distances, dtype=float)) / (stdev * math.sqrt(2)))
+
+# Batched version of get_combined_pull_curve(). Derailleurs without yaw info have all-zero
+# yaw coefficients, which never leave the free yaw band. max_free_yaws and link_lengths
+# optionally override chain_max_free_yaw and link_length for each row
+def combined_pull_rows(coefficients, yaw_coefficients, x, max_free_yaws=None, link_lengths=None):
+  return polyval_rows(coefficients, x) + calc_jockey_offsets(polyval_rows(yaw_coefficients, x),
+                                                             per_row(max_free_yaws, x), per_row(link_lengths, x))
+
+# Derivative of each row's polynomial
+def deriv_rows(coefficients):
+  if coefficients.shape[1] == 1:
+    return np.zeros_like(coefficients)
+  return coefficients[:, 1:] * np.arange(1, coefficients.shape[1])
+
+# Batched version of get_combined_pull_ratio_curve()
+def combined_pull_ratio_rows(coefficients, yaw_coefficients, x, max_free_yaws=None, link_lengths=None):
+  return polyval_rows(deriv_rows(coefficients), x) \
+    + calc_jockey_offset_rates(polyval_rows(yaw_coefficients, x), polyval_rows(deriv_rows(yaw_coefficients), x),
+                               per_row(max_free_yaws, x), per_row(link_lengths, x))
+
+class BarrelAdjusterSolution(NamedTuple):
+  barrel_adjuster: np.ndarray
+  # Every barrel adjuster value tried for each triple, starting at 0
+  barrel_adjuster_values: list
+  iterations: np.ndarray
+  converged: np.ndarray
+  average_diff: np.ndarray
+  # Positions and jockey/cog diffs from the last curve evaluation of each triple
+  shift_positions: np.ndarray
+  jockey_positions: np.ndarray
+  diffs: np.ndarray
+
+# Find the barrel adjuster amount that minimizes the distance from jockey to cog over all of
+# the inner shifts, for every triple in the batch.
+#
+# method="pull_ratio" is the original solver: exactly five steps of average_diff/pullRatio,
+# which counts as converged if the last average diff was within 0.1 mm. Its diffs come from the
+# evaluation before the last step.
+#
+# method="newton" steps with the local slope of the combined pull curve at the shifts with the
+# smallest and biggest diffs, and stops iterating each triple as soon as its average diff is
+# within tolerance. Triples that don't get there within max_iterations steps are reported as
+# not converged instead of raising.
+#
+# max_free_yaws and link_lengths optionally give each triple its own chain_max_free_yaw and link_length.
+def solve_barrel_adjusters(cumulative_shift_spacings, cog_positions, inner_mask, coefficients,
+                           yaw_coefficients, pull_ratios, method="newton", tolerance=1e-6,
+                           max_iterations=20, max_free_yaws=None, link_lengths=None):
+  n = len(cumulative_shift_spacings)
+  width = inner_mask.shape[1]
+  barrel_adjuster = np.zeros(n)
+  barrel_adjuster_values = [[0] for _ in range(n)]
+  iterations = np.zeros(n, dtype=int)
+  converged = np.zeros(n, dtype=bool)
+  average_diff = np.zeros(n)
+  shift_positions = np.zeros(cumulative_shift_spacings.shape)
+  jockey_positions = np.zeros(cumulative_shift_spacings.shape)
+  diffs = np.zeros((n, width))
+
+  if method == "pull_ratio":
+    num_evaluations = 5
+  elif method == "newton":
+    num_evaluations = max_iterations + 1
+  else:
+    raise Exception(f"Unknown barrel adjuster method {method}")
+
+  if max_free_yaws is not None:
+    max_free_yaws = np.broadcast_to(np.asarray(max_free_yaws, dtype=float), (n,))
+  if link_lengths is not None:
+    link_lengths = np.broadcast_to(np.asarray(link_lengths, dtype=float), (n,))
+
+  def rows(values, active):
+    return values[active] if values is not None else None
+
+  active = np.arange(n)
+
+  for iteration in range(0, num_evaluations):
+    shift_positions[active] = barrel_adjuster[active, None] + cumulative_shift_spacings[active]
+    jockey_positions[active] = combined_pull_rows(coefficients[active], yaw_coefficients[active],
+                                                  shift_positions[active], rows(max_free_yaws, active),
+                                                  rows(link_lengths, active))
+    diffs[active] = cog_positions[active, :width] - jockey_positions[active, :width]
+
+    active_mask = inner_mask[active]
+    lowest = np.where(active_mask, diffs[active], np.inf).argmin(axis=1)
+    highest = np.where(active_mask, diffs[active], -np.inf).argmax(axis=1)
+    average_diff[active] = (diffs[active, lowest] + diffs[active, highest])/2
+
+    if method == "pull_ratio":
+      step = average_diff[active]/pull_ratios[active]
+    else:
+      done = np.abs(average_diff[active]) <= tolerance
+      converged[active[done]] = True
+      if iteration == max_iterations:
+        break
+
+      active, lowest, highest = active[~done], lowest[~done], highest[~done]
+      if len(active) == 0:
+        break
+
+      # Newton step using the slope at the two shifts that set average_diff
+      slope = (combined_pull_ratio_rows(coefficients[active], yaw_coefficients[active],
+                                        shift_positions[active, lowest], rows(max_free_yaws, active),
+                                        rows(link_lengths, active))
+               + combined_pull_ratio_rows(coefficients[active], yaw_coefficients[active],
+                                          shift_positions[active, highest], rows(max_free_yaws, active),
+                                          rows(link_lengths, active)))/2
+      slope = np.where(np.isfinite(slope) & (slope > 0), slope, pull_ratios[active])
+      step = average_diff[active]/slope
+
+    barrel_adjuster[active] = barrel_adjuster[active] + step
+    iterations[active] = iterations[active] + 1
+    for i, value in zip(active.tolist(), barrel_adjuster[active].tolist()):
+      barrel_adjuster_values[i].append(value)
+
+  if method == "pull_ratio":
+    converged = np.abs(average_diff) <= 0.1
+
+  return BarrelAdjusterSolution(barrel_adjuster, barrel_adjuster_values, iterations, converged,
+                                average_diff, shift_positions, jockey_positions, diffs)
+
+def get_inverse_pull_curve(derailleur):
+  derailleur = get_derailleur_model(derailleur)
+  if derailleur.inverse_pull_curve is None:
+    derailleur.inverse_pull_curve = InverseCurve(derailleur.pull_curve, 0, max_cable_pull)
+  return derailleur.inverse_pull_curve
+
+# Solve for the cable pull of each derailleur/jockey position pair, grouping the
+# jockey positions by derailleur so each derailleur's inverse curve is solved once
+def solve_cable_pulls(derailleurs, jockey_positions):
+  jockey_positions = np.asarray(jockey_positions, dtype=float)
+  cable_pulls = np.full(len(derailleurs), np.nan)
+  num_solutions = np.zeros(len(derailleurs), dtype=int)
+
+  rows_by_derailleur = {}
+  for i, derailleur in enumerate(derailleurs):
+    rows_by_derailleur.setdefault(id(derailleur), (derailleur, []))[1].append(i)
+
+  for derailleur, rows in rows_by_derailleur.values():
+    result = get_inverse_pull_curve(derailleur).solve(jockey_positions[rows])
+    cable_pulls[rows] = result.x
+    num_solutions[rows] = result.num_solutions
+
+  return cable_pulls, num_solutions
+
+def warn_cable_pull_solutions(derailleur, jockey_position, num_solutions):
+  if num_solutions == 0:
+    print(f"Warning: no valid cable pull values for jockey position {jockey_position} on {derailleur['partNumber']}.")
+  elif num_solutions > 1:
+    # Just warn, and use the smallest valid cable pull instead of throwing an error
+    print(f"Warning: too many cable pull values for jockey position {jockey_position} on {derailleur['partNumber']}.", num_solutions)
+
+# Batched version of get_cable_pull_for_jockey_position()
+def get_cable_pulls_for_jockey_positions(derailleurs, jockey_positions, warn=True):
+  cable_pulls, num_solutions = solve_cable_pulls(derailleurs, jockey_positions)
+
+  if warn:
+    for i in np.flatnonzero(num_solutions != 1):
+      warn_cable_pull_solutions(derailleurs[i], jockey_positions[i], num_solutions[i])
+
+  # Return -1 since we flag negative values as invalid anyway
+  return np.where(num_solutions > 0, cable_pulls, -1)
+
+# Each row's diffs less the play between the chain rollers and the cog, and the chain angle that leaves.
+# jockey_to_cog_distances can be a scalar or one value per row
+def get_chain_angle_rows(diffs, roller_cog_free_play, jockey_to_cog_distances=jockey_to_cog_distance):
+  half_free_play = (roller_cog_free_play/2)[:, None]
+  diffs_minus_free_play = np.where(np.abs(diffs) < half_free_play, 0,
+                                   np.where(diffs > 0, diffs - half_free_play, diffs + half_free_play))
+  # Padding and rows that didn't converge can be out of arcsin's domain. They come out as NaN and are
+  # masked off by the callers, so they don't need a warning
+  with np.errstate(invalid="ignore"):
+    chain_angles = np.arcsin(diffs_minus_free_play/per_row(jockey_to_cog_distances, diffs_minus_free_play)) * 180 / np.pi
+  return diffs_minus_free_play, chain_angles
+
+# Calculate max chain angle for many shifter/derailleur/cassette triples at once, as arrays with
+# one row per triple. See calculate_max_chain_angles() for the arguments.
+#
+# smallest_cog_positions, jockey_to_cog_links_values, max_free_yaws and link_lengths optionally give
+# each triple its own value of the module constant they're named after, as a scalar or one value per
+# triple. warn=False skips the warnings about cable pulls without exactly one solution
+def calculate_max_chain_angle_arrays(shifters, derailleurs, cassettes, method="newton", tolerance=1e-6,
+                                     max_iterations=20, smallest_cog_positions=None,
+                                     jockey_to_cog_links_values=None, max_free_yaws=None, link_lengths=None,
+                                     warn=True):
+  shifters = get_models(shifters, get_shifter_model)
+  derailleurs = get_models(derailleurs, get_derailleur_model)
+  cassettes = get_models(cassettes, get_cassette_model)
+
+  smallest_cog_positions = smallest_cog_position if smallest_cog_positions is None else smallest_cog_positions
+  jockey_to_cog_distances = jockey_to_cog_distance if jockey_to_cog_links_values is None \
+    else np.asarray(jockey_to_cog_links_values, dtype=float) * 25.4 / 2
+
+  # Positions relative to the first shift/smallest cog, with padding repeating the last position
+  cumulative_shift_spacings, shift_positions_mask = stack_rows([s.shift_positions for s in shifters], fill=None)
+  cog_positions, cog_positions_mask = stack_rows([c.cog_positions for c in cassettes], fill=None)
+  cog_positions = per_row(smallest_cog_positions, cog_positions) + cog_positions
+  cassette_pitches, _ = stack_rows([c.pitches for c in cassettes])
+  coefficients, yaw_coefficients = stack_derailleur_curves(derailleurs)
+  pull_ratios = np.array([d["pullRatio"] for d in derailleurs])
+  roller_cog_free_play = np.array([c["chainRollerWidth"] - c["cogWidth"] for c in cassettes])
+  num_positions = np.minimum([c["speeds"] for c in cassettes], [s["speeds"] for s in shifters])
+  physical_high_limits = np.array([d.physical_high_limit for d in derailleurs])
+  physical_low_limits = np.array([d.physical_low_limit for d in derailleurs])
+  rows = np.arange(len(shifters))
+
+  # Only compare the inner positions, like calculate_max_chain_angle() always has
+  width = min(cumulative_shift_spacings.shape[1], cog_positions.shape[1])
+  columns = np.arange(width)
+  inner_mask = (columns >= 1) & (columns < num_positions[:, None] - 1)
+
+  solution = solve_barrel_adjusters(cumulative_shift_spacings, cog_positions, inner_mask, coefficients,
+                                    yaw_coefficients, pull_ratios, method, tolerance, max_iterations,
+                                    max_free_yaws, link_lengths)
+  barrel_adjuster = solution.barrel_adjuster
+  shift_positions = solution.shift_positions
+  jockey_positions = solution.jockey_positions
+  diffs = solution.diffs
 
   barrel_adjuster_too_low = barrel_adjuster < 0
 
-  diffs_minus_free_play = np.array([(
-      0 if abs(d) < roller_cog_free_play/2
-      else (
-        d - roller_cog_free_play/2 if d > 0
-        else d + roller_cog_free_play/2
-      )
-    )
-    for d in diffs])
-  
-  max_diff_minus_free_play = max(np.abs([diffs_minus_free_play.min(), diffs_minus_free_play.max()]))
+  diffs_minus_free_play, chain_angles = get_chain_angle_rows(diffs, roller_cog_free_play, jockey_to_cog_distances)
 
-  chain_angles = np.arcsin(diffs_minus_free_play/jockey_to_cog_distance) * 180 / np.pi
+  max_diff_minus_free_play = np.maximum(np.abs(np.where(inner_mask, diffs_minus_free_play, np.inf).min(axis=1)),
+                                        np.abs(np.where(inner_mask, diffs_minus_free_play, -np.inf).max(axis=1)))
 
-  max_chain_angle = chain_angles.max()
+  max_chain_angle_index = np.where(inner_mask, chain_angles, -np.inf).argmax(axis=1)
+  max_chain_angle = chain_angles[rows, max_chain_angle_index]
 
-  cable_pull_at_max_chain_angle = shift_positions[chain_angles.argmax() + 1]
+  cable_pull_at_max_chain_angle = shift_positions[rows, max_chain_angle_index]
 
   # Calculate end jockey positions based on second smallest or second biggest positions, plus the cog pitch
   # Yeah, this ignores the motion multiplier, but it shouldn't affect the pull too low or pull too high determinations
-  least_pull = get_cable_pull_for_jockey_position(derailleur,
-                                                  jockey_positions[1] - cassette_pitches[0])
+  num_shift_spacings = shift_positions_mask.sum(axis=1) - 1
+  num_pitches = cog_positions_mask.sum(axis=1) - 1
+  least_pull = get_cable_pulls_for_jockey_positions(derailleurs,
+                                                    jockey_positions[:, 1] - cassette_pitches[:, 0], warn)
   least_pull_too_low = least_pull < 0
-  most_pull = get_cable_pull_for_jockey_position(derailleur,
-                                                 jockey_positions[-2] + cassette_pitches[-1])
-  most_pull_too_high = derailleur_curve(most_pull) > derailleur["physicalHighLimit"]
-  most_pull_jockey_position_diff = derailleur["physicalHighLimit"] - derailleur_curve(most_pull)
-  cassette_total_pitch = max(cog_positions) - min(cog_positions)
-  derailleur_range_of_motion = derailleur["physicalHighLimit"] - derailleur["physicalLowLimit"]
+  most_pull = get_cable_pulls_for_jockey_positions(derailleurs,
+                                                   jockey_positions[rows, num_shift_spacings - 1]
+                                                   + cassette_pitches[rows, num_pitches - 1], warn)
+  most_pull_jockey_position = combined_pull_rows(coefficients, yaw_coefficients, most_pull, max_free_yaws,
+                                                 link_lengths)
+  most_pull_too_high = most_pull_jockey_position > physical_high_limits
+  most_pull_jockey_position_diff = physical_high_limits - most_pull_jockey_position
+  cassette_total_pitch = cog_positions[rows, num_pitches] - cog_positions[:, 0]
+  derailleur_range_of_motion = physical_high_limits - physical_low_limits
   derailleur_can_clear_cassette = derailleur_range_of_motion * 1.03 > cassette_total_pitch
 
   return {
-    "barrel_adjuster": barrel_adjuster,
-    "barrel_adjuster_values": barrel_adjuster_values,
-    "barrel_adjuster_too_low": bool(barrel_adjuster_too_low),
+    "solution": solution,
+    "inner_mask": inner_mask,
+    "barrel_adjuster_too_low": barrel_adjuster_too_low,
     "least_pull": least_pull,
-    "least_pull_too_low": bool(least_pull_too_low),
+    "least_pull_too_low": least_pull_too_low,
     "most_pull": most_pull,
-    "most_pull_too_high": bool(most_pull_too_high),
+    "most_pull_too_high": most_pull_too_high,
     "most_pull_jockey_position_diff": most_pull_jockey_position_diff,
     "cassette_total_pitch": cassette_total_pitch,
     "derailleur_range_of_motion": derailleur_range_of_motion,
-    "derailleur_can_clear_cassette": bool(derailleur_can_clear_cassette),
-    "diffs": diffs.tolist(),
-    "diffs_minus_free_play": diffs_minus_free_play.tolist(),
-    "max_diff_minus_free_play": float(max_diff_minus_free_play),
-    "max_chain_angle": float(max_chain_angle),
+    "derailleur_can_clear_cassette": derailleur_can_clear_cassette,
+    "diffs_minus_free_play": diffs_minus_free_play,
+    "max_diff_minus_free_play": max_diff_minus_free_play,
+    "chain_angles": chain_angles,
+    "max_chain_angle": max_chain_angle,
     "cable_pull_at_max_chain_angle": cable_pull_at_max_chain_angle,
-    "jockey_to_cog_links": jockey_to_cog_links,
-    "chain_angles": chain_angles.tolist()
+    "jockey_to_cog_links": np.broadcast_to(jockey_to_cog_links if jockey_to_cog_links_values is None
+                                           else jockey_to_cog_links_values, (len(shifters),))
   }
 
+# Calculate max chain angle for many shifter/derailleur/cassette triples at once.
+# The three lists are parallel, with one triple per index. See solve_barrel_adjusters() for
+# the barrel adjuster options. Triples whose barrel adjuster didn't converge have
+# barrel_adjuster_converged set to False rather than raising an exception
+def calculate_max_chain_angles(shifters, derailleurs, cassettes, method="newton", tolerance=1e-6,
+                               max_iterations=20, warn=True):
+  if len(shifters) == 0:
+    return []
+
+  arrays = calculate_max_chain_angle_arrays(shifters, derailleurs, cassettes, method, tolerance, max_iterations,
+                                            warn=warn)
+  solution = arrays["solution"]
+  inner_mask = arrays["inner_mask"]
+  barrel_adjuster_values = solution.barrel_adjuster_values
+  least_pull = arrays["least_pull"]
+  most_pull = arrays["most_pull"]
+  least_pull_found = least_pull != -1
+  most_pull_found = most_pull != -1
+
+  return [{
+    "barrel_adjuster": barrel_adjuster_values[i][-1],
+    "barrel_adjuster_values": barrel_adjuster_values[i],
+    "barrel_adjuster_iterations": int(solution.iterations[i]),
+    "barrel_adjuster_converged": bool(solution.converged[i]),
+    "barrel_adjuster_too_low": bool(arrays["barrel_adjuster_too_low"][i]),
+    "least_pull": float(least_pull[i]) if least_pull_found[i] else -1,
+    "least_pull_too_low": bool(arrays["least_pull_too_low"][i]),
+    "most_pull": float(most_pull[i]) if most_pull_found[i] else -1,
+    "most_pull_too_high": bool(arrays["most_pull_too_high"][i]),
+    "most_pull_jockey_position_diff": float(arrays["most_pull_jockey_position_diff"][i]),
+    "cassette_total_pitch": float(arrays["cassette_total_pitch"][i]),
+    "derailleur_range_of_motion": float(arrays["derailleur_range_of_motion"][i]),
+    "derailleur_can_clear_cassette": bool(arrays["derailleur_can_clear_cassette"][i]),
+    "diffs": solution.diffs[i, inner_mask[i]].tolist(),
+    "diffs_minus_free_play": arrays["diffs_minus_free_play"][i, inner_mask[i]].tolist(),
+    "max_diff_minus_free_play": float(arrays["max_diff_minus_free_play"][i]),
+    "max_chain_angle": float(arrays["max_chain_angle"][i]),
+    "cable_pull_at_max_chain_angle": float(arrays["cable_pull_at_max_chain_angle"][i]),
+    "jockey_to_cog_links": jockey_to_cog_links,
+    "chain_angles": arrays["chain_angles"][i, inner_mask[i]].tolist()
+  } for i in range(len(shifters))]
+
 def get_cable_pull_for_jockey_position(derailleur, jockey_position):
-  derailleur_curve = np.polynomial.Polynomial(coef=derailleur["coefficients"])
-  roots = (derailleur_curve - jockey_position).roots()
-
-  valid_roots = [r for r in roots
-                if r > 0 and r < max_cable_pull
-                  and np.iscomplex(r) == False  # Don't consider complex results
-                  # Commented out because this fails for SRAM GX 10-speed
-                  #and derailleur_curve(r) <= derailleur["physicalHighLimit"]]
-                ]
-  
+  result = get_inverse_pull_curve(derailleur).solve(jockey_position)
+  warn_cable_pull_solutions(derailleur, jockey_position, result.num_solutions)
+
   # Return -1 since we flag negative values as invalid anyway
-  if len(valid_roots) == 0:
-    print(f"Warning: no valid cable pull values for jockey position {jockey_position} on {derailleur['partNumber']}.", roots)
+  if result.no_solution:
     return -1
-  
-  # Just warn, and return the smallest valid root instead of throwing an error
-  if len(valid_roots) > 1:
-    print(f"Warning: too many cable pull values for jockey position {jockey_position} on {derailleur['partNumber']}.", valid_roots)
 
-  return np.min(valid_roots)
+  return result.x[()]
+
 
+# Reads a CSV into a dict of columns, skipping blank lines like csv.DictReader does. Columns of numbers
+# become float arrays, with empty cells as NaN, and any other column, like a note, an array of strings.
+# A transposed CSV has a column in each row, with its name in the first cell
+def read_csv_columns(input_file, transposed=False):
+  with open(input_file, newline='') as csvfile:
+    return parse_csv_columns(csvfile, transposed)
 
-def convert_to_floats(data):
-  # Convert to numbers
-  for row in data:
-    for key in row.keys():
-      if len(row[key]) == 0:
-        row[key] = np.nan
-      else:
-        try:
-          row[key] = float(row[key])
-        except:
-          # Ignore failed conversion attempts
-          pass
+def parse_csv_columns(lines, transposed=False):
+  rows = [row for row in csv.reader(lines) if row]
 
+  if transposed:
+    header = [row[0] for row in rows]
+    column_values = [row[1:len(rows[0])] for row in rows]
+  else:
+    header = rows[0]
+    column_values = list(zip(*rows[1:])) or [()] * len(header)
+
+  columns = {}
+  for name, values in zip(header, column_values):
+    try:
+      columns[name] = np.array([float(v) if v else math.nan for v in values], dtype=float)
+    except ValueError:
+      columns[name] = np.array(values, dtype=str)
+  return columns
 
 class PullRatioInfo(BaseModel):
   dropout_width: float
@@ -162,32 +446,27 @@ def calc_pull_ratio(info, coefficients, max_pull):
 
   second_biggest_cog_position = second_smallest_cog_position + total_pitch_inner_cogs
 
-  curve = np.polynomial.polynomial.Polynomial(coefficients)
+  # Accept an already built curve, like DerailleurModel.pull_curve
+  if isinstance(coefficients, np.polynomial.Polynomial):
+    curve = coefficients
+  else:
+    curve = np.polynomial.polynomial.Polynomial(coefficients)
+
+  cog_positions = [small_cog_position, second_smallest_cog_position,
+                   second_biggest_cog_position, biggest_cog_position]
+  cog_pulls = InverseCurve(curve, 0, max_cable_pull).solve(cog_positions)
 
-  smallest_cog_pull = [r for r in (curve - small_cog_position).roots() if r >= 0][0]
-  if smallest_cog_pull > max_pull:
-    print(f"Warning: smallest_cog_pull {smallest_cog_pull} > max_pull {max_pull}", (curve - small_cog_position).roots())
-    print("dropout_width", dropout_width)
-    print("small_cog_offset", small_cog_offset)
+  for name, position, pull, no_solution in zip(
+      ["smallest_cog_pull", "second_smallest_cog_pull", "second_biggest_cog_pull", "biggest_cog_pull"],
+      cog_positions, cog_pulls.x, cog_pulls.no_solution):
+    if no_solution:
+      raise Exception(f"No cable pull between 0 and {max_cable_pull} reaches {name.replace('_pull', '')} position {position}")
+    if pull > max_pull:
+      print(f"Warning: {name} {pull} > max_pull {max_pull}")
+      print("dropout_width", dropout_width)
+      print("small_cog_offset", small_cog_offset)
 
-  second_smallest_cog_pull = [r for r in (curve - second_smallest_cog_position).roots() if r >= 0][0]
-  if second_smallest_cog_pull > max_pull:
-    print(f"Warning: second_smallest_cog_pull {second_smallest_cog_pull} > max_pull {max_pull}", (curve - second_smallest_cog_position).roots())
-    print("dropout_width", dropout_width)
-    print("small_cog_offset", small_cog_offset)
-  
-  second_biggest_cog_pull = [r for r in (curve - second_biggest_cog_position).roots() if r >= 0][0]
-  if second_biggest_cog_pull > max_pull:
-    print(f"Warning: second_biggest_cog_pull {second_biggest_cog_pull} > max_pull {max_pull}",(curve - second_biggest_cog_position).roots())
-    print("dropout_width", dropout_width)
-    print("small_cog_offset", small_cog_offset)
-
-  biggest_cog_pull = [r for r in (curve - biggest_cog_position).roots() if r >= 0][0]
-  if biggest_cog_pull > max_pull:
-    print(f"Warning: biggest_cog_pull {biggest_cog_pull} > max_pull {max_pull}",(curve - biggest_cog_position).roots())
-    print("dropout_width", dropout_width)
-    print("small_cog_offset", small_cog_offset)
-  
+  smallest_cog_pull, second_smallest_cog_pull, second_biggest_cog_pull, biggest_cog_pull = cog_pulls.x
 
   pull_ratio = total_pitch_inner_cogs/(second_biggest_cog_pull - second_smallest_cog_pull)
 
@@ -205,23 +484,34 @@ def calc_pull_ratio(info, coefficients, max_pull):
     coefficients=[float(c) for c in curve.convert().coef]
     )
 
-def get_jockey_offset_curve(yaw_angle_curve):
+# Yaw within the chain's free yaw doesn't move the chain, so only yaw
+# beyond chain_max_free_yaw (in either direction) offsets the jockey.
+# max_free_yaw and link override chain_max_free_yaw and link_length, with anything that broadcasts
+# against yaw_angles
+def calc_yaw_beyond_free_yaw(yaw_angles, max_free_yaw=None):
+  max_free_yaw = chain_max_free_yaw if max_free_yaw is None else max_free_yaw
+  yaw_angles = np.asarray(yaw_angles, dtype=float)
+  outside_free_yaw = np.abs(yaw_angles) > max_free_yaw
+  return np.where(outside_free_yaw, yaw_angles - np.copysign(max_free_yaw, yaw_angles), 0), outside_free_yaw
+
+# Works on scalars and arrays alike, returning the same shape as yaw_angles
+def calc_jockey_offsets(yaw_angles, max_free_yaw=None, link=None):
+  link = link_length if link is None else link
+  beyond_free_yaw, outside_free_yaw = calc_yaw_beyond_free_yaw(yaw_angles, max_free_yaw)
+  return np.where(outside_free_yaw, np.sin(beyond_free_yaw/180*np.pi) * link, 0)[()]
+
+# Differentiate calc_jockey_offsets() using chain rule
+def calc_jockey_offset_rates(yaw_angles, yaw_angle_rates, max_free_yaw=None, link=None):
+  link = link_length if link is None else link
+  beyond_free_yaw, outside_free_yaw = calc_yaw_beyond_free_yaw(yaw_angles, max_free_yaw)
+  return np.where(outside_free_yaw,
+                  np.cos(beyond_free_yaw/180*np.pi) * link * yaw_angle_rates / 180 * np.pi,
+                  0)[()]
 
-  def calc_yaw_offset_curve(x):
-    y = yaw_angle_curve(x)
+def get_jockey_offset_curve(yaw_angle_curve):
 
-    if y < -chain_max_free_yaw:
-      return math.sin((y + chain_max_free_yaw)/180*math.pi) * link_length
-    elif y > chain_max_free_yaw:
-      return math.sin((y - chain_max_free_yaw)/180*math.pi) * link_length
-    else:
-      return 0
-  
   def yaw_offset_curve(x):
-    if isinstance(x, Iterable):
-      return np.array([calc_yaw_offset_curve(_x) for _x in x])
-    else:
-      return calc_yaw_offset_curve(x)
+    return calc_jockey_offsets(yaw_angle_curve(x))
 
   return yaw_offset_curve
 
@@ -230,54 +520,53 @@ def get_jockey_offset_rate_curve(yaw_angle_curve):
   
   deriv = yaw_angle_curve.deriv()
   
-  def calc_yaw_offset_rate_curve(x):
-    y = yaw_angle_curve(x)
-
-    if y < -chain_max_free_yaw:
-      return math.cos((y + chain_max_free_yaw)/180*math.pi) * link_length * deriv(x) / 180 * math.pi
-    elif y > chain_max_free_yaw:
-      return math.cos((y - chain_max_free_yaw)/180*math.pi) * link_length * deriv(x) / 180 * math.pi
-    else:
-      return 0
-  
   def yaw_offset_rate_curve(x):
-    if isinstance(x, Iterable):
-      return np.array([calc_yaw_offset_rate_curve(_x) for _x in x])
-    else:
-      return calc_yaw_offset_rate_curve(x)
+    return calc_jockey_offset_rates(yaw_angle_curve(x), deriv(x))
 
   return yaw_offset_rate_curve
 
 def get_combined_pull_curve(info):
-  pull_curve = np.polynomial.polynomial.Polynomial(info["coefficients"])
+  derailleur = get_derailleur_model(info)
+  pull_curve = derailleur.pull_curve
 
-  if "yawCoefficients" not in info:
+  if derailleur.yaw_angle_curve is None:
     return pull_curve
 
-  yaw_angle_curve = np.polynomial.polynomial.Polynomial(info["yawCoefficients"])
-  jockey_offset_curve = get_jockey_offset_curve(yaw_angle_curve)
+  yaw_angle_curve = derailleur.yaw_angle_curve
 
   def combined_pull_curve(x):
-    if isinstance(x, Iterable):
-      return np.array([pull_curve(_x) + jockey_offset_curve(_x) for _x in x])
-    else:
-      return pull_curve(x) + jockey_offset_curve(x)
+    return pull_curve(x) + calc_jockey_offsets(yaw_angle_curve(x))
   
   return combined_pull_curve
 
 def get_combined_pull_ratio_curve(info):
-  pull_curve = np.polynomial.polynomial.Polynomial(info["coefficients"])
+  derailleur = get_derailleur_model(info)
+  pull_ratio_curve = derailleur.pull_ratio_curve
 
-  if "yawCoefficients" not in info:
-    return pull_curve.deriv()
+  if derailleur.yaw_angle_curve is None:
+    return pull_ratio_curve
 
-  yaw_angle_curve = np.polynomial.polynomial.Polynomial(info["yawCoefficients"])
-  jockey_offset_rate_curve = get_jockey_offset_rate_curve(yaw_angle_curve)
+  yaw_angle_curve = derailleur.yaw_angle_curve
+  yaw_angle_rate_curve = derailleur.yaw_angle_rate_curve
 
   def combined_pull_ratio_curve(x):
-    if isinstance(x, Iterable):
-      return np.array([pull_curve(_x) + jockey_offset_rate_curve(_x) for _x in x])
-    else:
-      return pull_curve(x) + jockey_offset_rate_curve(x)
+    return pull_ratio_curve(x) + calc_jockey_offset_rates(yaw_angle_curve(x), yaw_angle_rate_curve(x))
   
-  return combined_pull_ratio_curve
\ No newline at end of file
+  return combined_pull_ratio_curve
+
+# Part folders (derailleurs/, shifters/) in a stable order, case-insensitively sorted like the all_*.json
+# files have always been, rather than whatever order os.listdir() happens to give
+def list_part_folders(folder):
+  return sorted((d for d in os.listdir(folder) if d != "template"), key=str.lower)
+
+# Like list(map()), but spread over that many worker processes when jobs > 1. Results come back in
+# the order of the inputs either way, so anything merged from them doesn't depend on the job count.
+# initializer(*initargs) runs in each worker first, or in this process when running serially
+def map_jobs(function, *iterables, jobs=1, initializer=None, initargs=()):
+  if jobs > 1:
+    with ProcessPoolExecutor(max_workers=jobs, initializer=initializer, initargs=initargs) as executor:
+      return list(executor.map(function, *iterables))
+
+  if initializer is not None:
+    initializer(*initargs)
+  return list(map(function, *iterables))